@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import zlib
+
+# Deterministic stand-in for the mp3gain binary, printing the same tab separated output as 'mp3gain -o'.
+# Set PYMP3GAIN_FAKE_LATENCY to the number of seconds to spend per file.
+# Apply and undo rewrite the file (unchanged) after printing its result line like mp3gain does, through a temporary
+# file with -t; set PYMP3GAIN_FAKE_WRITE_LATENCY to the number of seconds a rewrite takes.
+
+VERSION = "1.6.2"
+TRACK_HEADER = "File\tMP3 gain\tdB gain\tMax Amplitude\tMax global_gain\tMin global_gain"
+STORED_HEADER = TRACK_HEADER + "\tAlbum gain\tAlbum dB gain\tAlbum Max Amplitude\tAlbum Max global_gain\t" \
+                               "Album Min global_gain"
+UNDO_HEADER = "File\tleft global_gain change\tright global_gain change"
+MP3_GAIN_STEP_DB = 1.50515
+
+
+def get_values(mp3_file):
+    file_hash = zlib.crc32(mp3_file.encode('utf8'))
+    db_gain = (file_hash % 2000) / 100.0 - 10.0
+    max_amplitude = 20000.0 + file_hash % 15000
+    max_global_gain = 150 + file_hash % 50
+    min_global_gain = 100 + file_hash % 40
+
+    return db_gain, max_amplitude, max_global_gain, min_global_gain
+
+
+def get_arguments(argv):
+    options = dict()
+    files = []
+
+    idx = 0
+    while idx < len(argv):
+        arg = argv[idx]
+        if arg in ["-s", "-d"]:
+            options[arg] = argv[idx + 1]
+            idx = idx + 1
+        elif arg.startswith("-"):
+            options[arg] = True
+        else:
+            files.append(arg)
+        idx = idx + 1
+
+    return options, files
+
+
+def get_temp_file(mp3_file):
+    if mp3_file[-3:].lower() == "tmp":
+        return mp3_file + ".TMP"
+
+    return mp3_file[:-3] + "TMP"
+
+
+def rewrite_file(mp3_file, use_temp_file, latency):
+    with open(mp3_file, "rb") as f:
+        data = f.read()
+
+    if not use_temp_file:
+        time.sleep(latency)
+        with open(mp3_file, "wb") as f:
+            f.write(data)
+        return
+
+    temp_file = get_temp_file(mp3_file)
+    with open(temp_file, "wb") as f:
+        f.write(data[:len(data) // 2])
+        f.flush()
+        time.sleep(latency)
+        f.write(data[len(data) // 2:])
+
+    os.remove(mp3_file)
+    os.rename(temp_file, mp3_file)
+
+
+def main():
+    options, files = get_arguments(sys.argv[1:])
+    latency = float(os.environ.get("PYMP3GAIN_FAKE_LATENCY", "0"))
+    write_latency = float(os.environ.get("PYMP3GAIN_FAKE_WRITE_LATENCY", "0"))
+
+    if "-v" in options:
+        sys.stderr.write("{} version {}\n".format(sys.argv[0], VERSION))
+        return
+
+    stored_only = options.get("-s") == "c"
+    delete_tags = options.get("-s") == "d"
+    apply_gain = "-r" in options or "-a" in options
+    use_temp_file = "-t" in options
+    db_modifier = float(options.get("-d", 0))
+
+    if stored_only:
+        print(STORED_HEADER)
+    elif "-u" in options:
+        print(UNDO_HEADER)
+    else:
+        print(TRACK_HEADER)
+
+    for mp3_file in files:
+        if latency > 0:
+            time.sleep(latency)
+
+        db_gain, max_amplitude, max_global_gain, min_global_gain = get_values(mp3_file)
+
+        if delete_tags:
+            sys.stderr.write("Deleting tag info of {}...\n".format(mp3_file))
+        elif "-u" in options:
+            print("{}\t{}\t{}".format(mp3_file, -2, -2))
+        elif stored_only:
+            mp3_gain = round(db_gain / MP3_GAIN_STEP_DB)
+            print("{}\t{}\t{:f}\t{:f}\t{}\t{}\tNA\tNA\tNA\tNA\tNA".format(mp3_file, mp3_gain, db_gain, max_amplitude,
+                                                                          max_global_gain, min_global_gain))
+        else:
+            db_gain = db_gain + db_modifier
+            mp3_gain = round(db_gain / MP3_GAIN_STEP_DB)
+            print("{}\t{}\t{:f}\t{:f}\t{}\t{}".format(mp3_file, mp3_gain, db_gain, max_amplitude, max_global_gain,
+                                                      min_global_gain))
+            if apply_gain:
+                print("Applying mp3 gain change of {} to {}...".format(mp3_gain, mp3_file))
+
+        sys.stdout.flush()
+
+        # Track gain is written file by file, album gain once the whole album is analyzed
+        if (apply_gain and "-a" not in options) or "-u" in options:
+            rewrite_file(mp3_file, use_temp_file, write_latency)
+
+    if not stored_only and not delete_tags and "-u" not in options and "-e" not in options and len(files) > 0:
+        print("\"Album\"\t0\t0.000000\t30000.000000\t200\t100")
+        sys.stdout.flush()
+
+    if apply_gain and "-a" in options:
+        for mp3_file in files:
+            rewrite_file(mp3_file, use_temp_file, write_latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import os
+import sys
+import struct
+import zlib
+import argparse
+
+# 128 kbit/s 44.1 kHz MPEG-1 Layer III frames with empty side info and audio data
+FRAME_HEADER = b"\xff\xfb\x90\x64"
+FRAME_SIZE = 417
+
+
+def get_ape_tag(items):
+    data = b""
+    for key, value in items:
+        value = value.encode('utf8')
+        data = data + struct.pack("<II", len(value), 0) + key.encode('ascii') + b"\x00" + value
+
+    tag_size = len(data) + 32
+    header = struct.pack("<8sIIII8x", b"APETAGEX", 2000, tag_size, len(items), 0xa0000000)
+    footer = struct.pack("<8sIIII8x", b"APETAGEX", 2000, tag_size, len(items), 0x80000000)
+
+    return header + data + footer
+
+
+def make_file(mp3_file, num_frames, tagged):
+    frame = FRAME_HEADER + b"\x00" * (FRAME_SIZE - len(FRAME_HEADER))
+    data = frame * num_frames
+
+    if tagged:
+        file_hash = zlib.crc32(mp3_file.encode('utf8'))
+        db_gain = (file_hash % 2000) / 100.0 - 10.0
+        peak = (20000.0 + file_hash % 15000) / 32768.0
+        data = data + get_ape_tag([("MP3GAIN_MINMAX", "{:03d},{:03d}".format(100 + file_hash % 40,
+                                                                             150 + file_hash % 50)),
+                                   ("REPLAYGAIN_TRACK_GAIN", "{:+f} dB".format(db_gain)),
+                                   ("REPLAYGAIN_TRACK_PEAK", "{:f}".format(peak))])
+
+    with open(mp3_file, 'wb') as outfile:
+        outfile.write(data)
+
+
+def make_library(directory, num_files, files_per_folder=20, num_frames=8, tagged_ratio=0.5):
+    num_folders = max(1, (num_files + files_per_folder - 1) // files_per_folder)
+    tag_every = int(1 / tagged_ratio) if tagged_ratio > 0 else 0
+
+    file_idx = 0
+    for folder_idx in range(num_folders):
+        folder = os.path.join(directory, "Album {:06d}".format(folder_idx))
+        os.makedirs(folder, exist_ok=True)
+
+        for track_idx in range(files_per_folder):
+            if file_idx >= num_files:
+                break
+
+            mp3_file = os.path.join(folder, "{:02d} Track.mp3".format(track_idx + 1))
+            if not os.path.exists(mp3_file):
+                make_file(mp3_file, num_frames, tag_every > 0 and file_idx % tag_every == 0)
+            file_idx = file_idx + 1
+
+    return directory
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("directory", help="Output directory.")
+    parser.add_argument("--files", type=int, default=1000, help="Total # of files.")
+    parser.add_argument("--files-per-folder", type=int, default=20, dest="files_per_folder",
+                        help="# of files per album folder.")
+    parser.add_argument("--frames", type=int, default=8, help="# of MP3 frames per file.")
+    arguments = parser.parse_args()
+
+    make_library(arguments.directory, arguments.files, arguments.files_per_folder, arguments.frames)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
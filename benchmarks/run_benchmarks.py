@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import queue
+import resource
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_PATH))
+
+from make_library import make_library  # noqa: E402
+
+FAKE_MP3GAIN = os.path.join(BENCHMARK_PATH, "fake_mp3gain.py")
+GUI_BENCHMARKS = ["add", "read", "analyze", "apply"]
+LIB_BENCHMARKS = ["scan", "lib-analyze", "lib-apply"]
+PARSE_BENCHMARKS = ["parse", "parse-bulk"]
+BENCHMARKS = LIB_BENCHMARKS + GUI_BENCHMARKS + PARSE_BENCHMARKS
+
+ANALYSIS_HEADER = "File\tMP3 gain\tdB gain\tMax Amplitude\tMax global_gain\tMin global_gain\n"
+
+
+def get_library(library_dir, num_files):
+    directory = os.path.join(library_dir, "library-{}".format(num_files))
+    return make_library(directory, num_files)
+
+
+def get_mp3s(directory):
+    from lib.util import get_paths
+
+    return sorted(get_paths(directory, "mp3", True))
+
+
+def get_mp3gain(arguments):
+    from lib import MP3Gain
+
+    return MP3Gain(mp3gain_bin=FAKE_MP3GAIN, max_files=arguments.max_files, max_processes=arguments.processes)
+
+
+def run_lib_benchmark(benchmark, directory, arguments):
+    if benchmark == "scan":
+        start_time = time.perf_counter()
+        num_files = len(get_mp3s(directory))
+        return num_files, time.perf_counter() - start_time
+
+    mp3_files = get_mp3s(directory)
+    mp3gain = get_mp3gain(arguments)
+
+    start_time = time.perf_counter()
+    if benchmark == "lib-analyze":
+        job = mp3gain.get_file_analysis(mp3_files)
+    else:
+        job = mp3gain.set_volume(mp3_files, 89.0, False)
+
+    num_files = 0
+    while job.is_running():
+        try:
+            job.get_result(timeout=0.1)
+            num_files = num_files + 1
+        except queue.Empty:
+            pass
+
+    return num_files, time.perf_counter() - start_time
+
+
+def get_analysis_output(num_lines):
+    # Synthetic mp3gain -o output, with the status and album lines mp3gain mixes in
+    lines = [ANALYSIS_HEADER]
+    for idx in range(num_lines):
+        lines.append("/music/album-{}/track-{}.mp3\t{}\t{:.6f}\t{:.6f}\t{}\t{}\n".format(
+            idx // 12, idx % 12, idx % 11 - 5, (idx % 11 - 5) * 1.5, 20000 + idx % 12000, 200 - idx % 40,
+            100 + idx % 40))
+        if idx % 1000 == 999:
+            lines.append("\"Album\"\t0\t0.000000\t32767.000000\t210\t90\n")
+            lines.append("\n")
+
+    return lines
+
+
+def run_parse_benchmark(benchmark, num_lines):
+    from lib import ResultParser
+    from lib.ResultParser import parse_output
+
+    lines = get_analysis_output(num_lines)
+
+    start_time = time.perf_counter()
+    if benchmark == "parse":
+        parser = ResultParser(lines[0])
+        results = [parser.parse_line(line) for line in lines[1:]]
+        num_results = len([result for result in results if result is not None])
+    else:
+        num_results = len(parse_output("".join(lines)))
+
+    return num_results, time.perf_counter() - start_time
+
+
+def run_gui_benchmark(benchmark, directory, arguments):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    from PyQt5.QtCore import QEventLoop
+    from PyQt5.QtWidgets import QApplication
+
+    from gui import PyMP3List
+
+    app = QApplication([])
+
+    mp3_files = get_mp3s(directory)
+    mp3_list = PyMP3List(None, mp3gain=get_mp3gain(arguments))
+    mp3_list.show()
+
+    if benchmark != "add":
+        mp3_list.add_mp3s(mp3_files)
+
+    app.processEvents()
+
+    start_time = time.perf_counter()
+    start_thread_time = time.thread_time()
+
+    if benchmark == "add":
+        for idx in range(0, len(mp3_files), 500):
+            mp3_list.add_mp3s(mp3_files[idx:idx + 500], resize_columns=idx == 0)
+            app.processEvents()
+        mp3_list.resizeColumnsToContents()
+    else:
+        loop = QEventLoop()
+        mp3_list.process_done.connect(loop.quit)
+
+        if benchmark == "read":
+            mp3_list.process_list(operation="read")
+        elif benchmark == "analyze":
+            mp3_list.analyze_list()
+        elif benchmark == "apply":
+            mp3_list.apply_gain_list()
+
+        if mp3_list.operation is not None:
+            loop.exec_()
+
+    busy_time = time.thread_time() - start_thread_time
+
+    return len(mp3_files), time.perf_counter() - start_time, busy_time
+
+
+def run_single(benchmark, num_files, arguments):
+    busy_time = None
+    if benchmark in PARSE_BENCHMARKS:
+        # Sizes are output lines here, no library is needed
+        num_results, total_time = run_parse_benchmark(benchmark, num_files)
+        print(json.dumps(get_result(benchmark, num_files, num_results, total_time, busy_time)))
+        return
+
+    directory = get_library(arguments.library_dir, num_files)
+
+    if benchmark in GUI_BENCHMARKS:
+        num_results, total_time, busy_time = run_gui_benchmark(benchmark, directory, arguments)
+    else:
+        num_results, total_time = run_lib_benchmark(benchmark, directory, arguments)
+
+    print(json.dumps(get_result(benchmark, num_files, num_results, total_time, busy_time)))
+
+
+def get_result(benchmark, num_files, num_results, total_time, busy_time):
+    return {"benchmark": benchmark,
+            "files": num_files,
+            "results": num_results,
+            "seconds": total_time,
+            "files_per_second": num_results / total_time if total_time > 0 else 0,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "gui_busy_seconds": busy_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS,
+                        help="Benchmarks to run.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000],
+                        help="Library sizes (# of files).")
+    parser.add_argument("--library-dir", default=os.path.join(tempfile.gettempdir(), "pymp3gain-benchmark"),
+                        dest="library_dir", help="Where synthetic libraries are generated (and reused).")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds the fake mp3gain spends per file.")
+    parser.add_argument("--max-files", type=int, default=0, dest="max_files",
+                        help="Maximum # of files per process (0 = sized by file size and throughput, like pymp3gain; "
+                             "99 for comparison with fixed batches).")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Maximum # of parallel processes (0 = CPU count).")
+    parser.add_argument("--json", action="store_true",
+                        help="Print JSON Lines instead of a table.")
+    parser.add_argument("--single", nargs=2, default=None, metavar=("BENCHMARK", "SIZE"),
+                        help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    os.environ["PYMP3GAIN_FAKE_LATENCY"] = str(arguments.latency)
+
+    if arguments.single is not None:
+        run_single(arguments.single[0], int(arguments.single[1]), arguments)
+        return 0
+
+    if not arguments.json:
+        print("{:<12} {:>8} {:>10} {:>12} {:>10} {:>10}".format("benchmark", "files", "seconds", "files/sec",
+                                                                "RSS (MB)", "GUI busy"))
+
+    # Each benchmark runs in its own process so peak RSS isn't shared between them
+    for num_files in arguments.sizes:
+        for benchmark in arguments.benchmarks:
+            cmd = [sys.executable, os.path.abspath(__file__), "--single", benchmark, str(num_files),
+                   "--library-dir", arguments.library_dir, "--latency", str(arguments.latency),
+                   "--max-files", str(arguments.max_files), "--processes", str(arguments.processes)]
+            process = subprocess.run(cmd, stdout=subprocess.PIPE, encoding='utf8')
+
+            if process.returncode != 0:
+                print("{:<12} {:>8} failed".format(benchmark, num_files))
+                continue
+
+            result = json.loads(process.stdout.splitlines()[-1])
+
+            if arguments.json:
+                print(json.dumps(result))
+            else:
+                busy_time = result["gui_busy_seconds"]
+                print("{:<12} {:>8} {:>10.3f} {:>12.1f} {:>10.1f} {:>10}".format(
+                    benchmark, num_files, result["seconds"], result["files_per_second"], result["peak_rss_mb"],
+                    "" if busy_time is None else "{:.3f}".format(busy_time)))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
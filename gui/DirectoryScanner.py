@@ -0,0 +1,49 @@
+import time
+
+from PyQt5 import QtCore
+
+from lib.util import *
+
+SCAN_BATCH_SIZE = 500
+SCAN_INTERVAL = 0.1
+
+
+class DirectoryScanner(QtCore.QThread):
+    # Files, their stored analyses and the number of files found so far, batches included
+    files_found = QtCore.pyqtSignal(list, list, int, name="files_found")
+
+    def __init__(self, directory, mp3gain, parent=None):
+        super().__init__(parent)
+
+        self.directory = directory
+        self.mp3gain = mp3gain
+        self.cancelled = False
+        self.num_files = 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        mp3_files = []
+        analyses = []
+        last_batch = time.monotonic()
+
+        for mp3_file in iter_paths(self.directory, "mp3", recursive=True, sort=True):
+            if self.cancelled:
+                return
+
+            mp3_files.append(mp3_file)
+            analyses.extend(self.mp3gain.read_stored_analysis(mp3_file))
+
+            if len(mp3_files) >= SCAN_BATCH_SIZE or time.monotonic() - last_batch >= SCAN_INTERVAL:
+                self.emit_batch(mp3_files, analyses)
+                mp3_files = []
+                analyses = []
+                last_batch = time.monotonic()
+
+        if len(mp3_files) > 0 and not self.cancelled:
+            self.emit_batch(mp3_files, analyses)
+
+    def emit_batch(self, mp3_files, analyses):
+        self.num_files = self.num_files + len(mp3_files)
+        self.files_found.emit(mp3_files, analyses, self.num_files)
@@ -37,8 +37,17 @@ class PreferencesDialog(QDialog):
                                                   ValueEntry.ActionNone, [89, 119, 1.5])
         self.default_mode = create_entry("default_mode", "Default Mode:",
                                          ValueEntry.ActionList, "Track;Single Album;Album Folders")
-        self.max_files = create_entry("max_files", "Maximum # of files per process:",
-                                      ValueEntry.ActionNone, [1, 999, 1])
+        self.max_files = create_entry("max_files", "Maximum # of files per process (0 = auto):",
+                                      ValueEntry.ActionNone, [0, 999, 1])
+        self.max_processes = create_entry("max_processes", "Maximum # of parallel processes (0 = auto):",
+                                          ValueEntry.ActionNone, [0, 256, 1])
+        self.analysis_cache = create_entry("analysis_cache", "Cache analysis results:", ValueEntry.ActionNone)
+        self.native_gain = create_entry("native_gain", "Apply/undo gain without mp3gain (tagged files):",
+                                        ValueEntry.ActionNone)
+        self.native_analysis = create_entry("native_analysis", "Analyze without mp3gain (soundfile, SciPy):",
+                                            ValueEntry.ActionNone)
+        self.temp_files = create_entry("temp_files", "Rewrite changed files through a temporary copy (mp3gain -t):",
+                                       ValueEntry.ActionNone)
         self.mp3gain_bin = create_entry("mp3gain_bin", "MP3Gain executable:", ValueEntry.ActionFileOpen)
 
         self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
@@ -65,7 +74,12 @@ class PreferencesDialog(QDialog):
     def get_default_preferences():
         preferences = {"mp3gain_bin": "/usr/bin/mp3gain",
                        "default_target_volume": 89.0,
-                       "max_files": 99,
+                       "max_files": 0,
+                       "max_processes": 0,
+                       "analysis_cache": True,
+                       "native_gain": False,
+                       "native_analysis": False,
+                       "temp_files": False,
                        "default_mode": "Album Folders"}
 
         return preferences
@@ -1,5 +1,7 @@
 import os
 import json
+import time
+import sqlite3
 
 from lib.util import *
 
@@ -13,29 +15,55 @@ from . import PyMP3List
 from . import ValueEntry
 from . import PyMP3GainStatus
 from . import PreferencesDialog
+from . import DirectoryScanner
 
-from lib import MP3Gain
+from lib import MP3Gain, AnalysisCache, JobJournal
 
 PREF_DIR = os.path.expanduser("~/.config/pymp3gain/")
 PREF_FILE = "pymp3gain.conf"
 PREFERENCES = str(Path(PREF_DIR) / Path(PREF_FILE))
+CACHE_FILE = "analysis_cache.sqlite"
+ANALYSIS_CACHE = str(Path(PREF_DIR) / Path(CACHE_FILE))
+JOURNAL_FILE = "journal.sqlite"
+JOB_JOURNAL = str(Path(PREF_DIR) / Path(JOURNAL_FILE))
+RESUME_DESCRIPTIONS = {"apply": "Applying gain to", "undo": "Undoing gain on", "delete-tags": "Deleting tags from"}
+LOAD_BATCH_SIZE = 500
 
 
 class PyMP3GainApp(QMainWindow):
-    def __init__(self, version="unversioned", debug_output=False):
+    def __init__(self, version="unversioned", debug_output=False, metrics_file=None, profile_dir=None):
         super().__init__()
 
         self.debug_output = debug_output
+        self.metrics_file = metrics_file
+        self.profiler = None
+        self.profile_operation = None
         self.version = version
         self.last_path = ""
+        self.scanner = None
+        self.scan_dialog = None
 
         self.preferences = self.load_preferences()
         default_target_volume = self.preferences["default_target_volume"]
         default_mode = self.preferences["default_mode"]
         mp3gain_bin = self.preferences["mp3gain_bin"]
         max_files = self.preferences["max_files"]
-
-        self.mp3gain = MP3Gain(mp3gain_bin=mp3gain_bin, max_files=max_files)
+        max_processes = self.preferences["max_processes"]
+        native_gain = self.preferences["native_gain"]
+        native_analysis = self.preferences["native_analysis"]
+        temp_files = self.preferences["temp_files"]
+
+        self.mp3gain = MP3Gain(mp3gain_bin=mp3gain_bin, max_files=max_files, max_processes=max_processes,
+                               native_gain=native_gain, native_analysis=native_analysis, temp_files=temp_files,
+                               debug_output=debug_output)
+        self.set_analysis_cache(self.preferences["analysis_cache"])
+        self.open_job_journal()
+
+        if profile_dir is not None:
+            # Imported on demand, cProfile is only needed when profiling
+            from lib.Profiler import Profiler
+            self.profiler = Profiler(profile_dir)
+            self.mp3gain.set_profiler(self.profiler)
 
         menu = self.create_menu()
 
@@ -83,7 +111,10 @@ class PyMP3GainApp(QMainWindow):
         self.status = PyMP3GainStatus()
         self.status.reset_progress()
         self.main_layout.addWidget(create_frame(self.status, None))
+        self.mp3_list.process_started.connect(lambda: self.status.set_cancel_enabled(True))
+        self.mp3_list.process_started.connect(self.on_process_started)
         self.mp3_list.process_done.connect(self.on_process_done)
+        self.status.cancel_requested.connect(self.mp3_list.cancel_operation)
         self.mp3_list.mp3gain_progress.connect(self.status.set_progress)
 
         self.status_bar = self.statusBar()
@@ -95,6 +126,9 @@ class PyMP3GainApp(QMainWindow):
 
         self.showMaximized()
 
+        # Offer to continue a job the last session didn't get to finish
+        QtCore.QTimer.singleShot(0, self.check_interrupted_jobs)
+
     def create_menu(self):
         def create_action(parent, parent_menu, name, slot):
             action = QAction(name, parent)
@@ -118,6 +152,8 @@ class PyMP3GainApp(QMainWindow):
         menu_tools.addSeparator()
         create_action(self, menu_tools, "Undo gain", self.on_menu_tools_undo)
         create_action(self, menu_tools, "Delete stored tags", self.on_menu_tools_delete)
+        menu_tools.addSeparator()
+        create_action(self, menu_tools, "Resume interrupted job...", self.on_menu_tools_resume)
 
         menu_help = menu.addMenu("&Help")
         create_action(self, menu_help, "About", self.on_menu_help_about)
@@ -139,7 +175,7 @@ class PyMP3GainApp(QMainWindow):
         if res != "":
             self.last_path = res
             if directory:
-                self.load_source(sorted(get_paths(res, "mp3", True)))
+                self.load_directory(res)
             else:
                 self.load_source([res])
 
@@ -155,6 +191,11 @@ class PyMP3GainApp(QMainWindow):
             self.mp3gain_mode.set_value(self.preferences["default_mode"])
             self.mp3gain.set_mp3gain_bin(self.preferences["mp3gain_bin"])
             self.mp3gain.set_max_files(self.preferences["max_files"])
+            self.mp3gain.set_max_processes(self.preferences["max_processes"])
+            self.set_analysis_cache(self.preferences["analysis_cache"])
+            self.mp3gain.set_native_gain(self.preferences["native_gain"])
+            self.mp3gain.set_native_analysis(self.preferences["native_analysis"])
+            self.mp3gain.set_temp_files(self.preferences["temp_files"])
 
     def on_menu_tools_apply_gain(self):
         self.mp3_list.apply_gain_list()
@@ -168,6 +209,43 @@ class PyMP3GainApp(QMainWindow):
     def on_menu_tools_delete(self):
         self.mp3_list.delete_tags_list()
 
+    def on_menu_tools_resume(self):
+        journal = self.mp3gain.get_journal()
+
+        jobs = []
+        if journal is not None:
+            jobs = journal.get_unfinished_jobs()
+
+        if len(jobs) == 0:
+            self.status_bar.showMessage("No interrupted jobs.", 4000)
+            return
+
+        self.ask_resume(jobs[-1])
+
+    def check_interrupted_jobs(self):
+        journal = self.mp3gain.get_journal()
+        if journal is None or self.mp3_list.operation is not None:
+            return
+
+        # Jobs cancelled on purpose are only offered from the Tools menu
+        jobs = [entry for entry in journal.get_unfinished_jobs() if entry["interrupted"]]
+        if len(jobs) > 0:
+            self.ask_resume(jobs[-1])
+
+    def ask_resume(self, entry):
+        text = "{} {} files was interrupted on {} ({} done).\n\nResume the remaining files?".format(
+            RESUME_DESCRIPTIONS[entry["operation"]], entry["total"],
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created"])), entry["completed"])
+
+        answer = QMessageBox.question(self, "Resume Job", text,
+                                      QMessageBox.Yes | QMessageBox.No | QMessageBox.Discard, QMessageBox.Yes)
+
+        if answer == QMessageBox.Yes:
+            if not self.mp3_list.resume_operation(entry["job_id"]):
+                self.status_bar.showMessage("Another operation is still running.", 4000)
+        elif answer == QMessageBox.Discard:
+            self.mp3gain.get_journal().discard_job(entry["job_id"])
+
     def on_menu_help_about(self):
         description = "PyMP3Gain is a Qt frontend for mp3gain, written in Python.\n\nmp3gain version: {}".format(
             self.mp3gain.get_version())
@@ -190,12 +268,117 @@ class PyMP3GainApp(QMainWindow):
         self.mp3_list.set_analysis_config(album_analysis=self.album_mode,
                                           album_by_folder=self.album_mode_by_folder)
 
+    def on_process_started(self):
+        self.profile_operation = self.mp3_list.operation
+        self.start_profile(self.profile_operation)
+
     def on_process_done(self, msg=None):
         self.status.reset_progress()
         if msg:
             self.status_bar.showMessage(msg, 4000)
 
+        self.stop_profile(self.profile_operation)
+        self.profile_operation = None
+
+        if self.metrics_file is not None:
+            self.write_metrics()
+
+    def start_profile(self, operation):
+        if self.profiler is not None:
+            self.profiler.start(operation)
+
+    def stop_profile(self, operation):
+        if self.profiler is None:
+            return
+
+        try:
+            profile_path = self.profiler.stop(operation)
+        except OSError:
+            print("Error writing profile ({}).".format(self.profiler.output_dir))
+            return
+
+        if profile_path is not None:
+            print("Profile written to {}.prof and {}.trace.json".format(profile_path, profile_path))
+
+    def write_metrics(self):
+        try:
+            self.mp3gain.get_metrics().write(self.metrics_file)
+        except OSError:
+            print("Error writing metrics ({}).".format(self.metrics_file))
+
+    def set_analysis_cache(self, enabled):
+        if enabled and self.mp3gain.cache is None:
+            try:
+                self.mp3gain.set_cache(AnalysisCache(ANALYSIS_CACHE))
+            except sqlite3.Error:
+                print("Error opening analysis cache ({}).".format(ANALYSIS_CACHE))
+        elif not enabled and self.mp3gain.cache is not None:
+            self.mp3gain.cache.close()
+            self.mp3gain.set_cache(None)
+
+    def open_job_journal(self):
+        try:
+            self.mp3gain.set_journal(JobJournal(JOB_JOURNAL))
+        except sqlite3.Error:
+            print("Error opening job journal ({}).".format(JOB_JOURNAL))
+
+    def load_directory(self, directory):
+        if self.scanner is not None:
+            self.status_bar.showMessage("Still adding files from another directory.", 4000)
+            return
+
+        self.start_profile("add_directory")
+        self.scanner = DirectoryScanner(directory, self.mp3gain, self)
+        self.scanner.files_found.connect(self.on_files_found)
+        self.scanner.finished.connect(self.on_scan_finished)
+
+        self.scan_dialog = QProgressDialog("Adding files...", "Cancel", 0, 0, self)
+        self.scan_dialog.setWindowTitle("Adding Files")
+        self.scan_dialog.setMinimumDuration(0)
+        self.scan_dialog.setWindowModality(QtCore.Qt.NonModal)
+        self.scan_dialog.canceled.connect(self.scanner.cancel)
+        self.scan_dialog.show()
+
+        self.scanner.start()
+
+    def on_files_found(self, mp3_files, analyses, num_files):
+        # Sizing columns is expensive; do it for the first batch and then once at the end. num_files is the count as
+        # of this batch, the scanner may be further along by now.
+        first_batch = num_files == len(mp3_files)
+        self.mp3_list.add_mp3s(mp3_files, analyses, resize_columns=first_batch)
+
+        self.scan_dialog.setLabelText("Adding files... ({})\n{}".format(num_files, clip_text(mp3_files[-1], 64)))
+
+    def on_scan_finished(self):
+        self.scan_dialog.hide()
+        self.scan_dialog.deleteLater()
+        self.scan_dialog = None
+
+        self.scanner.deleteLater()
+        self.scanner = None
+
+        self.mp3_list.resizeColumnsToContents()
+        self.status_bar.showMessage("Loaded {} files.".format(self.mp3_list.model().rowCount()), 4000)
+
+        self.stop_profile("add_directory")
+
+    def closeEvent(self, event):
+        if self.scanner is not None:
+            self.scanner.cancel()
+            self.scanner.wait()
+
+        # Running mp3gain processes stop after their current file instead of being left behind
+        self.mp3_list.cancel_operation()
+        self.mp3gain.shutdown()
+
+        if self.mp3gain.get_journal() is not None:
+            self.mp3gain.get_journal().close()
+
+        super().closeEvent(event)
+
     def load_source(self, src):
+        self.start_profile("add_files")
+
         progress_dialog = QProgressDialog("Adding files...", "Cancel", 0, len(src), self)
         progress_dialog.setWindowTitle("Adding Files")
         progress_dialog.setMinimumDuration(0)
@@ -203,19 +386,24 @@ class PyMP3GainApp(QMainWindow):
         progress_dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose, True)
         progress_dialog.setValue(0)
 
-        for item in src:
-            if progress_dialog.wasCanceled():
+        for batch in split_list(src, LOAD_BATCH_SIZE):
+            if progress_dialog.wasCanceled() or len(batch) == 0:
                 break
 
-            self.mp3_list.add_mp3(item)
+            # Sizing columns is expensive; do it for the first batch and then once at the end
+            self.mp3_list.add_mp3s(batch, resize_columns=progress_dialog.value() == 0)
 
-            progress_dialog.setLabelText(clip_text(item, 64))
-            progress_dialog.setValue(progress_dialog.value() + 1)
+            progress_dialog.setLabelText(clip_text(batch[-1], 64))
+            progress_dialog.setValue(progress_dialog.value() + len(batch))
 
         progress_dialog.setValue(progress_dialog.maximum())
         progress_dialog.deleteLater()
 
-        self.status_bar.showMessage("Loaded {} files.".format(self.mp3_list.rowCount()), 4000)
+        self.mp3_list.resizeColumnsToContents()
+
+        self.status_bar.showMessage("Loaded {} files.".format(self.mp3_list.model().rowCount()), 4000)
+
+        self.stop_profile("add_files")
 
     def load_preferences(self):
         preferences = PreferencesDialog.get_default_preferences()
@@ -225,6 +413,10 @@ class PyMP3GainApp(QMainWindow):
             preferences_in = json.load(infile)
             if preferences_in.keys() == preferences.keys():
                 preferences = preferences_in
+            elif preferences_in.keys() < preferences.keys():
+                # Preferences from an older version; keep them and fill in defaults for new settings.
+                preferences.update(preferences_in)
+                self.save_preferences(preferences)
             else:
                 print("Error loading preferences; using defaults.")
         except FileNotFoundError:
@@ -1,7 +1,10 @@
-from PyQt5.QtWidgets import QWidget, QProgressBar, QLabel, QVBoxLayout, QSizePolicy
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import QWidget, QProgressBar, QLabel, QVBoxLayout, QHBoxLayout, QPushButton, QSizePolicy
 
 
 class PyMP3GainStatus(QWidget):
+    cancel_requested = QtCore.pyqtSignal(name="cancel_requested")
+
     def __init__(self):
         super().__init__()
 
@@ -11,10 +14,17 @@ class PyMP3GainStatus(QWidget):
         self.text = QLabel("")
         self.sub_progress = QProgressBar()
         self.total_progress = QProgressBar()
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.on_cancel)
+
+        text_layout = QHBoxLayout()
+        text_layout.addWidget(self.text, 1)
+        text_layout.addWidget(self.cancel_button)
 
         layout.addWidget(self.sub_progress)
         layout.addWidget(self.total_progress)
-        layout.addWidget(self.text)
+        layout.addLayout(text_layout)
         sp = QSizePolicy(QSizePolicy.Preferred, QSizePolicy.Maximum)
         self.setSizePolicy(sp)
 
@@ -29,8 +39,17 @@ class PyMP3GainStatus(QWidget):
         self.total_progress.setMaximum(total_max)
         self.total_progress.setValue(total_iter)
 
+    def set_cancel_enabled(self, enabled):
+        self.cancel_button.setEnabled(enabled)
+
+    def on_cancel(self):
+        self.cancel_button.setEnabled(False)
+        self.text.setText("Cancelling...")
+        self.cancel_requested.emit()
+
     def reset_progress(self):
         self.text.setText("")
+        self.cancel_button.setEnabled(False)
 
         self.sub_progress.setMaximum(1)
         self.sub_progress.reset()
@@ -1,42 +1,39 @@
-import queue
+import math
 import time
+import functools
+import itertools
 
-from pathlib import Path
+from array import array
 
 from PyQt5 import QtCore
-from PyQt5.QtGui import QBrush, QColor
-from PyQt5.QtWidgets import QAction, QTableWidget, QTableWidgetItem, QHeaderView, QMenu, QApplication
+from PyQt5.QtWidgets import QAction, QTableView, QHeaderView, QMenu
 
 from lib.util import *
+from lib.tags import apply_gain_change
+from lib.MP3Gain import get_volume_offset
+from lib.Metrics import SIZE_BUCKETS
+from lib.prediction import get_gain_range, predict_gain_change, get_prediction_flags, GAIN_UNKNOWN
 
-FILE_COLUMN = 0
-FOLDER_COLUMN = 1
-VOLUME_COLUMN = 2
-GAIN_DB_COLUMN = 3
-GAIN_MP3_COLUMN = 4
-CLIPPING_COLUMN = 5
-ALBUM_GAIN_DB_COLUMN = 6
-TAG_INFO_COLUMN = 7
-FILENAME_COLUMN = 8
+from .PyMP3ListModel import *
 
+RESULT_INTERVAL_MSEC = 50
+READ_BATCH_SIZE = 500
+# Journal operation -> list operation
+RESUME_OPERATIONS = {"apply": "apply_gain", "undo": "undo_gain", "delete-tags": "delete_tags"}
 
-class PyMP3List(QTableWidget):
+
+class PyMP3List(QTableView):
+    process_started = QtCore.pyqtSignal(name="process_started")
     process_done = QtCore.pyqtSignal(str, name="process_done")
     process_progress = QtCore.pyqtSignal(str, int, int, name="process_progress")
     mp3gain_progress = QtCore.pyqtSignal(str, int, int, int, int, name="mp3gain_progress")
+    results_ready = QtCore.pyqtSignal(name="results_ready")
 
     def __init__(self, parent, target_volume=89.0, mp3gain=None):
-        super().__init__(0, 9, parent)
-
-        self.setHorizontalHeaderItem(FILE_COLUMN, QTableWidgetItem("File"))
-        self.setHorizontalHeaderItem(FOLDER_COLUMN, QTableWidgetItem("Folder"))
-        self.setHorizontalHeaderItem(VOLUME_COLUMN, QTableWidgetItem("Volume"))
-        self.setHorizontalHeaderItem(GAIN_DB_COLUMN, QTableWidgetItem("Gain (dB)"))
-        self.setHorizontalHeaderItem(GAIN_MP3_COLUMN, QTableWidgetItem("Gain (mp3)"))
-        self.setHorizontalHeaderItem(CLIPPING_COLUMN, QTableWidgetItem("Clipping"))
-        self.setHorizontalHeaderItem(ALBUM_GAIN_DB_COLUMN, QTableWidgetItem("Album gain (dB)"))
-        self.setHorizontalHeaderItem(TAG_INFO_COLUMN, QTableWidgetItem("Tag Info"))
-        self.setHorizontalHeaderItem(FILENAME_COLUMN, QTableWidgetItem("$file"))
+        super().__init__(parent)
+
+        self.list_model = PyMP3ListModel(self)
+        self.setModel(self.list_model)
 
         self.setSelectionBehavior(QHeaderView.SelectRows)
 
@@ -44,170 +41,440 @@ class PyMP3List(QTableWidget):
         self.customContextMenuRequested.connect(self.on_context_menu)
 
         self.setEditTriggers(self.NoEditTriggers)
+        self.setWordWrap(False)
 
         header = self.horizontalHeader()
         header.resizeSections(QHeaderView.ResizeToContents)
-        header.setSectionHidden(8, True)
+        header.setSectionHidden(FILENAME_COLUMN, True)
         header.setStretchLastSection(True)
+        # Sorted by clicking a header, files stay in the order they were added until then
+        header.setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.setSortingEnabled(True)
+
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
 
-        self.mp3_list = dict()
         self.base_volume = 89.0
         self.target_volume = target_volume
         self.album_analysis = False
         self.album_by_folder = False
         self.mp3gain = mp3gain
         self.mp3gain_bin = self.mp3gain.mp3gain
+        # GUI stages are recorded next to MP3Gain's
+        self.metrics = self.mp3gain.get_metrics()
 
         self.process_thread = None
 
+        self.operation = None
+        self.operation_album_analysis = False
+        self.operation_files = []
+        self.operation_groups = dict()
+        self.num_albums = 0
+        self.albums_done = 0
+        self.operation_progress_text = ""
+        self.operation_start_time = 0
+        self.operation_stored_results = None
+        self.operation_refresh = []
+        self.operation_result_files = set()
+        self.operation_plan = None
+        self.operation_resume = None
+        self.waiting_for_results = False
+        self.job = None
+        self.operation_cancelled = False
+        self.expected_num_results = 0
+        self.total_idx = 0
+        self.total_files = 0
+
+        self.result_timer = QtCore.QTimer(self)
+        self.result_timer.setSingleShot(True)
+        self.result_timer.setInterval(RESULT_INTERVAL_MSEC)
+        self.result_timer.timeout.connect(self.on_results_ready)
+
+        self.results_ready.connect(self.on_results_ready, QtCore.Qt.QueuedConnection)
+        self.mp3gain.set_result_callback(self.results_ready.emit)
+
     def add_mp3(self, mp3_file):
-        if mp3_file in self.mp3_list:
-            return
+        self.add_mp3s([mp3_file])
+
+    def add_mp3s(self, mp3_files, analyses=None, resize_columns=True):
+        start_time = time.monotonic()
+        new_files = []
+        new_analyses = []
+        added = set()
 
-        working_file = Path(mp3_file)
+        for idx, mp3_file in enumerate(mp3_files):
+            if mp3_file in added or self.list_model.has_path(mp3_file):
+                continue
 
-        file = str(working_file.name)
-        folder = str(working_file.parent.name)
+            added.add(mp3_file)
+            new_files.append(mp3_file)
+            if analyses is not None:
+                new_analyses.append(analyses[idx])
 
-        current_row = self.rowCount()
-        self.insertRow(self.rowCount())
+        if len(new_files) == 0:
+            return
 
-        self.mp3_list[mp3_file] = current_row
+        if analyses is None:
+            new_analyses = self.mp3gain.read_stored_analysis(new_files)
 
-        self.setItem(current_row, FILE_COLUMN, QTableWidgetItem(file))
-        self.setItem(current_row, FOLDER_COLUMN, QTableWidgetItem(folder))
-        self.setItem(current_row, FILENAME_COLUMN, QTableWidgetItem(mp3_file))
+        self.list_model.append_files(new_files)
+        self.update_rows(new_analyses, new_files)
 
-        result = self.mp3gain.get_file_analysis(mp3_file, stored_only=True, block=True)
-        analysis = result[0]
+        if resize_columns:
+            self.resizeColumnsToContents()
 
-        self.update_row_by_file(mp3_file, analysis)
-        self.resizeColumnsToContents()
+        self.mp3gain.add_span("add", "gui", start_time, time.monotonic(), {"files": len(new_files)})
 
     def update_row_by_file(self, mp3, analysis):
-        try:
-            row = self.mp3_list[mp3]
-        except KeyError:
-            print("Error updating row:")
-            print(mp3)
-            print(analysis)
-            return
+        self.update_rows([analysis], [mp3])
+
+    def update_rows(self, analyses, mp3_files=None):
+        first_row = None
+        last_row = None
+
+        for idx, analysis in enumerate(analyses):
+            if mp3_files is None:
+                mp3 = analysis["File"]
+            else:
+                mp3 = mp3_files[idx]
+
+            row = self.list_model.get_row(mp3)
+            if row is None:
+                print("Error updating row:")
+                print(mp3)
+                print(analysis)
+                continue
+
+            if analysis["tag_exists"]:
+                mp3_gain_value = analysis.get("MP3 gain", math.nan) + self.get_gain_offset()
+                volume = self.base_volume + -1 * analysis.get("dB gain", 0)
+                album_db_gain = analysis.get("Album dB gain", math.nan)
+                clipping = analysis.get("Max Amplitude", 0) > 32767
+                min_gain, max_gain = self.get_global_gain_range(mp3, analysis)
+
+                self.list_model.set_row(row, True, volume, mp3_gain_value, clipping, album_db_gain,
+                                        analysis.get("dB gain", math.nan), analysis.get("Max Amplitude", math.nan),
+                                        min_gain, max_gain)
+            else:
+                self.list_model.set_row(row, False)
 
-        self.setItem(row, TAG_INFO_COLUMN, QTableWidgetItem(str(analysis["tag_exists"])))
+            if first_row is None or row < first_row:
+                first_row = row
+            if last_row is None or row > last_row:
+                last_row = row
 
-        if analysis["tag_exists"]:
-            mp3_gain_value = analysis["MP3 gain"] + self.get_gain_offset()
-            volume = self.base_volume + -1 * analysis.get("dB gain", 0)
-            gain_db = mp3_gain_value * 1.5
-            album_db_gain = analysis.get("Album dB gain", None)
+        if first_row is not None:
+            self.update_predictions(first_row, last_row)
 
-            volume = "{:.2f}".format(volume)
-            self.setItem(row, VOLUME_COLUMN, QTableWidgetItem(volume))
-            self.setItem(row, GAIN_DB_COLUMN, QTableWidgetItem(str(gain_db)))
-            self.setItem(row, GAIN_MP3_COLUMN, QTableWidgetItem(str(mp3_gain_value)))
-            self.setItem(row, ALBUM_GAIN_DB_COLUMN, QTableWidgetItem(str(album_db_gain)))
+    def get_global_gain_range(self, mp3, analysis):
+        if "Min global_gain" in analysis and "Max global_gain" in analysis:
+            return analysis["Min global_gain"], analysis["Max global_gain"]
 
-            if analysis["Max Amplitude"] > 32767:
-                self.setItem(row, CLIPPING_COLUMN, QTableWidgetItem("Yes"))
-                self.color_row(row, (255, 0, 0))
-            else:
-                self.setItem(row, CLIPPING_COLUMN, QTableWidgetItem(""))
-                self.color_row(row, (0, 0, 0))
+        # Tags written by other ReplayGain tools have no min/max, but a cached frame index does
+        if self.mp3gain.cache is not None:
+            frame_index = self.mp3gain.cache.get_frame_index(mp3)
+            if frame_index is not None and len(frame_index) > 0:
+                return get_gain_range(frame_index)
+
+        return GAIN_UNKNOWN, GAIN_UNKNOWN
+
+    def update_predictions(self, first_row=0, last_row=None):
+        list_model = self.list_model
+
+        if last_row is None:
+            last_row = list_model.rowCount() - 1
+        if last_row < first_row:
+            return
+
+        if self.album_analysis:
+            db_gains = list_model.album_gain
         else:
-            self.setItem(row, VOLUME_COLUMN, QTableWidgetItem(""))
-            self.setItem(row, GAIN_DB_COLUMN, QTableWidgetItem(""))
-            self.setItem(row, GAIN_MP3_COLUMN, QTableWidgetItem(""))
-            self.setItem(row, CLIPPING_COLUMN, QTableWidgetItem(""))
-            self.setItem(row, ALBUM_GAIN_DB_COLUMN, QTableWidgetItem(""))
-            self.color_row(row, (0, 0, 0))
+            db_gains = list_model.db_gain
+
+        # The whole range is predicted at once, so changing the target volume is instant even for huge lists
+        rows = slice(first_row, last_row + 1)
+        _, clipping, overflow = predict_gain_change(memoryview(db_gains)[rows], self.get_gain_offset(),
+                                                    memoryview(list_model.peak)[rows],
+                                                    memoryview(list_model.min_gain)[rows],
+                                                    memoryview(list_model.max_gain)[rows])
 
-    def color_row(self, row, color):
-        for col in range(self.columnCount()):
-            self.item(row, col).setForeground(QBrush(QColor(color[0], color[1], color[2])))
+        list_model.set_predictions(first_row, get_prediction_flags(clipping, overflow))
+        list_model.emit_rows_changed(first_row, last_row)
 
     def set_target_volume(self, target_volume):
         self.target_volume = target_volume
+        self.update_predictions()
 
     def set_analysis_config(self, album_analysis, album_by_folder):
         self.album_analysis = album_analysis
         self.album_by_folder = album_by_folder
+        self.update_predictions()
 
     def refresh_list(self, mp3_list=None):
         if mp3_list is None:
             mp3_list = self.get_mp3s(by_folder=False)["all"]
 
-        results = self.mp3gain.get_file_analysis(mp3_list, stored_only=True, block=True)
+        self.update_rows(self.mp3gain.read_stored_analysis(mp3_list))
 
-        for result in results:
-            self.update_row_by_file(result["File"], result)
+    def refresh_next_batch(self):
+        # Files re-read after an operation, in batches between events like a read operation
+        entries = list(itertools.islice(self.operation_stored_results, READ_BATCH_SIZE))
+        self.update_rows(entries)
+
+        if len(entries) < READ_BATCH_SIZE:
+            self.operation_stored_results = None
+            self.process_finished()
+        else:
+            QtCore.QTimer.singleShot(0, self.refresh_next_batch)
 
     def process_list(self, album_analysis=False, album_analysis_by_folder=False, operation="read", selected_only=False):
+        if self.operation is not None:
+            return
+
+        if operation not in ["read", "analyze", "apply_gain", "undo_gain", "delete_tags"]:
+            raise NotImplementedError
+
+        self.start_operation(operation, album_analysis, self.get_mp3s(album_analysis_by_folder, selected_only))
+
+    def resume_operation(self, journal_id):
+        if self.operation is not None:
+            return False
+
+        entry = self.mp3gain.get_journal().get_job(journal_id)
+        if entry is None:
+            return False
+
+        # Files of the job that have been removed from the list since are added back
+        self.add_mp3s([mp3_file for folder in entry["groups"].values() for mp3_file in folder])
+
+        self.operation_resume = journal_id
+        self.start_operation(RESUME_OPERATIONS[entry["operation"]], entry["params"].get("use_album_gain", False),
+                             entry["groups"])
+
+        return True
+
+    def start_operation(self, operation, album_analysis, mp3_list):
         self.setDisabled(True)
-        expected_num_results = 0
-        start_time = time.time()
 
-        mp3_list = self.get_mp3s(album_analysis_by_folder, selected_only)
+        self.operation = operation
+        self.operation_album_analysis = album_analysis
+        # Folders are scheduled together by MP3Gain, so the whole selection is a single pass
+        self.operation_groups = mp3_list
+        self.operation_files = [mp3_file for folder in mp3_list.values() for mp3_file in folder]
+        self.num_albums = len(mp3_list)
+        self.albums_done = 0
+        self.operation_start_time = time.time()
+        self.operation_cancelled = False
+        self.operation_plan = None
+        self.operation_refresh = []
+        self.operation_result_files = set()
+        self.total_idx = 0
+        self.total_files = len(self.operation_files)
+
+        self.metrics.inc("gui_operations_total", operation=operation)
+        self.process_started.emit()
+        self.run_operation()
+
+    def cancel_operation(self):
+        if self.operation is None:
+            return
 
-        total_files = 0
-        for folder in mp3_list:
-            total_files = total_files + len(mp3_list[folder])
-        total_idx = 0
+        self.operation_cancelled = True
 
-        if operation not in ["read", "analyze", "apply_gain", "undo_gain", "delete_tags"]:
-            raise NotImplementedError
+        # Results that are already on their way are still picked up, then the operation finishes as usual
+        if self.job is not None:
+            self.job.cancel()
+
+    def run_operation(self):
+        groups = self.operation_groups
+        operation = self.operation
+        album_analysis = self.operation_album_analysis
+
+        if self.operation_resume is not None:
+            # Continues an interrupted job from the journal with its own settings
+            self.operation_progress_text = "Resuming on"
+            self.job = self.mp3gain.resume_job(self.operation_resume)
+        elif operation == "apply_gain":
+            # The job leaves out files already at the target volume, see update_plan
+            self.operation_progress_text = "Applying gain to"
+            self.job = self.mp3gain.set_volume(src=groups, volume=self.target_volume, use_album_gain=album_analysis,
+                                               skip_unchanged=True, analyses=self.get_plan_analyses())
+        elif operation == "analyze":
+            self.operation_progress_text = "Analyzing"
+            self.job = self.mp3gain.get_file_analysis(src=groups, stored_only=False, album_analysis=album_analysis)
+        elif operation == "read":
+            self.operation_progress_text = "Reading"
+            self.expected_num_results = len(self.operation_files)
+            self.operation_stored_results = self.mp3gain.iter_stored_analysis(self.operation_files)
+            QtCore.QTimer.singleShot(0, self.read_next_batch)
+            return
+        elif operation == "undo_gain":
+            self.operation_progress_text = "Undoing gain on"
+            self.job = self.mp3gain.undo_gain(src=groups)
+        elif operation == "delete_tags":
+            self.operation_progress_text = "Deleting tags from"
+            self.job = self.mp3gain.delete_tags(src=groups)
+
+        self.expected_num_results = self.job.expected_results
+        self.waiting_for_results = True
+
+    def get_plan_analyses(self):
+        # Rows hold the stored (or last analyzed) values. The job plans from a copy of them in its own thread.
+        list_model = self.list_model
+
+        return functools.partial(get_row_analyses, dict(list_model.rows), array('b', list_model.tag_exists),
+                                 array('d', list_model.db_gain), array('d', list_model.album_gain))
+
+    def update_plan(self):
+        if self.job is None or self.operation_plan is not None:
+            return
+
+        plan = self.job.get_plan()
+        if plan is None:
+            return
+
+        self.operation_plan = plan
+
+        # Unchanged files need neither progress nor a refresh
+        self.operation_result_files.update(plan["unchanged"])
+        self.total_files = self.total_files - len(plan["unchanged"])
+        self.num_albums = len(plan["groups"])
+        self.expected_num_results = self.job.expected_results
+
+    def read_next_batch(self):
+        entries = []
 
-        for idx, folder in enumerate(mp3_list):
-            progress_text = "Processed"
-            if operation == "apply_gain":
-                progress_text = "Applying gain to"
-                expected_num_results = self.mp3gain.set_volume(src=mp3_list[folder],
-                                                               volume=self.target_volume,
-                                                               use_album_gain=album_analysis)
-            elif operation == "analyze":
-                progress_text = "Analyzing"
-                expected_num_results = self.mp3gain.get_file_analysis(src=mp3_list[folder],
-                                                                      stored_only=False,
-                                                                      album_analysis=album_analysis)
-            elif operation == "read":
-                progress_text = "Reading"
-                expected_num_results = self.mp3gain.get_file_analysis(src=mp3_list[folder],
-                                                                      stored_only=True,
-                                                                      album_analysis=album_analysis)
-            elif operation == "undo_gain":
-                progress_text = "Undoing gain on"
-                expected_num_results = self.mp3gain.undo_gain(src=mp3_list[folder])
-            elif operation == "delete_tags":
-                progress_text = "Deleting tags from"
-                expected_num_results = self.mp3gain.delete_tags(src=mp3_list[folder])
-
-            result = []
-            entry_idx = 0
-            num_entries = len(mp3_list[folder])
-
-            while self.mp3gain.is_running():
-                try:
-                    entry = self.mp3gain.get_result(timeout=0.01)
-
-                    prg_txt = "({}/{}) {} \'{}\'".format(entry_idx + 1, expected_num_results,
-                                                         progress_text, clip_text(entry["File"], 128))
-                    if len(mp3_list) > 1:
-                        self.mp3gain_progress.emit(prg_txt, entry_idx, num_entries, total_idx, total_files)
-                    else:
-                        self.mp3gain_progress.emit(prg_txt, entry_idx, num_entries, 0, 0)
-
-                    self.update_row_by_file(entry["File"], entry)
-
-                    entry_idx = entry_idx + 1
-                    total_idx = total_idx + 1
-
-                    result.append(entry)
-                except queue.Empty:
-                    QApplication.processEvents()
-
-            if operation in ["analyze", "apply_gain", "undo_gain", "delete_tags"]:
-                self.refresh_list(mp3_list[folder])
-
-        total_time = time_as_display(time.time() - start_time)
+        for entry in self.operation_stored_results:
+            entries.append(entry)
+            if len(entries) >= READ_BATCH_SIZE:
+                break
+
+        self.process_results(entries)
+
+        if len(entries) < READ_BATCH_SIZE or self.operation_cancelled:
+            self.operation_stored_results = None
+            self.end_operation()
+        else:
+            QtCore.QTimer.singleShot(0, self.read_next_batch)
+
+    def on_results_ready(self):
+        if not self.waiting_for_results:
+            return
+
+        # The plan is set before the job's first result
+        self.update_plan()
+
+        entries = self.job.get_results()
+        self.metrics.observe("gui_result_batch", len(entries), buckets=SIZE_BUCKETS, operation=self.operation)
+
+        self.albums_done = self.albums_done + len(self.job.get_completed_groups())
+        self.process_results(entries)
+
+        if self.job.is_running():
+            # Pick up stragglers that arrive after the worker's last notification
+            self.result_timer.start()
+        else:
+            self.result_timer.stop()
+            self.waiting_for_results = False
+            self.job = None
+            self.end_operation()
+
+    def process_results(self, entries):
+        if len(entries) == 0:
+            return
+
+        start_time = time.monotonic()
+
+        if self.operation == "read":
+            self.update_rows(entries)
+        else:
+            analyses = []
+
+            for entry in entries:
+                analysis = self.get_refreshed_analysis(entry)
+                if analysis is None:
+                    self.operation_refresh.append(entry["File"])
+                    analysis = entry
+
+                self.operation_result_files.add(entry["File"])
+                analyses.append(analysis)
+
+            self.update_rows(analyses)
+
+        end_time = time.monotonic()
+        self.metrics.observe("gui_update_seconds", end_time - start_time, operation=self.operation)
+        self.mp3gain.add_span("results", "gui", start_time, end_time, {"results": len(entries)})
+        self.metrics.inc("gui_rows_updated_total", len(entries), operation=self.operation)
+
+        self.total_idx = self.total_idx + len(entries)
+
+        prg_txt = "({}/{}) {} \'{}\'".format(self.total_idx, self.expected_num_results,
+                                             self.operation_progress_text, clip_text(entries[-1]["File"], 128))
+        if self.operation != "read" and self.num_albums > 1:
+            prg_txt = prg_txt + " (album {}/{})".format(self.albums_done, self.num_albums)
+            self.mp3gain_progress.emit(prg_txt, self.albums_done, self.num_albums, self.total_idx, self.total_files)
+        else:
+            self.mp3gain_progress.emit(prg_txt, self.total_idx, self.total_files, 0, 0)
+
+    def end_operation(self):
+        refresh = []
+
+        if self.operation != "read":
+            # Only re-read tags for files whose new values couldn't be worked out from mp3gain's output
+            # Files a cancelled operation didn't get to are unchanged
+            refresh = self.operation_refresh
+            if not self.operation_cancelled:
+                for mp3_file in self.operation_files:
+                    if mp3_file not in self.operation_result_files:
+                        refresh.append(mp3_file)
+
+        self.operation_refresh = []
+        self.operation_result_files = set()
+
+        if len(refresh) > 0:
+            self.operation_stored_results = self.mp3gain.iter_stored_analysis(refresh)
+            QtCore.QTimer.singleShot(0, self.refresh_next_batch)
+        else:
+            self.process_finished()
+
+    def get_refreshed_analysis(self, entry):
+        operation = self.operation
+
+        if operation == "delete_tags":
+            return {"File": entry["File"], "tag_exists": False}
+
+        # Album gain changes and undo output don't contain enough to derive the stored tags, nor does a resumed job
+        # that may have used another target volume
+        if self.operation_album_analysis or operation not in ["analyze", "apply_gain"] or \
+                self.operation_resume is not None:
+            return None
+
+        row = self.list_model.get_row(entry["File"])
+        if "MP3 gain" not in entry or "dB gain" not in entry or row is None:
+            return None
+
+        analysis = dict(entry)
+        analysis["tag_exists"] = True
+
+        album_db_gain = self.list_model.album_gain[row]
+        if not math.isnan(album_db_gain):
+            analysis["Album dB gain"] = album_db_gain
+
+        if operation == "apply_gain":
+            analysis["dB gain"] = analysis["dB gain"] - get_volume_offset(self.target_volume)
+            analysis = apply_gain_change(analysis, entry["MP3 gain"])
+
+        return analysis
+
+    def process_finished(self):
+        operation = self.operation
+        total_idx = self.total_idx
+
+        elapsed = time.time() - self.operation_start_time
+        total_time = time_as_display(elapsed)
+
+        self.metrics.observe("gui_operation_seconds", elapsed, operation=operation)
+        if elapsed > 0:
+            self.metrics.set("gui_rows_per_second", total_idx / elapsed, operation=operation)
         if operation == "analyze":
             msg = "Analyzed {} files.".format(total_idx)
         elif operation == "apply_gain":
@@ -219,8 +486,23 @@ class PyMP3List(QTableWidget):
         else:
             msg = "Processed {} files.".format(total_idx)
 
+        plan = self.operation_plan
+        if plan is not None and len(plan["unchanged"]) > 0:
+            msg = msg + " {} already at the target volume.".format(len(plan["unchanged"]))
+        if plan is not None and len(plan["analysis"]) > 0:
+            msg = msg + " {} analyzed first.".format(len(plan["analysis"]))
+
+        if self.operation_cancelled:
+            msg = "Cancelled after {} of {} files.".format(total_idx, self.total_files)
+
         msg = msg + " ({})".format(total_time)
 
+        self.operation = None
+        self.operation_files = []
+        self.operation_groups = dict()
+        self.operation_plan = None
+        self.operation_resume = None
+
         self.process_done.emit(msg)
         self.setDisabled(False)
 
@@ -241,38 +523,20 @@ class PyMP3List(QTableWidget):
                           operation="delete_tags")
 
     def get_mp3s(self, by_folder=False, selected_only=False):
-        mp3_folders = dict()
-
-        self.mp3_list = dict()
-
-        rows = range(0, self.rowCount())
-
-        for row in rows:
-            self.mp3_list[self.item(row, FILENAME_COLUMN).text()] = row
-
         if selected_only:
-            mp3_list = []
-            indexes = self.selectedIndexes()
-            for index in indexes:
-                if index.column() == 0:
-                    row = index.row()
-                    mp3_list.append(self.item(row, FILENAME_COLUMN).text())
+            mp3_list = [self.list_model.get_path(row) for row in self.get_selected_rows()]
         else:
-            mp3_list = self.mp3_list
-
-        for mp3_file in mp3_list:
-            mp3 = Path(mp3_file)
-            if by_folder:
-                folder = str(mp3.parent)
-            else:
-                folder = "all"
+            mp3_list = self.list_model.paths
 
-            if folder not in mp3_folders.keys():
-                mp3_folders[folder] = []
+        return group_by_folder(mp3_list, by_folder)
 
-            mp3_folders[folder].append(mp3_file)
+    def get_selected_rows(self):
+        # From the selection ranges, one entry per row rather than per cell
+        rows = set()
+        for selection_range in self.selectionModel().selection():
+            rows.update(range(selection_range.top(), selection_range.bottom() + 1))
 
-        return mp3_folders
+        return sorted(rows)
 
     def get_gain_offset(self):
         db_gain = self.target_volume - self.base_volume
@@ -284,19 +548,7 @@ class PyMP3List(QTableWidget):
         self.analyze_list(selected_only=True)
 
     def remove_selected(self):
-        selected_indexes = self.selectedIndexes()
-
-        rows = []
-
-        for index in selected_indexes:
-            row = index.row()
-            if row not in rows:
-                rows.append(row)
-
-        for row in sorted(rows, reverse=True):
-            self.removeRow(row)
-
-        _ = self.get_mp3s()  # refresh the mp3list/row lookup table
+        self.list_model.remove_rows(self.get_selected_rows())
 
     def on_context_menu(self, pos):
         menu = QMenu(self)
@@ -316,3 +568,19 @@ class PyMP3List(QTableWidget):
 
         if event.key() == QtCore.Qt.Key_Delete:
             self.remove_selected()
+
+
+def get_row_analyses(rows, tag_exists, db_gain, album_gain, groups):
+    analyses = dict()
+
+    for folder in groups.values():
+        for mp3_file in folder:
+            row = rows.get(mp3_file)
+            analysis = dict()
+            if row is not None and tag_exists[row] and not math.isnan(db_gain[row]):
+                analysis["dB gain"] = db_gain[row]
+            if row is not None and tag_exists[row] and not math.isnan(album_gain[row]):
+                analysis["Album dB gain"] = album_gain[row]
+            analyses[mp3_file] = analysis
+
+    return analyses
@@ -0,0 +1,289 @@
+import os
+import math
+
+from array import array
+
+from PyQt5 import QtCore
+from PyQt5.QtGui import QBrush, QColor
+
+from lib.prediction import GAIN_UNKNOWN, CLIPPING_FLAG, OVERFLOW_FLAG
+
+FILE_COLUMN = 0
+FOLDER_COLUMN = 1
+VOLUME_COLUMN = 2
+GAIN_DB_COLUMN = 3
+GAIN_MP3_COLUMN = 4
+CLIPPING_COLUMN = 5
+ALBUM_GAIN_DB_COLUMN = 6
+PREDICTION_COLUMN = 7
+TAG_INFO_COLUMN = 8
+FILENAME_COLUMN = 9
+
+HEADERS = ["File", "Folder", "Volume", "Gain (dB)", "Gain (mp3)", "Clipping", "Album gain (dB)", "After gain",
+           "Tag Info", "$file"]
+
+TAG_UNKNOWN = -1
+# Removing more separate row ranges than this resets the model instead of signalling every range
+MAX_REMOVED_RANGES = 64
+
+
+class PyMP3ListModel(QtCore.QAbstractTableModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.paths = []
+        # path -> row, kept in step with paths on insert, removal and sorting
+        self.rows = dict()
+        self.tag_exists = array('b')
+        self.volume = array('d')
+        self.mp3_gain = array('d')
+        self.clipping = array('b')
+        self.album_gain = array('d')
+
+        # Kept for predicting what applying gain would do, see PyMP3List.update_predictions
+        self.db_gain = array('d')
+        self.peak = array('d')
+        self.min_gain = array('h')
+        self.max_gain = array('h')
+        self.prediction = array('b')
+
+        self.clipping_brush = QBrush(QColor(255, 0, 0))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+
+        return len(self.paths)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+
+        return len(HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return HEADERS[section]
+
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole:
+            return self.get_text(index.row(), index.column())
+        elif role == QtCore.Qt.ForegroundRole:
+            if self.clipping[index.row()]:
+                return self.clipping_brush
+
+        return None
+
+    def get_text(self, row, column):
+        path = self.paths[row]
+
+        if column == FILE_COLUMN:
+            return os.path.basename(path)
+        elif column == FOLDER_COLUMN:
+            return os.path.basename(os.path.dirname(path))
+        elif column == FILENAME_COLUMN:
+            return path
+        elif column == TAG_INFO_COLUMN:
+            if self.tag_exists[row] == TAG_UNKNOWN:
+                return ""
+            return str(bool(self.tag_exists[row]))
+
+        if self.tag_exists[row] != 1:
+            return ""
+
+        if column == VOLUME_COLUMN:
+            return "{:.2f}".format(self.volume[row])
+        elif column == GAIN_DB_COLUMN:
+            return format_float(self.mp3_gain[row] * 1.5)
+        elif column == GAIN_MP3_COLUMN:
+            return format_float(self.mp3_gain[row], "{:.0f}")
+        elif column == CLIPPING_COLUMN:
+            return "Yes" if self.clipping[row] else ""
+        elif column == ALBUM_GAIN_DB_COLUMN:
+            return format_float(self.album_gain[row], "{:.2f}")
+        elif column == PREDICTION_COLUMN:
+            return format_prediction(self.prediction[row])
+
+        return None
+
+    def get_path(self, row):
+        return self.paths[row]
+
+    def get_row(self, path):
+        return self.rows.get(path)
+
+    def has_path(self, path):
+        return path in self.rows
+
+    def get_columns(self):
+        return [self.paths, self.tag_exists, self.volume, self.mp3_gain, self.clipping, self.album_gain,
+                self.db_gain, self.peak, self.min_gain, self.max_gain, self.prediction]
+
+    def update_rows_index(self, first_row=0):
+        rows = self.rows
+        paths = self.paths
+        for row in range(first_row, len(paths)):
+            rows[paths[row]] = row
+
+    def append_files(self, mp3_files):
+        if len(mp3_files) == 0:
+            return
+
+        first_row = len(self.paths)
+        num_rows = len(mp3_files)
+
+        self.beginInsertRows(QtCore.QModelIndex(), first_row, first_row + num_rows - 1)
+        self.paths.extend(mp3_files)
+        self.update_rows_index(first_row)
+        self.tag_exists.extend([TAG_UNKNOWN] * num_rows)
+        self.volume.extend([math.nan] * num_rows)
+        self.mp3_gain.extend([math.nan] * num_rows)
+        self.clipping.extend([0] * num_rows)
+        self.album_gain.extend([math.nan] * num_rows)
+        self.db_gain.extend([math.nan] * num_rows)
+        self.peak.extend([math.nan] * num_rows)
+        self.min_gain.extend([GAIN_UNKNOWN] * num_rows)
+        self.max_gain.extend([GAIN_UNKNOWN] * num_rows)
+        self.prediction.extend([0] * num_rows)
+        self.endInsertRows()
+
+    def removeRows(self, row, count, parent=QtCore.QModelIndex()):
+        if count <= 0 or row < 0 or row + count > len(self.paths):
+            return False
+
+        self.beginRemoveRows(parent, row, row + count - 1)
+        for path in self.paths[row:row + count]:
+            del self.rows[path]
+        for column in self.get_columns():
+            del column[row:row + count]
+        self.update_rows_index(row)
+        self.endRemoveRows()
+
+        return True
+
+    def remove_rows(self, rows):
+        # Any set of rows in one go, renumbering only the rows after the first removed one
+        rows = sorted(set(rows))
+        if len(rows) == 0:
+            return
+
+        for row in rows:
+            del self.rows[self.paths[row]]
+
+        ranges = get_ranges(rows)
+        if len(ranges) <= MAX_REMOVED_RANGES:
+            for first_row, last_row in reversed(ranges):
+                self.beginRemoveRows(QtCore.QModelIndex(), first_row, last_row)
+                for column in self.get_columns():
+                    del column[first_row:last_row + 1]
+                self.endRemoveRows()
+        else:
+            # Scattered selections: filter every column once
+            removed = set(rows)
+            kept = [row for row in range(rows[0], len(self.paths)) if row not in removed]
+
+            self.beginResetModel()
+            for column in self.get_columns():
+                column[rows[0]:] = get_items(column, kept)
+            self.endResetModel()
+
+        self.update_rows_index(rows[0])
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        keys = self.get_sort_keys(column)
+        if keys is None:
+            return
+
+        order_rows = sorted(range(len(self.paths)), key=keys.__getitem__,
+                            reverse=order == QtCore.Qt.DescendingOrder)
+
+        self.layoutAboutToBeChanged.emit()
+        old_indexes = self.persistentIndexList()
+        new_rows = [0] * len(order_rows)
+        for new_row, old_row in enumerate(order_rows):
+            new_rows[old_row] = new_row
+        self.changePersistentIndexList(old_indexes, [self.index(new_rows[index.row()], index.column())
+                                                     for index in old_indexes])
+
+        for values in self.get_columns():
+            values[:] = get_items(values, order_rows)
+        self.update_rows_index()
+        self.layoutChanged.emit()
+
+    def get_sort_keys(self, column):
+        # Rows without a value (no tag, not analyzed) are kept together at one end
+        if column == FILE_COLUMN:
+            return [os.path.basename(path).lower() for path in self.paths]
+        elif column == FOLDER_COLUMN:
+            return [os.path.basename(os.path.dirname(path)).lower() for path in self.paths]
+        elif column == FILENAME_COLUMN:
+            return self.paths
+        elif column == TAG_INFO_COLUMN:
+            return [(value == TAG_UNKNOWN, value) for value in self.tag_exists]
+
+        values = {VOLUME_COLUMN: self.volume, GAIN_DB_COLUMN: self.mp3_gain, GAIN_MP3_COLUMN: self.mp3_gain,
+                  CLIPPING_COLUMN: self.clipping, ALBUM_GAIN_DB_COLUMN: self.album_gain,
+                  PREDICTION_COLUMN: self.prediction}.get(column)
+        if values is None:
+            return None
+
+        return [(tag_exists != 1 or math.isnan(value), 0 if math.isnan(value) else value)
+                for tag_exists, value in zip(self.tag_exists, values)]
+
+    def set_row(self, row, tag_exists, volume=math.nan, mp3_gain=math.nan, clipping=False, album_gain=math.nan,
+                db_gain=math.nan, peak=math.nan, min_gain=GAIN_UNKNOWN, max_gain=GAIN_UNKNOWN):
+        self.tag_exists[row] = 1 if tag_exists else 0
+        self.volume[row] = volume
+        self.mp3_gain[row] = mp3_gain
+        self.clipping[row] = 1 if clipping else 0
+        self.album_gain[row] = album_gain
+        self.db_gain[row] = db_gain
+        self.peak[row] = peak
+        self.min_gain[row] = min_gain
+        self.max_gain[row] = max_gain
+
+    def set_predictions(self, first_row, flags):
+        self.prediction[first_row:first_row + len(flags)] = array('b', flags)
+
+    def emit_rows_changed(self, first_row, last_row):
+        self.dataChanged.emit(self.index(first_row, 0), self.index(last_row, len(HEADERS) - 1))
+
+
+def get_ranges(rows):
+    # Sorted rows -> [(first, last)] of consecutive rows
+    ranges = []
+
+    for row in rows:
+        if len(ranges) > 0 and ranges[-1][1] == row - 1:
+            ranges[-1] = (ranges[-1][0], row)
+        else:
+            ranges.append((row, row))
+
+    return ranges
+
+
+def get_items(values, rows):
+    if isinstance(values, array):
+        return array(values.typecode, [values[row] for row in rows])
+
+    return [values[row] for row in rows]
+
+
+def format_prediction(flags):
+    if flags == CLIPPING_FLAG | OVERFLOW_FLAG:
+        return "Clips, overflows"
+    elif flags == CLIPPING_FLAG:
+        return "Clips"
+    elif flags == OVERFLOW_FLAG:
+        return "Overflows"
+
+    return ""
+
+
+def format_float(value, float_format="{}"):
+    if math.isnan(value):
+        return ""
+
+    return float_format.format(value)
@@ -1,5 +1,7 @@
 from .PyMP3GainStatus import PyMP3GainStatus
 from .ValueEntry import ValueEntry
 from .PreferencesDialog import PreferencesDialog
+from .DirectoryScanner import DirectoryScanner
+from .PyMP3ListModel import PyMP3ListModel
 from .PyMP3List import PyMP3List
 from .PyMP3GainApp import PyMP3GainApp
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from lib.FrameIndex import FrameIndex
+
+CACHE_MAX_ENTRIES = 250000
+FRAME_INDEX_MAX_ENTRIES = 5000
+HASH_BLOCK_SIZE = 65536
+
+
+class AnalysisCache(object):
+    def __init__(self, cache_file, max_entries=None, verify_hash=False, max_frame_indexes=None):
+        self.cache_file = cache_file
+
+        if max_entries is None:
+            self.max_entries = CACHE_MAX_ENTRIES
+        else:
+            self.max_entries = max_entries
+
+        # Frame indexes are much bigger than analysis results, so far fewer of them are kept
+        if max_frame_indexes is None:
+            self.max_frame_indexes = FRAME_INDEX_MAX_ENTRIES
+        else:
+            self.max_frame_indexes = max_frame_indexes
+
+        self.verify_hash = verify_hash
+        self.lock = threading.Lock()
+
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, "
+                                "mtime INTEGER, hash TEXT, result TEXT, last_used REAL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS albums (album_key TEXT PRIMARY KEY, results TEXT, "
+                                "last_used REAL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS frame_indexes (path TEXT PRIMARY KEY, size INTEGER, "
+                                "mtime INTEGER, hash TEXT, frame_index BLOB, last_used REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS albums_last_used ON albums (last_used)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS frame_indexes_last_used ON frame_indexes (last_used)")
+        self.connection.commit()
+
+    def get_file_key(self, mp3_file):
+        try:
+            stat = os.stat(mp3_file)
+        except OSError:
+            return None
+
+        if self.verify_hash:
+            file_hash = get_partial_hash(mp3_file, stat.st_size)
+        else:
+            file_hash = None
+
+        return stat.st_size, stat.st_mtime_ns, file_hash
+
+    def get_album_key(self, mp3_files):
+        album_hash = hashlib.sha1()
+
+        for mp3_file in sorted(mp3_files):
+            file_key = self.get_file_key(mp3_file)
+            if file_key is None:
+                return None
+
+            album_hash.update(json.dumps([mp3_file, file_key]).encode('utf8'))
+
+        return album_hash.hexdigest()
+
+    def get(self, mp3_file):
+        results, _ = self.get_many([mp3_file])
+
+        if len(results) == 0:
+            return None
+
+        return results[0]
+
+    def get_many(self, mp3_files):
+        results = []
+        misses = []
+        hits = []
+
+        with self.lock:
+            for mp3_file in mp3_files:
+                file_key = self.get_file_key(mp3_file)
+                row = None
+
+                if file_key is not None:
+                    row = self.connection.execute("SELECT size, mtime, hash, result FROM files WHERE path = ?",
+                                                  (mp3_file,)).fetchone()
+
+                if row is None or row[0] != file_key[0] or row[1] != file_key[1] or \
+                        (self.verify_hash and row[2] != file_key[2]):
+                    misses.append(mp3_file)
+                    continue
+
+                results.append(json.loads(row[3]))
+                hits.append(mp3_file)
+
+            if len(hits) > 0:
+                now = time.time()
+                self.connection.executemany("UPDATE files SET last_used = ? WHERE path = ?",
+                                            [(now, mp3_file) for mp3_file in hits])
+                self.connection.commit()
+
+        return results, misses
+
+    def put_many(self, results):
+        rows = []
+        now = time.time()
+
+        for result in results:
+            file_key = self.get_file_key(result["File"])
+            if file_key is None:
+                continue
+
+            rows.append((result["File"], file_key[0], file_key[1], file_key[2], json.dumps(result), now))
+
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.evict("files")
+            self.connection.commit()
+
+    def get_album(self, mp3_files):
+        album_key = self.get_album_key(mp3_files)
+        if album_key is None:
+            return None
+
+        with self.lock:
+            row = self.connection.execute("SELECT results FROM albums WHERE album_key = ?",
+                                          (album_key,)).fetchone()
+            if row is None:
+                return None
+
+            self.connection.execute("UPDATE albums SET last_used = ? WHERE album_key = ?", (time.time(), album_key))
+            self.connection.commit()
+
+        return json.loads(row[0])
+
+    def put_album(self, mp3_files, results):
+        album_key = self.get_album_key(mp3_files)
+        if album_key is None:
+            return
+
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO albums VALUES (?, ?, ?)",
+                                    (album_key, json.dumps(results), time.time()))
+            self.evict("albums")
+            self.connection.commit()
+
+    def get_frame_index(self, mp3_file):
+        file_key = self.get_file_key(mp3_file)
+        if file_key is None:
+            return None
+
+        with self.lock:
+            row = self.connection.execute("SELECT size, mtime, hash, frame_index FROM frame_indexes WHERE path = ?",
+                                          (mp3_file,)).fetchone()
+
+            if row is None or row[0] != file_key[0] or row[1] != file_key[1] or \
+                    (self.verify_hash and row[2] != file_key[2]):
+                return None
+
+            self.connection.execute("UPDATE frame_indexes SET last_used = ? WHERE path = ?", (time.time(), mp3_file))
+            self.connection.commit()
+
+        return FrameIndex.from_bytes(row[3])
+
+    def put_frame_index(self, mp3_file, frame_index):
+        file_key = self.get_file_key(mp3_file)
+        if file_key is None:
+            return
+
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO frame_indexes VALUES (?, ?, ?, ?, ?, ?)",
+                                    (mp3_file, file_key[0], file_key[1], file_key[2], frame_index.to_bytes(),
+                                     time.time()))
+            self.evict("frame_indexes", self.max_frame_indexes)
+            self.connection.commit()
+
+    def evict(self, table, max_entries=None):
+        if max_entries is None:
+            max_entries = self.max_entries
+
+        num_entries = self.connection.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+
+        if num_entries > max_entries:
+            # Drop the least recently used entries, with some slack so we don't evict on every insert
+            num_evict = num_entries - max_entries + max_entries // 20
+            self.connection.execute("DELETE FROM {0} WHERE rowid IN (SELECT rowid FROM {0} "
+                                    "ORDER BY last_used LIMIT ?)".format(table), (num_evict,))
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM files")
+            self.connection.execute("DELETE FROM albums")
+            self.connection.execute("DELETE FROM frame_indexes")
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def get_partial_hash(mp3_file, size):
+    file_hash = hashlib.blake2b(digest_size=16)
+
+    try:
+        with open(mp3_file, 'rb') as mp3:
+            file_hash.update(mp3.read(HASH_BLOCK_SIZE))
+            if size > HASH_BLOCK_SIZE:
+                mp3.seek(max(HASH_BLOCK_SIZE, size - HASH_BLOCK_SIZE))
+                file_hash.update(mp3.read(HASH_BLOCK_SIZE))
+    except OSError:
+        return None
+
+    return file_hash.hexdigest()
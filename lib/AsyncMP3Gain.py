@@ -0,0 +1,245 @@
+import asyncio
+import subprocess
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.util import get_groups
+from lib.MP3Gain import MP3Gain, MP3_GAIN_SUGGESTED_VOLUME, ENCODING, get_fallback_info, get_schedule, \
+    ignore_interrupts
+from lib.ResultParser import ResultParser
+from lib.ChunkProgress import ChunkProgress
+
+OPERATIONS = ["analyze", "apply", "undo", "delete-tags"]
+STREAM_LIMIT = 1024 * 1024
+
+
+class AsyncMP3Gain(object):
+    def __init__(self, mp3gain=None, max_processes=None):
+        # Settings (binary, batch sizes, cache, native jobs) and result parsing come from a regular MP3Gain
+        if mp3gain is None:
+            self.mp3gain = MP3Gain()
+        else:
+            self.mp3gain = mp3gain
+
+        if max_processes is None:
+            self.max_processes = 0
+        else:
+            self.max_processes = max_processes
+
+        # Created on first use, so they belong to the loop they're used in
+        self.semaphore = None
+        self.native_executor = None
+
+    def get_num_processes(self):
+        if self.max_processes > 0:
+            return self.max_processes
+
+        return self.mp3gain.get_num_processes()
+
+    def get_semaphore(self):
+        # Shared by every call, so concurrent calls together stay within the process limit
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.get_num_processes())
+
+        return self.semaphore
+
+    def get_native_executor(self):
+        if self.native_executor is None:
+            self.native_executor = ProcessPoolExecutor(max_workers=self.get_num_processes(),
+                                                       mp_context=multiprocessing.get_context("spawn"),
+                                                       initializer=ignore_interrupts)
+
+        return self.native_executor
+
+    def close(self):
+        if self.native_executor is not None:
+            self.native_executor.shutdown()
+            self.native_executor = None
+
+    async def analyze(self, src, album_analysis=False, ordered=False):
+        return [result async for result in self.stream(src, "analyze", album=album_analysis, ordered=ordered)]
+
+    async def set_volume(self, src, volume, use_album_gain=False, ordered=False):
+        return [result async for result in self.stream(src, "apply", album=use_album_gain, volume=volume,
+                                                       ordered=ordered)]
+
+    async def undo_gain(self, src, ordered=False):
+        return [result async for result in self.stream(src, "undo", ordered=ordered)]
+
+    async def delete_tags(self, src, ordered=False):
+        return [result async for result in self.stream(src, "delete-tags", ordered=ordered)]
+
+    async def stream(self, src, operation="analyze", album=False, volume=MP3_GAIN_SUGGESTED_VOLUME, ordered=False):
+        if operation not in OPERATIONS:
+            raise ValueError("unknown operation {}".format(operation))
+
+        cached_results, cmd_list = self.get_cmd_list(src, operation, album, volume)
+
+        for result in cached_results:
+            yield result
+
+        results = asyncio.Queue()
+        tasks = dict()
+
+        for idx in get_schedule(cmd_list):
+            if ordered:
+                tasks[idx] = asyncio.ensure_future(self.run_cmd(cmd_list[idx]))
+            else:
+                tasks[idx] = asyncio.ensure_future(self.run_cmd(cmd_list[idx], results))
+
+        try:
+            if ordered:
+                for idx in range(len(cmd_list)):
+                    for result in await tasks[idx]:
+                        yield result
+            else:
+                # Every task ends its results with None
+                pending = len(tasks)
+                while pending > 0:
+                    result = await results.get()
+                    if result is None:
+                        pending = pending - 1
+                    else:
+                        yield result
+
+                for task in tasks.values():
+                    task.result()
+        finally:
+            # The caller stopped early (or a run failed), so don't leave mp3gain running. Cancelled runs terminate
+            # their process and wait for it, so none is left behind once this returns.
+            for task in tasks.values():
+                task.cancel()
+
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    def get_cmd_list(self, src, operation, album, volume):
+        mp3gain = self.mp3gain
+        groups = get_groups(src)
+        cached_results = []
+        store_results = False
+
+        if operation == "analyze":
+            cmd = mp3gain.get_analysis_cmd(album_analysis=album)
+            native_job = mp3gain.get_native_analysis_job(album)
+
+            if mp3gain.cache is not None:
+                cached_results, groups = mp3gain.get_cached_analysis(groups, album)
+                mp3gain.metrics.inc("cache_hits_total", len(cached_results), operation=operation)
+                store_results = True
+        elif operation == "apply":
+            cmd = mp3gain.get_volume_cmd(volume, album)
+            native_job = mp3gain.get_native_volume_job(volume, album)
+        elif operation == "undo":
+            album = False
+            cmd = mp3gain.get_undo_cmd()
+            native_job = mp3gain.get_native_undo_job()
+        elif operation == "delete-tags":
+            album = False
+            cmd = mp3gain.get_delete_tags_cmd()
+            native_job = None
+        else:
+            raise ValueError("unknown operation {}".format(operation))
+
+        return cached_results, mp3gain.get_cmd_list(cmd, groups, album, store_results, native_job, operation)
+
+    async def run_cmd(self, cmd_info, results=None):
+        try:
+            if cmd_info.native_job is None:
+                return await self.run_mp3gain_cmd(cmd_info, results)
+
+            return await self.run_native_job(cmd_info, results)
+        finally:
+            if results is not None:
+                results.put_nowait(None)
+
+    async def run_native_job(self, cmd_info, results=None):
+        loop = asyncio.get_running_loop()
+
+        async with self.get_semaphore():
+            start_time = loop.time()
+            native_results, fallback_files = await loop.run_in_executor(self.get_native_executor(),
+                                                                        self.mp3gain.get_native_call(cmd_info))
+            self.mp3gain.update_native_metrics(cmd_info, native_results, fallback_files, loop.time() - start_time)
+
+        self.mp3gain.store_results(native_results, cmd_info.album, cmd_info.store_results)
+
+        if results is not None:
+            for result in native_results:
+                results.put_nowait(result)
+
+        fallback_info = get_fallback_info(cmd_info, fallback_files)
+        if fallback_info is not None:
+            native_results = native_results + await self.run_mp3gain_cmd(fallback_info, results)
+
+        return native_results
+
+    async def run_mp3gain_cmd(self, cmd_info, results=None):
+        loop = asyncio.get_running_loop()
+        progress = ChunkProgress(cmd_info)
+        cmd_results = []
+
+        def add_record(record, cancelled=False):
+            if not progress.add_record(record, cancelled):
+                return
+
+            result = record.as_dict()
+            cmd_results.append(result)
+            if results is not None:
+                results.put_nowait(result)
+
+        async with self.get_semaphore():
+            start_time = loop.time()
+            console_process = await asyncio.create_subprocess_exec(*cmd_info.cmd,
+                                                                   stdin=subprocess.DEVNULL,
+                                                                   stdout=subprocess.PIPE,
+                                                                   stderr=subprocess.DEVNULL,
+                                                                   limit=STREAM_LIMIT)
+            spawn_time = loop.time() - start_time
+            parser = None
+
+            try:
+                parser = ResultParser((await console_process.stdout.readline()).decode(ENCODING))
+
+                async for line in console_process.stdout:
+                    record = parser.parse_line(line.decode(ENCODING))
+                    if record is not None:
+                        add_record(record)
+
+                await console_process.wait()
+            except asyncio.CancelledError:
+                # A run that writes goes on to the next result line (or to its end) before it's stopped, same as the
+                # threaded front end, and is reaped before the cancellation goes on
+                if not progress.can_stop():
+                    if parser is None:
+                        parser = ResultParser((await console_process.stdout.readline()).decode(ENCODING))
+
+                    while not progress.stopped:
+                        line = await console_process.stdout.readline()
+                        if len(line) == 0:
+                            break
+
+                        record = parser.parse_line(line.decode(ENCODING))
+                        if record is not None:
+                            add_record(record, cancelled=True)
+
+                if console_process.returncode is None and (progress.stopped or progress.can_stop()):
+                    try:
+                        console_process.terminate()
+                    except ProcessLookupError:
+                        pass
+                await console_process.wait()
+                progress.finish(console_process.returncode)
+                raise
+
+            progress.finish(console_process.returncode)
+
+        elapsed = loop.time() - start_time
+        self.mp3gain.update_throughput(cmd_info, elapsed)
+        self.mp3gain.update_process_metrics(cmd_info, spawn_time, elapsed)
+        self.mp3gain.metrics.inc("results_total", len(cmd_results), operation=cmd_info.operation, source="mp3gain")
+        self.mp3gain.add_span("mp3gain", "chunk", start_time, start_time + elapsed,
+                              {"files": cmd_info.num_files, "operation": cmd_info.operation})
+        self.mp3gain.store_results(cmd_results, cmd_info.album, cmd_info.store_results)
+
+        return cmd_results
@@ -0,0 +1,83 @@
+import os
+
+# Operations that write files
+WRITE_OPERATIONS = ["apply", "undo", "delete-tags"]
+
+
+class ChunkProgress(object):
+    # Follows the result lines of one mp3gain run to tell which of its files are written and where the run can be
+    # stopped, for both the threaded and the asyncio front end
+    def __init__(self, cmd_info, complete_files=None):
+        self.cmd_info = cmd_info
+        self.complete_files = complete_files
+
+        # mp3gain prints a file's result line before writing the file, so it's only written once the next line arrives.
+        # Only files written to a temporary copy (-t) can be cut off safely there; files patched in place and album
+        # gain, which is written after the whole album is analyzed, run to the end.
+        self.writes = cmd_info.operation in WRITE_OPERATIONS
+        self.confirm_files = self.writes and not cmd_info.album
+        self.stop_between_files = self.confirm_files and "-t" in cmd_info.cmd[:-cmd_info.num_files]
+
+        self.last_file = None
+        self.dropped_file = None
+        self.stopped = False
+
+    def add_record(self, record, cancelled=False):
+        # Returns whether the record is reported; stopped is set once the run should be terminated
+        if self.confirm_files:
+            if self.last_file is not None:
+                self.complete([self.last_file])
+
+            # The previous file is written, this one is about to be: stop here and don't report it
+            if cancelled and self.stop_between_files:
+                self.stopped = True
+                self.dropped_file = record.file
+                return False
+
+            self.last_file = record.file
+        elif cancelled and not self.writes:
+            # Analysis doesn't write anything, a result line means mp3gain is done with that file
+            self.stopped = True
+
+        return True
+
+    def can_stop(self):
+        # Whether a cancelled run may be terminated before its next result line
+        return not self.writes
+
+    def finish(self, returncode):
+        if self.dropped_file is not None:
+            restore_temp_file(self.dropped_file)
+
+        # Everything is written once mp3gain exits cleanly, including the last file and album runs
+        if self.writes and returncode == 0:
+            self.complete(self.cmd_info.cmd[-self.cmd_info.num_files:])
+
+    def complete(self, mp3_files):
+        if self.complete_files is not None:
+            self.complete_files(mp3_files)
+
+
+def get_temp_file(mp3_file):
+    # Where mp3gain -t writes a file before replacing the original: the extension becomes TMP, or .TMP is appended
+    # to a name that already ends in tmp
+    if mp3_file[-3:].lower() == "tmp":
+        return mp3_file + ".TMP"
+
+    return mp3_file[:-3] + "TMP"
+
+
+def restore_temp_file(mp3_file):
+    # mp3gain was stopped while writing this file: either the original is still there next to a partial temp file,
+    # or mp3gain had already removed it and only the complete temp file is left to rename
+    temp_file = get_temp_file(mp3_file)
+    if not os.path.exists(temp_file):
+        return
+
+    try:
+        if os.path.exists(mp3_file):
+            os.remove(temp_file)
+        else:
+            os.replace(temp_file, mp3_file)
+    except OSError:
+        print("Error cleaning up {}.".format(temp_file))
@@ -0,0 +1,322 @@
+import sys
+import zlib
+import struct
+
+from array import array
+from functools import lru_cache
+
+MPEG1 = 3
+MPEG2 = 2
+MPEG_RESERVED = 1
+LAYER_III = 1
+MONO = 3
+BITRATES_MPEG1 = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0]
+BITRATES_MPEG2 = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0]
+SAMPLE_RATES = [44100, 48000, 32000, 0]
+GLOBAL_GAIN_OFFSET = 21
+MAX_GLOBAL_GAIN = 255
+CRC_POLY = 0x8005
+FRAME_INDEX_MAGIC = b"MP3I"
+FRAME_INDEX_VERSION = 1
+FRAME_INDEX_HEADER = "<4sHIQ"
+
+
+class FrameIndex(object):
+    def __init__(self, offsets=None, headers=None, gains=None):
+        # One entry per frame for offsets/headers, one per granule and channel for gains
+        self.offsets = array('Q') if offsets is None else offsets
+        self.headers = array('I') if headers is None else headers
+        self.gains = array('B') if gains is None else gains
+
+    @classmethod
+    def scan(cls, data, start=0, end=None):
+        frame_index = cls()
+
+        if end is None:
+            end = len(data)
+
+        for pos, header in iter_frames(data, start, end):
+            frame_index.offsets.append(pos)
+            frame_index.headers.append(header)
+
+            for _, bit_pos in get_global_gain_offsets(pos, header):
+                frame_index.gains.append(read_byte_at_bit(data, bit_pos))
+
+        return frame_index
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get_channels(self):
+        if len(self.headers) == 0:
+            return 0
+
+        return get_header_info(self.headers[0])[2]
+
+    def get_side_info_offset(self, idx):
+        return self.offsets[idx] + (6 if get_header_info(self.headers[idx])[3] else 4)
+
+    def get_min_max(self):
+        if len(self.gains) == 0:
+            return None
+
+        return min(self.gains), max(self.gains)
+
+    def iter_gain_positions(self):
+        gain_idx = 0
+
+        for pos, header in zip(self.offsets, self.headers):
+            for channel, bit_pos in get_global_gain_offsets(pos, header):
+                yield gain_idx, channel, bit_pos
+                gain_idx = gain_idx + 1
+
+    def check_frames(self, data):
+        # A cached index is only trusted where every frame header is still at its offset
+        for pos, header in zip(self.offsets, self.headers):
+            if pos + 4 > len(data) or get_header(data, pos) != header:
+                raise ValueError("frame index doesn't match the data")
+
+    def read_gains(self, data):
+        # Only the positions are reused, the gains are read from data again
+        self.check_frames(data)
+        self.gains = array('B', [read_byte_at_bit(data, bit_pos) for _, _, bit_pos in self.iter_gain_positions()])
+
+    def change_gain(self, data, left_change, right_change):
+        changes = [left_change, right_change]
+        if changes == [0, 0]:
+            return
+
+        self.check_frames(data)
+
+        for gain_idx, channel, bit_pos in self.iter_gain_positions():
+            gain = read_byte_at_bit(data, bit_pos)
+            if changes[channel] != 0:
+                # Like mp3gain without wrapping, saturate at the ends of the global_gain range
+                gain = clamp_gain(gain + changes[channel])
+                write_byte_at_bit(data, bit_pos, gain)
+            self.gains[gain_idx] = gain
+
+        for pos, header in zip(self.offsets, self.headers):
+            if get_header_info(header)[3]:
+                update_crc(data, pos, header)
+
+    def to_bytes(self):
+        if len(self.offsets) == 0:
+            return struct.pack(FRAME_INDEX_HEADER, FRAME_INDEX_MAGIC, FRAME_INDEX_VERSION, 0, 0)
+
+        # Offsets are stored as frame distances, which are few distinct values and compress well
+        distances = array('I', [self.offsets[idx] - self.offsets[idx - 1] for idx in range(1, len(self.offsets))])
+        headers = array('I', self.headers)
+
+        if sys.byteorder == "big":
+            distances.byteswap()
+            headers.byteswap()
+
+        return struct.pack(FRAME_INDEX_HEADER, FRAME_INDEX_MAGIC, FRAME_INDEX_VERSION, len(self.offsets),
+                           self.offsets[0]) + zlib.compress(distances.tobytes() + headers.tobytes() +
+                                                            self.gains.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        header_size = struct.calcsize(FRAME_INDEX_HEADER)
+        if len(data) < header_size:
+            return None
+
+        magic, version, num_frames, first_offset = struct.unpack_from(FRAME_INDEX_HEADER, data)
+        if magic != FRAME_INDEX_MAGIC or version != FRAME_INDEX_VERSION:
+            return None
+
+        if num_frames == 0:
+            return cls()
+
+        try:
+            arrays = zlib.decompress(data[header_size:])
+        except zlib.error:
+            return None
+
+        distances = array('I')
+        headers = array('I')
+        distances_size = (num_frames - 1) * distances.itemsize
+        headers_size = num_frames * headers.itemsize
+
+        distances.frombytes(arrays[0:distances_size])
+        headers.frombytes(arrays[distances_size:distances_size + headers_size])
+        gains = array('B', arrays[distances_size + headers_size:])
+
+        if sys.byteorder == "big":
+            distances.byteswap()
+            headers.byteswap()
+
+        offsets = array('Q', [first_offset])
+        for distance in distances:
+            offsets.append(offsets[-1] + distance)
+
+        frame_index = cls(offsets, headers, gains)
+        if sum(len(get_global_gain_offsets(0, header)) for header in headers) != len(gains):
+            return None
+
+        return frame_index
+
+
+@lru_cache(maxsize=4096)
+def get_header_info(header):
+    if header >> 21 != 0x7FF:
+        return None
+
+    version = (header >> 19) & 0x03
+    layer = (header >> 17) & 0x03
+    bitrate_idx = (header >> 12) & 0x0F
+    sample_rate_idx = (header >> 10) & 0x03
+
+    # Free format frames (bitrate index 0) can't be sized from the header, mp3gain doesn't support them either
+    if version == MPEG_RESERVED or layer != LAYER_III or bitrate_idx in [0, 15] or sample_rate_idx == 3:
+        return None
+
+    mpeg1 = version == MPEG1
+    padding = (header >> 9) & 0x01
+    channels = 1 if (header >> 6) & 0x03 == MONO else 2
+    crc = (header >> 16) & 0x01 == 0
+
+    if mpeg1:
+        frame_size = 144000 * BITRATES_MPEG1[bitrate_idx] // SAMPLE_RATES[sample_rate_idx] + padding
+    else:
+        sample_rate = SAMPLE_RATES[sample_rate_idx] >> (1 if version == MPEG2 else 2)
+        frame_size = 72000 * BITRATES_MPEG2[bitrate_idx] // sample_rate + padding
+
+    return frame_size, mpeg1, channels, crc
+
+
+def get_header(data, pos):
+    return struct.unpack_from(">I", data, pos)[0]
+
+
+def get_side_info_size(mpeg1, channels):
+    if mpeg1:
+        return 17 if channels == 1 else 32
+
+    return 9 if channels == 1 else 17
+
+
+def is_info_frame(data, pos, header):
+    _, mpeg1, channels, crc = get_header_info(header)
+
+    info_pos = pos + 4 + (2 if crc else 0) + get_side_info_size(mpeg1, channels)
+    if data[info_pos:info_pos + 4] in [b"Xing", b"Info"]:
+        return True
+
+    return data[pos + 36:pos + 40] == b"VBRI"
+
+
+def iter_frames(data, start, end):
+    pos = start
+    synced = False
+
+    while pos + 4 <= end:
+        header = get_header(data, pos)
+        frame_info = get_header_info(header)
+
+        if frame_info is not None and pos + frame_info[0] <= end:
+            next_pos = pos + frame_info[0]
+
+            # A single matching header may be a false sync, so the next frame has to match too
+            if synced or next_pos + 4 > end or get_header_info(get_header(data, next_pos)) is not None:
+                if synced or not is_info_frame(data, pos, header):
+                    yield pos, header
+
+                synced = True
+                pos = next_pos
+                continue
+
+        synced = False
+        pos = data.find(b"\xff", pos + 1, end)
+        if pos < 0:
+            return
+
+
+@lru_cache(maxsize=4096)
+def get_gain_bit_offsets(header):
+    _, mpeg1, channels, crc = get_header_info(header)
+
+    side_info = (6 if crc else 4) * 8
+
+    # Bits before the first granule: main_data_begin, private_bits and (MPEG1 only) scfsi
+    if mpeg1:
+        side_info = side_info + (18 if channels == 1 else 20)
+        granules = 2
+        block_size = 59
+    else:
+        side_info = side_info + (9 if channels == 1 else 10)
+        granules = 1
+        block_size = 63
+
+    offsets = []
+    for granule in range(granules):
+        for channel in range(channels):
+            offsets.append((channel, side_info + (granule * channels + channel) * block_size + GLOBAL_GAIN_OFFSET))
+
+    return tuple(offsets)
+
+
+def get_global_gain_offsets(pos, header):
+    return [(channel, pos * 8 + bit_pos) for channel, bit_pos in get_gain_bit_offsets(header)]
+
+
+def read_byte_at_bit(data, bit_pos):
+    byte_pos = bit_pos >> 3
+    shift = 8 - (bit_pos & 0x07)
+
+    return (((data[byte_pos] << 8) | data[byte_pos + 1]) >> shift) & 0xFF
+
+
+def write_byte_at_bit(data, bit_pos, value):
+    byte_pos = bit_pos >> 3
+    shift = 8 - (bit_pos & 0x07)
+
+    word = (data[byte_pos] << 8) | data[byte_pos + 1]
+    word = (word & ~(0xFF << shift)) | (value << shift)
+
+    data[byte_pos] = (word >> 8) & 0xFF
+    data[byte_pos + 1] = word & 0xFF
+
+
+def clamp_gain(gain):
+    return min(max(gain, 0), MAX_GLOBAL_GAIN)
+
+
+def fit_gain_change(change, gain_min, gain_max):
+    # The largest part of change that takes no global_gain between gain_min and gain_max past 0 or 255
+    return min(max(change, -gain_min), MAX_GLOBAL_GAIN - gain_max)
+
+
+def get_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ CRC_POLY) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+
+    return table
+
+
+CRC_TABLE = get_crc_table()
+
+
+def get_crc(data, crc=0xFFFF):
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[(crc >> 8) ^ byte]
+
+    return crc
+
+
+def update_crc(data, pos, header):
+    _, mpeg1, channels, _ = get_header_info(header)
+
+    side_info_size = get_side_info_size(mpeg1, channels)
+    crc = get_crc(data[pos + 6:pos + 6 + side_info_size], get_crc(data[pos + 2:pos + 4]))
+
+    data[pos + 4] = crc >> 8
+    data[pos + 5] = crc & 0xFF
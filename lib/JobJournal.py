@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+FILE_PLANNED = 0
+FILE_STARTED = 1
+FILE_COMPLETED = 2
+# Completions are committed in batches; a crash loses at most this much, and those files are simply run again
+COMMIT_INTERVAL = 0.5
+
+
+class JobJournal(object):
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_commit = 0
+
+        journal_dir = os.path.dirname(journal_file)
+        if journal_dir and not os.path.exists(journal_dir):
+            os.makedirs(journal_dir)
+
+        self.connection = sqlite3.connect(journal_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (job_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                "operation TEXT, params TEXT, created REAL, finished REAL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS files (job_id INTEGER, path TEXT, group_name TEXT, "
+                                "state INTEGER, PRIMARY KEY (job_id, path))")
+        self.connection.commit()
+
+    def create_job(self, operation, params, groups):
+        # Every file is planned before the first mp3gain process starts
+        with self.lock:
+            cursor = self.connection.execute("INSERT INTO jobs (operation, params, created) VALUES (?, ?, ?)",
+                                             (operation, json.dumps(params), time.time()))
+            job_id = cursor.lastrowid
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                        [(job_id, mp3_file, name, FILE_PLANNED)
+                                         for name in groups for mp3_file in groups[name]])
+            self.connection.commit()
+
+        return job_id
+
+    def start_files(self, job_id, mp3_files):
+        with self.lock:
+            self.write_pending()
+            self.connection.executemany("UPDATE files SET state = ? WHERE job_id = ? AND path = ? AND state < ?",
+                                        [(FILE_STARTED, job_id, mp3_file, FILE_STARTED) for mp3_file in mp3_files])
+            self.connection.commit()
+
+    def complete_files(self, job_id, mp3_files, flush=True):
+        with self.lock:
+            self.pending.extend((job_id, mp3_file) for mp3_file in mp3_files)
+
+            if flush or time.monotonic() - self.last_commit >= COMMIT_INTERVAL:
+                self.write_pending()
+                self.connection.commit()
+
+    def flush(self):
+        with self.lock:
+            self.write_pending()
+            self.connection.commit()
+
+    def write_pending(self):
+        if len(self.pending) > 0:
+            self.connection.executemany("UPDATE files SET state = ? WHERE job_id = ? AND path = ?",
+                                        [(FILE_COMPLETED, job_id, mp3_file) for job_id, mp3_file in self.pending])
+            self.pending = []
+
+        self.last_commit = time.monotonic()
+
+    def finish_job(self, job_id):
+        # Finished jobs are dropped, anything left unfinished (cancelled, failed files) stays resumable
+        with self.lock:
+            self.write_pending()
+
+            remaining = self.connection.execute("SELECT COUNT(*) FROM files WHERE job_id = ? AND state < ?",
+                                                (job_id, FILE_COMPLETED)).fetchone()[0]
+            if remaining == 0:
+                self.delete_job(job_id)
+            else:
+                self.connection.execute("UPDATE jobs SET finished = ? WHERE job_id = ?", (time.time(), job_id))
+
+            self.connection.commit()
+
+    def discard_job(self, job_id):
+        with self.lock:
+            self.delete_job(job_id)
+            self.connection.commit()
+
+    def delete_job(self, job_id):
+        self.connection.execute("DELETE FROM files WHERE job_id = ?", (job_id,))
+        self.connection.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def get_unfinished_jobs(self):
+        with self.lock:
+            self.write_pending()
+            self.connection.commit()
+
+            rows = self.connection.execute("SELECT jobs.job_id, operation, params, created, finished, COUNT(*), "
+                                           "SUM(state = ?), SUM(state = ?) FROM jobs JOIN files "
+                                           "ON jobs.job_id = files.job_id GROUP BY jobs.job_id "
+                                           "HAVING SUM(state < ?) > 0 ORDER BY jobs.job_id",
+                                           (FILE_STARTED, FILE_COMPLETED, FILE_COMPLETED)).fetchall()
+
+        return [{"job_id": row[0], "operation": row[1], "params": json.loads(row[2]), "created": row[3],
+                 "interrupted": row[4] is None, "total": row[5], "started": row[6], "completed": row[7]}
+                for row in rows]
+
+    def get_job(self, job_id):
+        # groups holds the unfinished files, partial_groups the groups that also have completed files
+        with self.lock:
+            self.write_pending()
+            self.connection.commit()
+
+            job = self.connection.execute("SELECT operation, params FROM jobs WHERE job_id = ?",
+                                          (job_id,)).fetchone()
+            if job is None:
+                return None
+
+            rows = self.connection.execute("SELECT path, group_name, state FROM files WHERE job_id = ? "
+                                           "ORDER BY rowid", (job_id,)).fetchall()
+
+        entry = {"job_id": job_id, "operation": job[0], "params": json.loads(job[1]), "groups": dict(),
+                 "all_groups": dict(), "partial_groups": []}
+
+        for mp3_file, name, state in rows:
+            entry["all_groups"].setdefault(name, []).append(mp3_file)
+            if state < FILE_COMPLETED:
+                entry["groups"].setdefault(name, []).append(mp3_file)
+
+        for name in entry["groups"]:
+            if len(entry["groups"][name]) < len(entry["all_groups"][name]):
+                entry["partial_groups"].append(name)
+
+        return entry
+
+    def close(self):
+        with self.lock:
+            self.write_pending()
+            self.connection.commit()
+            self.connection.close()
@@ -1,31 +1,93 @@
+import os
+import time
+import signal
 import subprocess
-import queue
 import threading
+import functools
+import multiprocessing
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError, as_completed
 
 from lib.util import *
+from lib.MP3GainJob import MP3GainJob
+from lib.Metrics import Metrics, SIZE_BUCKETS
+from lib.ResultParser import ResultParser, parse_output
+from lib.ChunkProgress import ChunkProgress, WRITE_OPERATIONS
+from lib.tags import get_stored_analysis, get_gain_change
+from lib.globalgain import apply_gain_files, undo_gain_files
 
 ENCODING = 'utf8'
 MP3_GAIN_BIN = "/usr/bin/mp3gain"
 MP3_GAIN_SUGGESTED_VOLUME = 89.0
-QUEUE_SIZE = 8192
+# Adaptive batches (max_files = 0) aim for runs of about BATCH_TIME seconds, with at least BATCHES_PER_PROCESS
+# batches per process so the last runs don't leave processes idle
+BATCH_TIME = 5.0
+BATCHES_PER_PROCESS = 4
+MAX_BATCH_FILES = 999
+DEFAULT_THROUGHPUT = 4 * 1024 * 1024
+THROUGHPUT_SMOOTHING = 0.3
+
+# One mp3gain run (or native job): the full command line ending in its num_files files, whether it's an album, whether
+# to cache the results, the native job if any, the group names it covers and the total file size if known
+Chunk = namedtuple("Chunk", ["cmd", "num_files", "album", "store_results", "native_job", "groups", "num_bytes",
+                             "operation"])
 
 
 class MP3Gain(object):
-    def __init__(self, mp3gain_bin=None, max_files=None):
+    def __init__(self, mp3gain_bin=None, max_files=None, max_processes=None, cache=None, drop_timeout=None,
+                 native_gain=False, native_analysis=False, temp_files=False, debug_output=False):
         if mp3gain_bin is None:
             self.mp3gain = MP3_GAIN_BIN
         else:
             self.mp3gain = mp3gain_bin
 
+        # 0 sizes batches adaptively
         if max_files is None:
-            self.max_files = 99
+            self.max_files = 0
         else:
             self.max_files = max_files
 
-        self.processing_done = threading.Event()
-        self.processing_done.set()
+        if max_processes is None:
+            self.max_processes = 0
+        else:
+            self.max_processes = max_processes
+
+        self.cache = cache
+
+        # Write-ahead journal of apply/undo/delete jobs, set with set_journal()
+        self.journal = None
+
+        # Apply/undo rewrite global_gain in-process for files with stored tags instead of spawning mp3gain
+        self.native_gain = native_gain
+
+        # Analyze with the in-process ReplayGain implementation where the decoder and sample rate allow it
+        self.native_analysis = native_analysis
+
+        # mp3gain writes changed files to a temporary copy first (-t). That rewrites every file, but a cancelled run
+        # can be stopped between files; without it files are patched in place and running batches finish.
+        self.temp_files = temp_files
+
+        self.debug_output = debug_output
+
+        # Measured mp3gain throughput (bytes/s per process), by command
+        self.throughput = dict()
+        self.throughput_lock = threading.Lock()
 
-        self.process_results = queue.Queue(QUEUE_SIZE)
+        # Chunks of every job share one pool, which is the global limit on parallel mp3gain processes
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        self.jobs = set()
+
+        # Defaults for new jobs
+        self.result_callback = None
+        self.drop_timeout = drop_timeout
+
+        # Counters and latency histograms of every stage, labelled by operation
+        self.metrics = Metrics()
+
+        # Records a span timeline while set and profiling
+        self.profiler = None
 
     def set_mp3gain_bin(self, mp3gain_bin):
         self.mp3gain = mp3gain_bin
@@ -33,6 +95,107 @@ class MP3Gain(object):
     def set_max_files(self, max_files):
         self.max_files = max_files
 
+    def set_max_processes(self, max_processes):
+        self.max_processes = max_processes
+
+        # Chunks already queued on the old pool still run there
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def get_executor(self):
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.get_num_processes())
+
+            return self.executor
+
+    def set_result_callback(self, result_callback):
+        self.result_callback = result_callback
+
+    def set_drop_timeout(self, drop_timeout):
+        self.drop_timeout = drop_timeout
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def set_journal(self, journal):
+        self.journal = journal
+
+    def get_journal(self):
+        return self.journal
+
+    def set_native_gain(self, native_gain):
+        self.native_gain = native_gain
+
+    def set_native_analysis(self, native_analysis):
+        self.native_analysis = native_analysis
+
+    def set_temp_files(self, temp_files):
+        self.temp_files = temp_files
+
+    def set_debug_output(self, debug_output):
+        self.debug_output = debug_output
+
+    def get_metrics(self):
+        return self.metrics
+
+    def set_profiler(self, profiler):
+        self.profiler = profiler
+
+    def add_span(self, name, category, start, end, args=None):
+        if self.profiler is not None:
+            self.profiler.add_span(name, category, start, end, args)
+
+    def get_throughput(self, cmd):
+        with self.throughput_lock:
+            return self.throughput.get(tuple(cmd), DEFAULT_THROUGHPUT)
+
+    def update_throughput(self, cmd_info, elapsed):
+        if cmd_info.num_bytes is None or elapsed <= 0:
+            return
+
+        cmd = tuple(cmd_info.cmd[:-cmd_info.num_files])
+        throughput = cmd_info.num_bytes / elapsed
+
+        with self.throughput_lock:
+            if cmd in self.throughput:
+                throughput = THROUGHPUT_SMOOTHING * throughput + (1.0 - THROUGHPUT_SMOOTHING) * self.throughput[cmd]
+            self.throughput[cmd] = throughput
+
+    def get_batch_limits(self, cmd, groups):
+        max_arg_bytes = get_arg_limit(cmd)
+
+        if self.max_files > 0:
+            return self.max_files, 0, max_arg_bytes, None
+
+        sizes = get_file_sizes(groups)
+        total_bytes = sum(sizes.values())
+
+        max_bytes = self.get_throughput(cmd) * BATCH_TIME
+        max_bytes = min(max_bytes, total_bytes / (self.get_num_processes() * BATCHES_PER_PROCESS))
+
+        return MAX_BATCH_FILES, max(int(max_bytes), 1), max_arg_bytes, sizes
+
+    def get_native_analysis_job(self, album_analysis):
+        if not self.native_analysis:
+            return None
+
+        # Imported on demand, the decoder and SciPy take a while to load and are optional
+        from lib import replaygain
+
+        if not replaygain.is_available():
+            return None
+
+        return replaygain.analyze_files, album_analysis
+
+    def get_num_processes(self):
+        if self.max_processes > 0:
+            return self.max_processes
+
+        return os.cpu_count() or 1
+
     def get_version(self):
         cmd = [self.mp3gain, '-v']
         try:
@@ -51,7 +214,20 @@ class MP3Gain(object):
 
         return "not found"
 
-    def get_file_analysis(self, src, stored_only=False, album_analysis=False, block=False):
+    def get_file_analysis(self, src, stored_only=False, album_analysis=False, block=False, ordered=False):
+        cmd = self.get_analysis_cmd(stored_only, album_analysis)
+
+        if stored_only:
+            return self.process_mp3gain_cmd(cmd, src, block=block, ordered=ordered, operation="read")
+
+        native_job = self.get_native_analysis_job(album_analysis)
+
+        # Cached files are looked up in the job's thread
+        return self.process_mp3gain_cmd(cmd, src, album=album_analysis, block=block, ordered=ordered,
+                                        use_cache=self.cache is not None, store_results=self.cache is not None,
+                                        native_job=native_job, operation="analyze")
+
+    def get_analysis_cmd(self, stored_only=False, album_analysis=False):
         cmd = [self.mp3gain, '-q', '-o']
 
         if not album_analysis:
@@ -60,152 +236,632 @@ class MP3Gain(object):
         if stored_only:
             cmd.extend(['-s', 'c'])
 
-        return self.process_mp3gain_cmd(cmd, src, block=block)
+        return cmd
+
+    def get_cached_analysis(self, src, album_analysis=False):
+        groups = get_groups(src)
+        cached_results = []
+
+        for name in groups:
+            if len(groups[name]) == 0:
+                continue
+
+            if album_analysis:
+                album_results = self.cache.get_album(groups[name])
+                if album_results is not None:
+                    cached_results.extend(album_results)
+                    groups[name] = []
+            else:
+                hits, groups[name] = self.cache.get_many(groups[name])
+                cached_results.extend(hits)
+
+        return cached_results, groups
+
+    def read_stored_analysis(self, src):
+        return list(self.iter_stored_analysis(src))
+
+    def iter_stored_analysis(self, src):
+        if isinstance(src, str):
+            src = [src]
+
+        for mp3_file in src:
+            yield get_stored_analysis(mp3_file)
+
+    def set_volume(self, src, volume, use_album_gain, block=False, ordered=False, journal_id=None, prepare=None,
+                   skip_unchanged=False, analyses=None):
+        # With skip_unchanged, files already at the target volume are left out: the job plans that in its own thread
+        # (see plan_volume) and keeps the plan
+        plan = None
+        if skip_unchanged:
+            plan = functools.partial(self.plan_volume, volume=volume, use_album_gain=use_album_gain, analyses=analyses)
+
+        return self.process_mp3gain_cmd(self.get_volume_cmd(volume, use_album_gain), src, album=use_album_gain,
+                                        block=block, ordered=ordered,
+                                        native_job=self.get_native_volume_job(volume, use_album_gain),
+                                        operation="apply",
+                                        journal_params={"volume": volume, "use_album_gain": use_album_gain},
+                                        journal_id=journal_id, prepare=prepare, plan=plan)
+
+    def plan_volume(self, src, volume, use_album_gain, analyses=None):
+        # Works out from stored (or the caller's) analysis which files actually change, so set_volume() can be given
+        # only those. analyses maps files to analysis entries, or is a function returning that map for the groups;
+        # without it the stored tags are read.
+        groups = get_groups(src)
+
+        if callable(analyses):
+            analyses = analyses(groups)
+        elif analyses is None:
+            analyses = dict()
+            for name in groups:
+                for analysis in self.iter_stored_analysis(groups[name]):
+                    analyses[analysis["File"]] = analysis
 
-    def set_volume(self, src, volume, use_album_gain, block=False):
-        cmd = [self.mp3gain, '-c', '-q', '-o', '-d', str(int(volume - MP3_GAIN_SUGGESTED_VOLUME))]
+        plan = get_volume_plan(groups, analyses, get_volume_offset(volume), use_album_gain)
+
+        for key in ["change", "unchanged", "analysis"]:
+            self.metrics.inc("planned_files_total", len(plan[key]), operation="apply", plan=key)
+
+        if self.debug_output:
+            print("Plan: {} to change, {} unchanged, {} needing analysis first".format(
+                len(plan["change"]), len(plan["unchanged"]), len(plan["analysis"])))
+
+        return plan
+
+    def get_volume_cmd(self, volume, use_album_gain):
+        cmd = [self.mp3gain, '-c', '-q', '-o'] + self.get_temp_file_args() + ['-d', str(get_volume_offset(volume))]
 
         if use_album_gain:
             cmd.append('-a')
         else:
             cmd.append('-r')
 
-        return self.process_mp3gain_cmd(cmd, src, block=block)
+        return cmd
+
+    def get_native_volume_job(self, volume, use_album_gain):
+        if not self.native_gain:
+            return None
+
+        return apply_gain_files, get_volume_offset(volume), use_album_gain
+
+    def undo_gain(self, src, block=False, ordered=False, journal_id=None):
+        return self.process_mp3gain_cmd(self.get_undo_cmd(), src, block=block, ordered=ordered,
+                                        native_job=self.get_native_undo_job(), operation="undo", journal_params={},
+                                        journal_id=journal_id)
+
+    def get_undo_cmd(self):
+        return [self.mp3gain, '-q', '-o'] + self.get_temp_file_args() + ['-u']
+
+    def get_temp_file_args(self):
+        if self.temp_files:
+            return ['-t']
+
+        return []
 
-    def undo_gain(self, src, block=False):
-        cmd = [self.mp3gain, '-q', '-o', '-u']
-        return self.process_mp3gain_cmd(cmd, src, block=block)
+    def get_native_undo_job(self):
+        if not self.native_gain:
+            return None
 
-    def delete_tags(self, src, block=False):
-        cmd = [self.mp3gain, '-q', '-o', '-s', 'd']
-        return self.process_mp3gain_cmd(cmd, src, block=block)
+        return (undo_gain_files,)
 
-    def process_mp3gain_cmd(self, cmd, input_files, block=False):
-        self.processing_done.wait()
+    def delete_tags(self, src, block=False, ordered=False, journal_id=None):
+        return self.process_mp3gain_cmd(self.get_delete_tags_cmd(), src, block=block, ordered=ordered,
+                                        operation="delete-tags", journal_params={}, journal_id=journal_id)
 
-        max_files = self.max_files
+    def resume_job(self, journal_id, ordered=False):
+        # Continues the unfinished files of an interrupted apply/undo/delete job under its journal entry
+        entry = self.journal.get_job(journal_id)
+        if entry is None:
+            return None
 
-        if isinstance(input_files, str):
-            input_files = [input_files]
+        if entry["operation"] not in WRITE_OPERATIONS:
+            raise ValueError("unknown operation {}".format(entry["operation"]))
+
+        groups = entry["groups"]
+        params = entry["params"]
+        prepare = None
+
+        if entry["operation"] == "apply":
+            if params["use_album_gain"]:
+                # Album gain only comes out right over a whole album, so albums that were cut off halfway are
+                # undone (global_gain changes are lossless) and applied again as a whole. The undo runs in the job's
+                # thread, before the apply.
+                partial_groups = {name: entry["all_groups"][name] for name in entry["partial_groups"]}
+                if len(partial_groups) > 0:
+                    prepare = functools.partial(self.undo_gain, partial_groups, block=True)
+                    groups.update(partial_groups)
+
+            # Track gain files that were being changed when the job stopped may already be at the target volume
+            return self.set_volume(groups, params["volume"], params["use_album_gain"], ordered=ordered,
+                                   journal_id=journal_id, prepare=prepare,
+                                   skip_unchanged=not params["use_album_gain"])
+        elif entry["operation"] == "undo":
+            return self.undo_gain(groups, ordered=ordered, journal_id=journal_id)
+
+        return self.delete_tags(groups, ordered=ordered, journal_id=journal_id)
+
+    def get_delete_tags_cmd(self):
+        return [self.mp3gain, '-q', '-o', '-s', 'd']
+
+    def process_mp3gain_cmd(self, cmd, input_files, album=False, block=False, ordered=False, use_cache=False,
+                            store_results=False, native_job=None, operation="mp3gain", journal_params=None,
+                            journal_id=None, prepare=None, plan=None):
+        # prepare is run before the first chunk starts, plan(groups) returns a plan (see plan_volume) of the files
+        # to run. Files are planned, cached results are looked up and chunks are sized (which looks at every file) in
+        # the job's thread, so starting a job doesn't hold up the caller.
+        groups = get_groups(input_files)
+        get_job_chunks = functools.partial(self.get_job_chunks, cmd, album=album, store_results=store_results,
+                                           native_job=native_job, operation=operation, use_cache=use_cache)
+
+        if block:
+            if plan is not None:
+                groups = plan(groups)["groups"]
+            if prepare is not None:
+                prepare()
+            cached_results, cmd_list = get_job_chunks(groups)
+            return cached_results + self.process_mp3gain_cmd_block(cmd_list)
+
+        job = MP3GainJob(sum(len(mp3_files) for mp3_files in groups.values()),
+                         result_callback=self.result_callback, drop_timeout=self.drop_timeout)
+
+        # Operations that change files are journaled (or continue their journal entry when resumed)
+        if self.journal is not None and journal_params is not None:
+            if journal_id is None:
+                journal_id = self.journal.create_job(operation, journal_params, groups)
+            job.set_journal(self.journal, journal_id)
+
+        with self.executor_lock:
+            self.jobs.add(job)
+
+        process_thread = threading.Thread(target=lambda: self.process_mp3gain_cmd_thread(job, groups, get_job_chunks,
+                                                                                         ordered, operation, prepare,
+                                                                                         plan))
+        process_thread.start()
 
-        mp3_lists = split_list(input_files, max_files)
+        return job
+
+    def get_job_chunks(self, cmd, groups, album=False, store_results=False, native_job=None, operation="mp3gain",
+                       use_cache=False):
+        cached_results = []
+
+        if use_cache:
+            cached_results, groups = self.get_cached_analysis(groups, album)
+            self.metrics.inc("cache_hits_total", len(cached_results), operation=operation)
+
+        return cached_results, self.get_cmd_list(cmd, groups, album, store_results, native_job, operation)
+
+    def get_cmd_list(self, cmd, groups, album=False, store_results=False, native_job=None, operation="mp3gain"):
+        # Album gain is calculated over all files passed to a single mp3gain run, so album chunks can't be split.
+        # Anything else is packed across groups into chunks limited by file count, size and command line length.
+        max_files, max_bytes, max_arg_bytes, sizes = self.get_batch_limits(cmd, groups)
+        chunks = get_chunks(groups, pack=not album, max_files=max_files, max_bytes=max_bytes,
+                            max_arg_bytes=max_arg_bytes, sizes=sizes)
 
         cmd_list = []
-        expected_results = 0
 
-        for mp3_list in mp3_lists:
+        for names, mp3_list in chunks:
+            chunk_bytes = None
+            if sizes is not None:
+                chunk_bytes = sum(sizes[mp3_file] for mp3_file in mp3_list)
+
             cmd_tmp = cmd.copy()
             cmd_tmp.extend(mp3_list)
-            cmd_list.append([cmd_tmp, len(mp3_list)])
-            expected_results = expected_results + len(mp3_list)
+            cmd_list.append(Chunk(cmd_tmp, len(mp3_list), album, store_results, native_job, names, chunk_bytes,
+                                  operation))
 
-        if block:
-            return self.process_mp3gain_cmd_block(cmd_list)
-
-        self.processing_done.clear()
-        process_thread = threading.Thread(target=lambda: self.process_mp3gain_cmd_thread(cmd_list))
-        process_thread.start()
+        if self.debug_output:
+            self.print_batches(cmd, cmd_list, max_bytes, max_arg_bytes)
 
-        return expected_results
+        return cmd_list
 
     def process_mp3gain_cmd_block(self, cmd_list):
         results = []
 
-        for cmd_info in cmd_list:
-            cmd = cmd_info[0]
-            num_files = cmd_info[1]
-            console_process = subprocess.Popen(cmd,
-                                               stdin=subprocess.DEVNULL,
-                                               stdout=subprocess.PIPE,
-                                               stderr=subprocess.DEVNULL,
-                                               encoding='utf8')
+        native_executor = self.get_native_executor(cmd_list)
+        try:
+            futures = dict()
+            for idx in get_schedule(cmd_list):
+                futures[idx] = self.get_executor().submit(self.get_cmd_results, cmd_list[idx], native_executor)
+
+            for idx in range(len(cmd_list)):
+                results.extend(futures[idx].result())
+        finally:
+            if native_executor is not None:
+                native_executor.shutdown()
+
+        return results
+
+    def get_native_executor(self, cmd_list):
+        num_jobs = len([cmd_info for cmd_info in cmd_list if cmd_info.native_job is not None])
+        if num_jobs == 0:
+            return None
+
+        # Forking a process that runs Qt (or any other) threads isn't safe, so workers are spawned
+        return ProcessPoolExecutor(max_workers=min(num_jobs, self.get_num_processes()),
+                                   mp_context=multiprocessing.get_context("spawn"), initializer=ignore_interrupts)
+
+    def run_native_job(self, cmd_info, native_executor):
+        start_time = time.monotonic()
+        future = native_executor.submit(self.get_native_call(cmd_info))
+        results, fallback_files = future.result()
+        end_time = time.monotonic()
+        self.update_native_metrics(cmd_info, results, fallback_files, end_time - start_time)
+        self.add_span("native", "chunk", start_time, end_time,
+                      {"files": cmd_info.num_files, "fallback": len(fallback_files)})
 
-            process_result, result_code = console_process.communicate()
-            lines = process_result.splitlines()
+        self.store_results(results, cmd_info.album, cmd_info.store_results)
 
-            headers = lines[0].split('\t')
+        return results, get_fallback_info(cmd_info, fallback_files)
 
-            for idx in range(1, num_files + 1):
-                result = self.get_result(tag_line=[headers, lines[idx]])
-                results.append(result)
+    def get_native_call(self, cmd_info):
+        native_job = cmd_info.native_job
+        mp3_files = cmd_info.cmd[-cmd_info.num_files:]
+
+        # Workers share frame indexes through the cache file, so a later undo doesn't have to re-scan
+        cache_file = None
+        if self.cache is not None:
+            cache_file = self.cache.cache_file
+
+        return functools.partial(native_job[0], mp3_files, *native_job[1:], cache_file=cache_file)
+
+    def update_native_metrics(self, cmd_info, results, fallback_files, elapsed):
+        operation = cmd_info.operation
+
+        self.metrics.inc("native_jobs_total", operation=operation)
+        self.metrics.observe("native_job_seconds", elapsed, operation=operation)
+        self.metrics.inc("results_total", len(results), operation=operation, source="native")
+        self.metrics.inc("native_fallback_files_total", len(fallback_files), operation=operation)
+
+    def update_process_metrics(self, cmd_info, spawn_time, elapsed):
+        operation = cmd_info.operation
+
+        self.metrics.inc("mp3gain_processes_total", operation=operation)
+        self.metrics.observe("mp3gain_spawn_seconds", spawn_time, operation=operation)
+        self.metrics.observe("mp3gain_run_seconds", elapsed, operation=operation)
+        self.metrics.observe("mp3gain_batch_files", cmd_info.num_files, buckets=SIZE_BUCKETS, operation=operation)
+
+    def get_cmd_results(self, cmd_info, native_executor=None):
+        if cmd_info.native_job is None:
+            return self.get_mp3gain_cmd_results(cmd_info)
+
+        results, fallback_info = self.run_native_job(cmd_info, native_executor)
+        if fallback_info is not None:
+            results.extend(self.get_mp3gain_cmd_results(fallback_info))
 
         return results
 
-    def process_mp3gain_cmd_thread(self, cmd_list):
-        self.processing_done.clear()
+    def run_cmd(self, job, cmd_info, result_callback=None):
+        if job.is_cancelled():
+            return []
+
+        job.start_files(cmd_info.cmd[-cmd_info.num_files:])
+
+        if cmd_info.native_job is None:
+            return self.run_mp3gain_cmd(job, cmd_info, result_callback)
 
-        while not self.process_results.empty():
-            try:
-                _ = self.process_results.get(block=False)
-            except queue.Empty:
-                pass
+        # Native jobs return once their files are written
+        results, fallback_info = self.run_native_job(cmd_info, job.native_executor)
+        job.complete_files([result["File"] for result in results])
+        if result_callback is not None:
+            for result in results:
+                result_callback(result)
+            results = []
+
+        if fallback_info is not None and not job.is_cancelled():
+            results.extend(self.run_mp3gain_cmd(job, fallback_info, result_callback))
+
+        return results
+
+    def print_batches(self, cmd, cmd_list, max_bytes, max_arg_bytes):
+        if len(cmd_list) == 0:
+            return
+
+        num_files = [cmd_info.num_files for cmd_info in cmd_list]
+        print("Batches: {} ({} files, {}-{} per batch), max. {} bytes, max. {} argument bytes, {:.0f} bytes/s".format(
+            len(cmd_list), sum(num_files), min(num_files), max(num_files), max_bytes, max_arg_bytes,
+            self.get_throughput(cmd)))
 
         for cmd_info in cmd_list:
-            cmd = cmd_info[0]
-            num_files = cmd_info[1]
-            console_process = subprocess.Popen(cmd,
-                                               stdin=subprocess.DEVNULL,
-                                               stdout=subprocess.PIPE,
-                                               stderr=subprocess.DEVNULL,
-                                               encoding='utf8',
-                                               bufsize=32768)
-
-            line = console_process.stdout.readline()
-            line = line.rstrip('\n')
-            headers = line.split('\t')
-
-            while True:
-                line = console_process.stdout.readline()
-
-                if line != "":
-                    try:
-                        self.process_results.put([headers, line], block=False)
-                    except queue.Full:
-                        pass
-                else:
-                    if console_process.poll() is not None:
-                        break
+            arg_bytes = sum(get_arg_size(arg) for arg in cmd_info.cmd[-cmd_info.num_files:])
+            num_bytes = "?" if cmd_info.num_bytes is None else cmd_info.num_bytes
+            print("Batch: {} files, {} bytes, {} argument bytes".format(cmd_info.num_files, num_bytes, arg_bytes))
+
+            # Album batches can't be split, mp3gain will fail to start
+            if arg_bytes > max_arg_bytes:
+                print("Batch exceeds the command line limit.")
+
+    def get_mp3gain_cmd_results(self, cmd_info):
+        cmd = cmd_info.cmd
+        start_time = time.monotonic()
+        console_process = subprocess.Popen(cmd,
+                                           stdin=subprocess.DEVNULL,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.DEVNULL,
+                                           encoding='utf8')
+        spawn_time = time.monotonic() - start_time
 
-                console_process.stdout.flush()
+        process_result, result_code = console_process.communicate()
+        parse_start = time.monotonic()
+        self.update_throughput(cmd_info, parse_start - start_time)
+        self.update_process_metrics(cmd_info, spawn_time, parse_start - start_time)
+
+        results = [result.as_dict() for result in parse_output(process_result)]
+        self.metrics.observe("parse_bulk_seconds", time.monotonic() - parse_start, operation=cmd_info.operation)
+        self.add_span("mp3gain", "chunk", start_time, parse_start,
+                      {"files": cmd_info.num_files, "operation": cmd_info.operation})
+        self.metrics.inc("results_total", len(results), operation=cmd_info.operation, source="mp3gain")
 
-        self.processing_done.set()
+        self.store_results(results, cmd_info.album, cmd_info.store_results)
 
-    def get_result(self, block=True, timeout=0.01, tag_line=None, debug_output=False):
-        ints = ["MP3 gain", "Max global_gain", "Min global_gain", "Album gain",
-                "Album Max global_gain", "Album Min global_gain"]
-        floats = ["dB gain", "Max Amplitude", "Album dB gain", "Album Max Amplitude"]
+        return results
 
-        if tag_line is None:
-            while tag_line is None:
-                tag_line = self.process_results.get(block=block, timeout=timeout)
-                line = tag_line[1][0:7]
-                # Parsing is pretty weird here. Just sorta brute-forcing my way through this.
-                if line in ["Applyin", "No chan", "\"Album\"", "\n", "...but "]:
-                    tag_line = None
+    def process_mp3gain_cmd_thread(self, job, groups, get_job_chunks, ordered=False, operation="mp3gain", prepare=None,
+                                   plan=None):
+        start_time = time.monotonic()
+        group_names = list(groups)
+
+        try:
+            if plan is not None:
+                job.set_plan(plan(groups))
+                groups = job.get_plan()["groups"]
 
-        headers = tag_line[0]
-        line = tag_line[1]
+            cached_results, cmd_list = get_job_chunks(groups)
+            for entry in cached_results:
+                job.put_result(entry)
 
-        mp3 = line.rstrip('\n')
-        if debug_output:
-            print("Result: {}".format(mp3))
+            pending_groups = get_pending_groups(cmd_list, group_names)
+            for name in pending_groups:
+                if pending_groups[name] == 0:
+                    job.complete_group(name)
 
-        entry = dict()
-        entry["tag_exists"] = False
+            job.native_executor = self.get_native_executor(cmd_list)
 
-        for idx, value in enumerate(mp3.split('\t')):
-            if value != "NA":
-                entry[headers[idx]] = value
+            if prepare is not None and not job.is_cancelled():
+                prepare()
 
-        for param in entry:
-            if param in ints:
-                entry["tag_exists"] = True
-                entry[param] = int(entry[param])
-            elif param in floats:
-                entry["tag_exists"] = True
-                entry[param] = float(entry[param])
+            executor = self.get_executor()
+            futures = dict()
 
-        return entry
+            for idx in get_schedule(cmd_list):
+                if ordered:
+                    future = executor.submit(self.run_cmd, job, cmd_list[idx])
+                else:
+                    future = executor.submit(self.run_cmd, job, cmd_list[idx], job.put_result)
+
+                futures[future] = idx
+                job.add_future(future)
+
+            if ordered:
+                chunk_futures = sorted(futures, key=lambda x: futures[x])
+            else:
+                chunk_futures = as_completed(futures)
+
+            for future in chunk_futures:
+                try:
+                    results = future.result()
+                except CancelledError:
+                    continue
+
+                for result in results:
+                    job.put_result(result)
+
+                for name in complete_chunk(cmd_list[futures[future]], pending_groups):
+                    job.complete_group(name)
+        finally:
+            if job.native_executor is not None:
+                job.native_executor.shutdown()
+                job.native_executor = None
+
+            with self.executor_lock:
+                self.jobs.discard(job)
+
+            self.update_job_metrics(job, operation, time.monotonic() - start_time)
+            self.add_span(operation, "job", start_time, time.monotonic(), {"files": job.expected_results})
+            job.finish()
+
+    def update_job_metrics(self, job, operation, elapsed):
+        result_stats = job.get_result_stats()
+
+        if job.is_cancelled():
+            self.metrics.inc("operations_cancelled_total", operation=operation)
+        self.metrics.inc("operations_total", operation=operation)
+        self.metrics.observe("operation_seconds", elapsed, operation=operation)
+        self.metrics.inc("late_results_total", result_stats["late"], operation=operation)
+        self.metrics.inc("dropped_results_total", result_stats["dropped"], operation=operation)
+
+    def run_mp3gain_cmd(self, job, cmd_info, result_callback=None):
+        cmd = cmd_info.cmd
+        operation = cmd_info.operation
+        metrics = self.metrics
+        profiling = self.profiler is not None and self.profiler.is_active()
+        progress = ChunkProgress(cmd_info, job.complete_files)
+        records = []
+        results = []
+        num_results = 0
+        start_time = time.monotonic()
+
+        # In its own session, so Ctrl+C in a terminal reaches only us and we stop mp3gain between files
+        console_process = subprocess.Popen(cmd,
+                                           stdin=subprocess.DEVNULL,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.DEVNULL,
+                                           encoding='utf8',
+                                           bufsize=32768,
+                                           start_new_session=True)
+        spawn_time = time.monotonic() - start_time
+
+        parser = ResultParser(console_process.stdout.readline())
+        last_result = start_time
+
+        for line in console_process.stdout:
+            parse_start = time.monotonic()
+            record = parser.parse_line(line)
+            parse_end = time.monotonic()
+            metrics.observe("parse_seconds", parse_end - parse_start, operation=operation)
+
+            if record is None:
+                continue
+
+            if not progress.add_record(record, job.is_cancelled()):
+                break
+
+            # Waiting for mp3gain (and the pipe) since the previous file
+            metrics.observe("file_seconds", parse_start - last_result, operation=operation)
+            if profiling:
+                self.add_span("file", "file", last_result, parse_end, {"file": record.file})
+            num_results = num_results + 1
+
+            if result_callback is None:
+                records.append(record)
+                last_result = parse_end
+            else:
+                # Blocks while the job's queue is full
+                result_callback(record)
+                last_result = time.monotonic()
+                metrics.observe("result_put_seconds", last_result - parse_end, operation=operation)
+                metrics.observe("result_queue_depth", job.results.qsize(), buckets=SIZE_BUCKETS, operation=operation)
+
+            if cmd_info.store_results:
+                results.append(record.as_dict())
+
+            if progress.stopped:
+                break
+
+        cancelled = progress.stopped
+        if cancelled:
+            console_process.terminate()
+
+        console_process.stdout.close()
+        console_process.wait()
+        progress.finish(console_process.returncode)
+
+        elapsed = time.monotonic() - start_time
+        self.update_process_metrics(cmd_info, spawn_time, elapsed)
+        metrics.inc("results_total", num_results, operation=operation, source="mp3gain")
+        self.add_span("mp3gain", "chunk", start_time, start_time + elapsed,
+                      {"files": cmd_info.num_files, "operation": operation, "cancelled": cancelled})
+
+        if not cancelled:
+            self.update_throughput(cmd_info, elapsed)
+
+        # Album results of a cancelled run are incomplete, only the track results are kept
+        self.store_results(results, cmd_info.album and not cancelled, cmd_info.store_results)
+
+        return records
+
+    def store_results(self, results, album, store_results):
+        if not store_results or self.cache is None:
+            return
+
+        if album:
+            self.cache.put_album([entry["File"] for entry in results], results)
+
+        self.cache.put_many(results)
 
     def is_running(self):
-        return not self.processing_done.is_set() or not self.process_results.empty()
+        with self.executor_lock:
+            return len(self.jobs) > 0
+
+    def cancel(self):
+        with self.executor_lock:
+            jobs = list(self.jobs)
+
+        for job in jobs:
+            job.cancel()
+
+        return jobs
+
+    def shutdown(self):
+        for job in self.cancel():
+            job.wait()
+
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+def ignore_interrupts():
+    # Native workers are stopped through their job, never halfway through a file
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def get_volume_offset(volume):
+    return int(volume - MP3_GAIN_SUGGESTED_VOLUME)
+
+
+def get_volume_plan(groups, analyses, volume_offset, album=False):
+    # Files to change, unchanged files and files without an analysis; groups holds what still has to go to mp3gain
+    plan = {"groups": dict(), "change": [], "unchanged": [], "analysis": []}
+
+    for name in groups:
+        mp3_files = groups[name]
+        gain_changes = [get_gain_change(analyses.get(mp3_file, {}), volume_offset, album) for mp3_file in mp3_files]
+
+        if album:
+            # An album is analyzed and changed as a whole
+            if any(gain_change is None for gain_change in gain_changes):
+                plan["analysis"].extend(mp3_files)
+            elif any(gain_change != 0 for gain_change in gain_changes):
+                plan["change"].extend(mp3_files)
+            else:
+                plan["unchanged"].extend(mp3_files)
+                continue
+
+            plan["groups"][name] = list(mp3_files)
+            continue
+
+        remaining = []
+        for mp3_file, gain_change in zip(mp3_files, gain_changes):
+            if gain_change is None:
+                plan["analysis"].append(mp3_file)
+            elif gain_change != 0:
+                plan["change"].append(mp3_file)
+            else:
+                plan["unchanged"].append(mp3_file)
+                continue
+
+            remaining.append(mp3_file)
+
+        if len(remaining) > 0:
+            plan["groups"][name] = remaining
+
+    return plan
+
+
+def get_fallback_info(cmd_info, fallback_files):
+    # Files without usable stored tags (or frames that couldn't be parsed) still go through mp3gain
+    if len(fallback_files) == 0:
+        return None
+
+    return cmd_info._replace(cmd=cmd_info.cmd[:-cmd_info.num_files] + fallback_files, num_files=len(fallback_files),
+                             native_job=None, num_bytes=None)
+
+
+def get_schedule(cmd_list):
+    # Largest chunks first, so a big album doesn't start last and hold up the end of the run
+    return sorted(range(len(cmd_list)), key=lambda idx: cmd_list[idx].num_files, reverse=True)
+
+
+def complete_chunk(cmd_info, pending_groups):
+    completed = []
+
+    for name in cmd_info.groups:
+        pending_groups[name] = pending_groups[name] - 1
+        if pending_groups[name] == 0:
+            completed.append(name)
+
+    return completed
+
+
+def get_pending_groups(cmd_list, group_names=None):
+    pending_groups = dict()
+
+    if group_names is not None:
+        for name in group_names:
+            pending_groups[name] = 0
+
+    for cmd_info in cmd_list:
+        for name in cmd_info.groups:
+            pending_groups[name] = pending_groups.get(name, 0) + 1
+
+    return pending_groups
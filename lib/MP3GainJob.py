@@ -0,0 +1,207 @@
+import time
+import queue
+import threading
+
+from lib.ResultParser import MP3GainResult
+
+QUEUE_SIZE = 8192
+NOTIFY_INTERVAL = 0.05
+NOTIFY_BATCH_SIZE = 500
+RESULT_PUT_TIMEOUT = 0.1
+
+
+class MP3GainJob(object):
+    def __init__(self, expected_results=0, result_callback=None, drop_timeout=None):
+        self.expected_results = expected_results
+        self.num_results = 0
+        self.completed_files = []
+
+        self.results = queue.Queue(QUEUE_SIZE)
+        self.completed_groups = queue.Queue()
+
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+
+        # Notified on every result, completed group and when the job is done, for readers that block
+        self.update_condition = threading.Condition()
+        self.futures = []
+        self.futures_lock = threading.Lock()
+
+        # Set by MP3Gain while the job has native jobs
+        self.native_executor = None
+
+        # Journal entry of apply/undo/delete jobs, so an interrupted job can be resumed
+        self.journal = None
+        self.journal_id = None
+
+        # Set before the first chunk starts if the job planned which files to skip
+        self.plan = None
+
+        self.result_callback = result_callback
+        self.last_notify = 0
+
+        # Results are never dropped unless a drop timeout is set; late results had to wait for queue space
+        self.drop_timeout = drop_timeout
+        self.result_stats_lock = threading.Lock()
+        self.late_results = 0
+        self.dropped_results = 0
+
+    def set_result_callback(self, result_callback):
+        self.result_callback = result_callback
+
+    def set_journal(self, journal, journal_id):
+        self.journal = journal
+        self.journal_id = journal_id
+
+    def set_plan(self, plan):
+        # Files the plan leaves unchanged are done without a result
+        self.plan = plan
+        self.expected_results = self.expected_results - len(plan["unchanged"])
+        self.complete_files(plan["unchanged"])
+
+    def get_plan(self):
+        return self.plan
+
+    def start_files(self, mp3_files):
+        if self.journal is not None:
+            self.journal.start_files(self.journal_id, mp3_files)
+
+    def complete_files(self, mp3_files):
+        # Only once the files are written, which for mp3gain is after their result line
+        if self.journal is not None and len(mp3_files) > 0:
+            self.journal.complete_files(self.journal_id, mp3_files, flush=False)
+
+    def add_future(self, future):
+        with self.futures_lock:
+            self.futures.append(future)
+
+        if self.is_cancelled():
+            future.cancel()
+
+    def cancel(self):
+        self.cancelled.set()
+
+        # Chunks that haven't started yet are dropped. Running mp3gain processes that write through temporary files
+        # stop once their current file is written, the others finish their batch.
+        with self.futures_lock:
+            for future in self.futures:
+                future.cancel()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    def finish(self):
+        if self.journal is not None:
+            self.journal.finish_job(self.journal_id)
+
+        self.done.set()
+        self.notify_update()
+        self.notify_results(force=True)
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def has_update(self):
+        return not self.results.empty() or not self.completed_groups.empty() or self.done.is_set()
+
+    def wait_update(self, timeout=None):
+        # Blocks until there are results or completed groups to read, or the job is done
+        with self.update_condition:
+            return self.update_condition.wait_for(self.has_update, timeout)
+
+    def notify_update(self):
+        with self.update_condition:
+            self.update_condition.notify_all()
+
+    def is_running(self):
+        return not self.done.is_set() or not self.results.empty()
+
+    def get_progress(self):
+        return self.num_results, self.expected_results
+
+    def get_completed_files(self):
+        with self.result_stats_lock:
+            return list(self.completed_files)
+
+    def put_result(self, result):
+        # Parsed mp3gain output, or a dict from the cache or a native job
+        if isinstance(result, MP3GainResult):
+            mp3_file = result.file
+        else:
+            mp3_file = result["File"]
+
+        with self.result_stats_lock:
+            self.num_results = self.num_results + 1
+            self.completed_files.append(mp3_file)
+
+        try:
+            self.results.put(result, block=False)
+        except queue.Full:
+            with self.result_stats_lock:
+                self.late_results = self.late_results + 1
+
+            # Block the reader (and with it the mp3gain pipe) until the consumer catches up
+            start_time = time.monotonic()
+            while True:
+                self.notify_results(force=True)
+
+                try:
+                    self.results.put(result, timeout=RESULT_PUT_TIMEOUT)
+                    break
+                except queue.Full:
+                    # Nobody may be reading the results of a cancelled job anymore
+                    if self.is_cancelled():
+                        with self.result_stats_lock:
+                            self.dropped_results = self.dropped_results + 1
+                        return
+
+                    if self.drop_timeout is not None and time.monotonic() - start_time >= self.drop_timeout:
+                        with self.result_stats_lock:
+                            self.dropped_results = self.dropped_results + 1
+                        return
+
+        self.notify_update()
+        self.notify_results()
+
+    def get_result_stats(self):
+        with self.result_stats_lock:
+            return {"late": self.late_results, "dropped": self.dropped_results}
+
+    def notify_results(self, force=False):
+        if self.result_callback is None:
+            return
+
+        now = time.monotonic()
+        if force or now - self.last_notify >= NOTIFY_INTERVAL or self.results.qsize() >= NOTIFY_BATCH_SIZE:
+            self.last_notify = now
+            self.result_callback()
+
+    def get_result(self, block=True, timeout=0.01):
+        result = self.results.get(block=block, timeout=timeout)
+        if isinstance(result, MP3GainResult):
+            return result.as_dict()
+
+        return result
+
+    def get_results(self):
+        results = []
+
+        while True:
+            try:
+                results.append(self.get_result(block=False))
+            except queue.Empty:
+                return results
+
+    def complete_group(self, name):
+        self.completed_groups.put(name)
+        self.notify_update()
+        self.notify_results(force=True)
+
+    def get_completed_groups(self):
+        completed = []
+
+        while True:
+            try:
+                completed.append(self.completed_groups.get(block=False))
+            except queue.Empty:
+                return completed
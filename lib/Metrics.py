@@ -0,0 +1,151 @@
+import os
+import json
+import bisect
+import threading
+
+METRIC_PREFIX = "pymp3gain_"
+# Upper bounds of the histogram buckets: seconds for latencies, counts for sizes
+LATENCY_BUCKETS = [0.0001, 0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0]
+SIZE_BUCKETS = [1, 10, 50, 100, 500, 1000, 5000, 10000]
+
+
+class Metrics(object):
+    def __init__(self, prefix=None):
+        if prefix is None:
+            self.prefix = METRIC_PREFIX
+        else:
+            self.prefix = prefix
+
+        self.lock = threading.Lock()
+
+        # (name, labels) -> value, or [bucket counts, sum, count] for histograms
+        self.counters = dict()
+        self.gauges = dict()
+        self.histograms = dict()
+        self.buckets = dict()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, get_label_key(labels))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, get_label_key(labels))] = value
+
+    def observe(self, name, value, buckets=None, **labels):
+        key = (name, get_label_key(labels))
+
+        with self.lock:
+            # A histogram keeps the buckets it was first observed with
+            if name not in self.buckets:
+                self.buckets[name] = LATENCY_BUCKETS if buckets is None else buckets
+
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = [[0] * (len(self.buckets[name]) + 1), 0.0, 0]
+                self.histograms[key] = histogram
+
+            histogram[0][bisect.bisect_left(self.buckets[name], value)] += 1
+            histogram[1] = histogram[1] + value
+            histogram[2] = histogram[2] + 1
+
+    def get_counter(self, name, **labels):
+        with self.lock:
+            return self.counters.get((name, get_label_key(labels)), 0)
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict()
+            self.gauges = dict()
+            self.histograms = dict()
+            self.buckets = dict()
+
+    def as_dict(self):
+        entry = {"counters": [], "gauges": [], "histograms": []}
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                entry["counters"].append({"name": name, "labels": dict(labels), "value": value})
+
+            for (name, labels), value in sorted(self.gauges.items()):
+                entry["gauges"].append({"name": name, "labels": dict(labels), "value": value})
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                bounds = [str(bound) for bound in self.buckets[name]] + ["+Inf"]
+                entry["histograms"].append({"name": name, "labels": dict(labels),
+                                            "buckets": dict(zip(bounds, get_cumulative(histogram[0]))),
+                                            "sum": histogram[1], "count": histogram[2]})
+
+        return entry
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=1)
+
+    def to_prometheus(self):
+        lines = []
+
+        with self.lock:
+            for metric_type, values in [("counter", self.counters), ("gauge", self.gauges)]:
+                for name in sorted(set(name for name, labels in values)):
+                    lines.append("# TYPE {}{} {}".format(self.prefix, name, metric_type))
+                    for (value_name, labels), value in sorted(values.items()):
+                        if value_name == name:
+                            lines.append("{}{}{} {}".format(self.prefix, name, get_label_text(labels), value))
+
+            for name in sorted(set(name for name, labels in self.histograms)):
+                lines.append("# TYPE {}{} histogram".format(self.prefix, name))
+                bounds = [str(bound) for bound in self.buckets[name]] + ["+Inf"]
+
+                for (value_name, labels), histogram in sorted(self.histograms.items()):
+                    if value_name != name:
+                        continue
+
+                    for bound, count in zip(bounds, get_cumulative(histogram[0])):
+                        lines.append("{}{}_bucket{} {}".format(self.prefix, name,
+                                                               get_label_text(labels + (("le", bound),)), count))
+                    lines.append("{}{}_sum{} {}".format(self.prefix, name, get_label_text(labels), histogram[1]))
+                    lines.append("{}{}_count{} {}".format(self.prefix, name, get_label_text(labels), histogram[2]))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, metrics_file):
+        # Prometheus text for *.prom (node exporter's textfile collector), JSON otherwise
+        if metrics_file.endswith(".prom"):
+            text = self.to_prometheus()
+        else:
+            text = self.to_json()
+
+        # Written next to the target and renamed, so a collector never reads half a file
+        tmp_file = metrics_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write(text)
+        os.replace(tmp_file, metrics_file)
+
+
+def get_label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def get_label_text(labels):
+    if len(labels) == 0:
+        return ""
+
+    values = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        values.append("{}=\"{}\"".format(name, value))
+
+    return "{" + ",".join(values) + "}"
+
+
+def get_cumulative(counts):
+    cumulative = []
+    total = 0
+
+    for count in counts:
+        total = total + count
+        cumulative.append(total)
+
+    return cumulative
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import cProfile
+import threading
+
+
+class Profiler(object):
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        self.lock = threading.Lock()
+        self.num_sessions = 0
+
+        # A session lasts while any operation is running, overlapping operations share it
+        self.profile = None
+        self.operations = []
+        self.session_operations = []
+        self.start_time = 0
+        self.events = []
+        self.thread_names = dict()
+
+    def is_active(self):
+        return self.profile is not None
+
+    def start(self, operation):
+        with self.lock:
+            self.operations.append(operation)
+            self.session_operations.append(operation)
+            if self.profile is not None:
+                return
+
+            self.profile = cProfile.Profile()
+            self.start_time = time.monotonic()
+            self.events = []
+            self.thread_names = dict()
+            profile = self.profile
+
+        # cProfile only follows the thread that starts it, worker threads show up in the trace
+        profile.enable()
+
+    def stop(self, operation):
+        with self.lock:
+            if operation not in self.operations:
+                return None
+
+            self.operations.remove(operation)
+            if len(self.operations) > 0:
+                return None
+
+            profile = self.profile
+            self.profile = None
+            self.num_sessions = self.num_sessions + 1
+            name = "{:03d}-{}".format(self.num_sessions, "+".join(self.session_operations))
+            self.session_operations = []
+            events = self.events
+            thread_names = self.thread_names
+
+        profile.disable()
+
+        base_path = os.path.join(self.output_dir, name)
+        profile.dump_stats(base_path + ".prof")
+        self.write_trace(base_path + ".trace.json", events, thread_names)
+
+        return base_path
+
+    def add_span(self, name, category, start, end, args=None):
+        # start/end are time.monotonic() values
+        if self.profile is None:
+            return
+
+        thread = threading.current_thread()
+        event = {"name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": thread.ident,
+                 "ts": (start - self.start_time) * 1000000, "dur": (end - start) * 1000000}
+        if args is not None:
+            event["args"] = args
+
+        with self.lock:
+            self.events.append(event)
+            self.thread_names[thread.ident] = thread.name
+
+    def write_trace(self, trace_file, events, thread_names):
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                    for tid, name in thread_names.items()]
+
+        with open(trace_file, "w") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,111 @@
+ALBUM_FILE = "\"Album\""
+
+# mp3gain -o column -> (record attribute, converter)
+COLUMNS = {"File": ("file", str),
+           "MP3 gain": ("mp3_gain", int),
+           "dB gain": ("db_gain", float),
+           "Max Amplitude": ("max_amplitude", float),
+           "Max global_gain": ("max_global_gain", int),
+           "Min global_gain": ("min_global_gain", int),
+           "Album gain": ("album_gain", int),
+           "Album dB gain": ("album_db_gain", float),
+           "Album Max Amplitude": ("album_max_amplitude", float),
+           "Album Max global_gain": ("album_max_global_gain", int),
+           "Album Min global_gain": ("album_min_global_gain", int)}
+
+
+class MP3GainResult(object):
+    __slots__ = ["file", "mp3_gain", "db_gain", "max_amplitude", "max_global_gain", "min_global_gain", "album_gain",
+                 "album_db_gain", "album_max_amplitude", "album_max_global_gain", "album_min_global_gain",
+                 "extra", "tag_exists", "columns"]
+
+    def __init__(self, columns=None):
+        # Columns without a value (NA) stay unset, unknown columns go to extra
+        self.extra = None
+        self.tag_exists = False
+
+        # (column, attribute) of the parser's known columns, shared by its results
+        if columns is None:
+            self.columns = [(column, COLUMNS[column][0]) for column in COLUMNS]
+        else:
+            self.columns = columns
+
+    def as_dict(self):
+        entry = {"tag_exists": self.tag_exists}
+
+        for column, attribute in self.columns:
+            value = getattr(self, attribute, None)
+            if value is not None:
+                entry[column] = value
+
+        if self.extra is not None:
+            entry.update(self.extra)
+
+        return entry
+
+
+class ResultParser(object):
+    def __init__(self, header_line):
+        self.headers = header_line.rstrip('\n').split('\t')
+        self.num_columns = len(self.headers)
+
+        # Compiled once per mp3gain run: (index, attribute, converter) for known columns, (index, header) for others
+        self.columns = []
+        self.extra_columns = []
+        self.result_columns = []
+
+        for idx, header in enumerate(self.headers):
+            if header in COLUMNS:
+                self.columns.append((idx,) + COLUMNS[header])
+                self.result_columns.append((header, COLUMNS[header][0]))
+            else:
+                self.extra_columns.append((idx, header))
+
+    def parse_line(self, line):
+        fields = line.rstrip('\n').split('\t')
+
+        # Status lines ("Applying mp3 gain change...", "No changes to undo...", blank lines) aren't tab separated
+        # like the header; the "Album" summary line is, but isn't a file
+        if len(fields) < self.num_columns or fields[0] == ALBUM_FILE:
+            return None
+
+        # A file name may contain tabs itself
+        if len(fields) > self.num_columns:
+            extra = len(fields) - self.num_columns
+            fields = ['\t'.join(fields[0:extra + 1])] + fields[extra + 1:]
+
+        result = MP3GainResult(self.result_columns)
+
+        try:
+            for idx, attribute, converter in self.columns:
+                value = fields[idx]
+                if value != "NA":
+                    setattr(result, attribute, converter(value))
+                    if converter is not str:
+                        result.tag_exists = True
+        except ValueError:
+            return None
+
+        if len(self.extra_columns) > 0:
+            result.extra = {header: fields[idx] for idx, header in self.extra_columns if fields[idx] != "NA"}
+
+        return result
+
+    def parse_lines(self, lines):
+        results = []
+
+        for line in lines:
+            result = self.parse_line(line)
+            if result is not None:
+                results.append(result)
+
+        return results
+
+
+def parse_output(output):
+    # Bulk parsing of a whole run's stdout, header line included
+    lines = output.splitlines()
+    if len(lines) == 0:
+        return []
+
+    return ResultParser(lines[0]).parse_lines(lines[1:])
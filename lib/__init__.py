@@ -1,2 +1,6 @@
 from .MP3Gain import MP3Gain
+from .AnalysisCache import AnalysisCache
+from .JobJournal import JobJournal
+from .FrameIndex import FrameIndex
+from .ResultParser import ResultParser, MP3GainResult
 from .util import *
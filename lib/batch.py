@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import shutil
+
+from lib.util import *
+
+MODES = {"track": (False, False),
+         "album": (True, False),
+         "album-folders": (True, True)}
+OPERATIONS = ["analyze", "apply", "undo", "delete-tags"]
+RESUME_OPERATIONS = ["apply", "undo", "delete-tags"]
+
+
+def get_mp3_files(paths):
+    mp3_files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            mp3_files.extend(sorted(get_paths(path, "mp3", True)))
+        else:
+            mp3_files.append(path)
+
+    return mp3_files
+
+
+def run_batch(mp3gain, operation, paths, mode="track", target_volume=89.0, ordered=False, output=None, force=False):
+    if output is None:
+        output = sys.stdout
+
+    if operation not in OPERATIONS:
+        raise ValueError("unknown operation {}".format(operation))
+
+    if mode not in MODES:
+        raise ValueError("unknown mode {}".format(mode))
+
+    if shutil.which(mp3gain.mp3gain) is None:
+        print("mp3gain executable not found ({}).".format(mp3gain.mp3gain), file=sys.stderr)
+        return 2
+
+    album_analysis, album_analysis_by_folder = MODES[mode]
+    if operation in ["undo", "delete-tags"]:
+        album_analysis = False
+        album_analysis_by_folder = False
+
+    mp3_list = group_by_folder(get_mp3_files(paths), album_analysis_by_folder)
+
+    # All folders go to a single call, so independent albums run concurrently
+    if operation == "analyze":
+        job = mp3gain.get_file_analysis(src=mp3_list, stored_only=False, album_analysis=album_analysis,
+                                        ordered=ordered)
+    elif operation == "apply":
+        if not force:
+            # Files already at the target volume are left alone
+            plan = mp3gain.plan_volume(mp3_list, target_volume, album_analysis)
+            output.write(json.dumps({"operation": operation, "plan": {"change": len(plan["change"]),
+                                                                      "unchanged": len(plan["unchanged"]),
+                                                                      "analysis": len(plan["analysis"])}}) + "\n")
+            output.flush()
+            mp3_list = plan["groups"]
+
+        job = mp3gain.set_volume(src=mp3_list, volume=target_volume, use_album_gain=album_analysis, ordered=ordered)
+    elif operation == "undo":
+        job = mp3gain.undo_gain(src=mp3_list, ordered=ordered)
+    else:
+        job = mp3gain.delete_tags(src=mp3_list, ordered=ordered)
+
+    return write_job(job, operation, output, album_analysis_by_folder)
+
+
+def resume_batch(mp3gain, job_id=None, ordered=False, output=None, discard=False):
+    if output is None:
+        output = sys.stdout
+
+    journal = mp3gain.get_journal()
+
+    # Without a job id, the interrupted jobs are listed
+    if job_id is None:
+        for entry in journal.get_unfinished_jobs():
+            output.write(json.dumps(entry) + "\n")
+        output.flush()
+        return 0
+
+    entry = journal.get_job(job_id)
+    if entry is None:
+        print("No such job in the journal ({}).".format(job_id), file=sys.stderr)
+        return 2
+
+    if discard:
+        journal.discard_job(job_id)
+        return 0
+
+    if entry["operation"] not in RESUME_OPERATIONS:
+        print("Unknown operation in the journal ({}).".format(entry["operation"]), file=sys.stderr)
+        return 2
+
+    if shutil.which(mp3gain.mp3gain) is None:
+        print("mp3gain executable not found ({}).".format(mp3gain.mp3gain), file=sys.stderr)
+        return 2
+
+    job = mp3gain.resume_job(job_id, ordered=ordered)
+
+    album_by_folder = entry["operation"] == "apply" and entry["params"]["use_album_gain"] and \
+        len(entry["all_groups"]) > 1
+
+    return write_job(job, entry["operation"], output, album_by_folder)
+
+
+def write_job(job, operation, output, album_analysis_by_folder=False):
+    cancelled = False
+
+    while True:
+        try:
+            job.wait_update()
+            running = job.is_running()
+
+            # An album's results are queued before its completion, so they are written first
+            completed = job.get_completed_groups()
+            write_results(job, operation, output)
+
+            if album_analysis_by_folder:
+                for folder in completed:
+                    output.write(json.dumps({"operation": operation, "album": folder, "completed": True}) + "\n")
+                output.flush()
+
+            if not running:
+                break
+        except KeyboardInterrupt:
+            # mp3gain runs in its own session, so it stops between files and the results so far are still written
+            print("Cancelling...", file=sys.stderr)
+            job.cancel()
+            cancelled = True
+
+    if cancelled:
+        output.write(json.dumps({"operation": operation, "cancelled": True,
+                                 "completed": len(job.get_completed_files()),
+                                 "total": job.expected_results}) + "\n")
+        output.flush()
+        return 130
+
+    return 0
+
+
+def write_results(job, operation, output):
+    for entry in job.get_results():
+        entry["operation"] = operation
+        output.write(json.dumps(entry) + "\n")
+
+    output.flush()
@@ -0,0 +1,276 @@
+import os
+import mmap
+import shutil
+import sqlite3
+
+from lib.tags import *
+from lib.ChunkProgress import get_temp_file
+from lib.FrameIndex import FrameIndex, fit_gain_change
+from lib.AnalysisCache import AnalysisCache
+from lib.prediction import get_gain_range
+
+UNDO_TAG = "MP3GAIN_UNDO"
+MIN_MAX_TAG = "MP3GAIN_MINMAX"
+
+frame_caches = dict()
+
+
+def get_frame_cache(cache_file):
+    if cache_file is None:
+        return None
+
+    # Native jobs run in worker processes, each opening its own connection to the shared cache
+    if cache_file not in frame_caches:
+        try:
+            frame_caches[cache_file] = AnalysisCache(cache_file)
+        except sqlite3.Error:
+            frame_caches[cache_file] = None
+
+    return frame_caches[cache_file]
+
+
+def get_audio_range(mp3):
+    start = 0
+
+    mp3.seek(0)
+    header = mp3.read(ID3V2_HEADER_SIZE)
+    if len(header) == ID3V2_HEADER_SIZE and header[0:3] == b"ID3":
+        start = ID3V2_HEADER_SIZE + syncsafe_int(header[6:10])
+        if header[5] & 0x10:
+            start = start + ID3V2_HEADER_SIZE
+
+    end, _, _ = read_ape_items(mp3)
+
+    return start, end
+
+
+def get_work_copy(mp3_file):
+    # Frames and tags are changed in a copy that replaces the file once both are written, so an interrupted change
+    # leaves either the old or the new file and is simply run again on resume. Replacing would break hard links,
+    # those files are left to mp3gain.
+    stat = os.stat(mp3_file)
+    if stat.st_nlink > 1:
+        return None
+
+    temp_file = get_temp_file(mp3_file)
+    shutil.copyfile(mp3_file, temp_file)
+    os.chmod(temp_file, stat.st_mode & 0o7777)
+    try:
+        os.chown(temp_file, stat.st_uid, stat.st_gid)
+    except OSError:
+        pass
+
+    return temp_file
+
+
+def replace_with_copy(temp_file, mp3_file):
+    with open(temp_file, 'rb') as f:
+        os.fsync(f.fileno())
+
+    os.replace(temp_file, mp3_file)
+
+
+def remove_work_copy(temp_file):
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+
+
+def change_gain(mp3_file, left_change, right_change, frame_cache=None, target_file=None):
+    # Changes target_file (a copy of mp3_file) if given, using mp3_file's cached frame index
+    frame_index = None
+    if frame_cache is not None:
+        frame_index = frame_cache.get_frame_index(mp3_file)
+
+    if target_file is None:
+        target_file = mp3_file
+
+    with open(target_file, 'r+b') as mp3:
+        if frame_index is None:
+            start, end = get_audio_range(mp3)
+            if end <= start:
+                return None
+
+        with mmap.mmap(mp3.fileno(), 0) as data:
+            if frame_index is None:
+                frame_index = FrameIndex.scan(data, start, end)
+                if len(frame_index) == 0:
+                    return None
+            else:
+                frame_index.read_gains(data)
+
+            gain_min, gain_max = get_gain_range(frame_index)
+
+            # Like mp3gain, a change that would overflow a frame's global_gain is reduced to what fits, so the change
+            # that is returned (and recorded for undo) is exactly the one applied
+            left_change = fit_gain_change(left_change, gain_min, gain_max)
+            right_change = fit_gain_change(right_change, gain_min, gain_max)
+
+            frame_index.change_gain(data, left_change, right_change)
+            data.flush()
+
+    # mp3gain tracks mono files with the same change for both channels
+    if frame_index.get_channels() == 1:
+        right_change = left_change
+
+    return frame_index, gain_min, gain_max, left_change, right_change
+
+
+def get_undo(analysis_tags):
+    undo = analysis_tags.get(UNDO_TAG)
+    if undo is None:
+        return None
+
+    try:
+        left, right = undo.split(',')[0:2]
+        return int(left), int(right)
+    except ValueError:
+        return 0, 0
+
+
+def get_gain_tags(analysis, frame_index):
+    tags = dict()
+    tags[MIN_MAX_TAG] = "{:03d},{:03d}".format(*get_gain_range(frame_index))
+
+    for _, db_key, peak_key, tag_prefix in GAIN_KEYS:
+        if db_key in analysis:
+            tags[tag_prefix + "GAIN"] = "{:+f} dB".format(analysis[db_key])
+        if peak_key in analysis:
+            tags[tag_prefix + "PEAK"] = "{:f}".format(analysis[peak_key] / 32768.0)
+
+    for min_key, max_key, tag in MIN_MAX_KEYS[1:]:
+        if min_key in analysis and max_key in analysis:
+            tags[tag] = "{:03d},{:03d}".format(analysis[min_key], analysis[max_key])
+
+    return tags
+
+
+def put_frame_index(mp3_file, frame_index, frame_cache):
+    # Stored after the tags are written, so the cache key matches the file's final size and mtime
+    if frame_cache is not None:
+        frame_cache.put_frame_index(mp3_file, frame_index)
+
+
+def apply_gain(analysis, gain_change, volume_offset, album=False, frame_cache=None):
+    mp3_file = analysis["File"]
+    db_key = GAIN_KEYS[1][1] if album else GAIN_KEYS[0][1]
+    peak_key = GAIN_KEYS[1][2] if album else GAIN_KEYS[0][2]
+
+    undo = get_undo(read_tags(mp3_file))
+    if undo is None:
+        undo = (0, 0)
+
+    temp_file = get_work_copy(mp3_file)
+    if temp_file is None:
+        return None
+
+    try:
+        changed = change_gain(mp3_file, gain_change, gain_change, frame_cache, temp_file)
+        if changed is None:
+            return None
+
+        frame_index, gain_min, gain_max, left_change, right_change = changed
+
+        tags = get_gain_tags(apply_gain_change(analysis, left_change), frame_index)
+
+        if left_change != 0 or right_change != 0:
+            tags[UNDO_TAG] = "{:+04d},{:+04d},N".format(undo[0] + left_change, undo[1] + right_change)
+
+        write_ape_tags(temp_file, tags)
+        replace_with_copy(temp_file, mp3_file)
+    finally:
+        remove_work_copy(temp_file)
+
+    put_frame_index(mp3_file, frame_index, frame_cache)
+
+    result = {"File": mp3_file,
+              "tag_exists": True,
+              "MP3 gain": left_change,
+              "dB gain": analysis[db_key] + volume_offset,
+              "Max global_gain": gain_max,
+              "Min global_gain": gain_min}
+    if peak_key in analysis:
+        result["Max Amplitude"] = analysis[peak_key]
+
+    return result
+
+
+def apply_gain_files(mp3_files, volume_offset, album=False, cache_file=None):
+    analyses = [get_stored_analysis(mp3_file) for mp3_file in mp3_files]
+    gain_changes = [get_gain_change(analysis, volume_offset, album) for analysis in analyses]
+
+    # Album gain only makes sense if every file of the album carries it, otherwise mp3gain has to analyze them all
+    if album and any(gain_change is None for gain_change in gain_changes):
+        return [], mp3_files
+
+    frame_cache = get_frame_cache(cache_file)
+    results = []
+    fallback_files = []
+
+    for analysis, gain_change in zip(analyses, gain_changes):
+        result = None
+
+        if gain_change is not None:
+            try:
+                result = apply_gain(analysis, gain_change, volume_offset, album, frame_cache)
+            except (OSError, ValueError):
+                result = None
+
+        if result is None:
+            fallback_files.append(analysis["File"])
+        else:
+            results.append(result)
+
+    return results, fallback_files
+
+
+def undo_gain(mp3_file, frame_cache=None):
+    undo = get_undo(read_tags(mp3_file))
+    if undo is None:
+        return {"File": mp3_file,
+                "tag_exists": False,
+                "left global_gain change": "0",
+                "right global_gain change": "0"}
+
+    temp_file = get_work_copy(mp3_file)
+    if temp_file is None:
+        return None
+
+    try:
+        changed = change_gain(mp3_file, -undo[0], -undo[1], frame_cache, temp_file)
+        if changed is None:
+            return None
+
+        frame_index, _, _, left_change, right_change = changed
+
+        tags = get_gain_tags(apply_gain_change(get_stored_analysis(mp3_file), left_change), frame_index)
+
+        write_ape_tags(temp_file, tags, remove=[UNDO_TAG])
+        replace_with_copy(temp_file, mp3_file)
+    finally:
+        remove_work_copy(temp_file)
+
+    put_frame_index(mp3_file, frame_index, frame_cache)
+
+    return {"File": mp3_file,
+            "tag_exists": False,
+            "left global_gain change": str(left_change),
+            "right global_gain change": str(right_change)}
+
+
+def undo_gain_files(mp3_files, cache_file=None):
+    frame_cache = get_frame_cache(cache_file)
+    results = []
+    fallback_files = []
+
+    for mp3_file in mp3_files:
+        try:
+            result = undo_gain(mp3_file, frame_cache)
+        except (OSError, ValueError):
+            result = None
+
+        if result is None:
+            fallback_files.append(mp3_file)
+        else:
+            results.append(result)
+
+    return results, fallback_files
@@ -0,0 +1,83 @@
+import math
+import functools
+
+from lib.tags import MP3_GAIN_STEP_DB
+from lib.FrameIndex import MAX_GLOBAL_GAIN
+
+MAX_AMPLITUDE = 32767
+GAIN_UNKNOWN = -1
+CLIPPING_FLAG = 1
+OVERFLOW_FLAG = 2
+
+
+@functools.lru_cache(maxsize=None)
+def get_numpy():
+    # Imported on first use, NumPy takes a while to load and batch runs only need it for native jobs
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    return numpy
+
+
+def get_gain_range(frame_index):
+    if len(frame_index.gains) == 0:
+        return None
+
+    numpy = get_numpy()
+    if numpy is None:
+        return frame_index.get_min_max()
+
+    gains = numpy.frombuffer(frame_index.gains, dtype=numpy.uint8)
+
+    return int(gains.min()), int(gains.max())
+
+
+def predict_gain_change(db_gains, gain_offset, peaks, min_gains, max_gains):
+    # Unknown values are NaN (dB gain, peak) or GAIN_UNKNOWN (global_gain) and never predict clipping or overflow
+    numpy = get_numpy()
+    if numpy is None:
+        return predict_gain_change_python(db_gains, gain_offset, peaks, min_gains, max_gains)
+
+    db_gains = numpy.asarray(db_gains, dtype=numpy.float64)
+    peaks = numpy.asarray(peaks, dtype=numpy.float64)
+    min_gains = numpy.asarray(min_gains, dtype=numpy.int32)
+    max_gains = numpy.asarray(max_gains, dtype=numpy.int32)
+
+    with numpy.errstate(invalid='ignore'):
+        gain_changes = numpy.floor(0.5 + db_gains / MP3_GAIN_STEP_DB) + gain_offset
+        clipping = peaks * numpy.exp2(gain_changes / 4.0) > MAX_AMPLITUDE
+
+        known = (min_gains != GAIN_UNKNOWN) & (max_gains != GAIN_UNKNOWN)
+        overflow = known & ((max_gains + gain_changes > MAX_GLOBAL_GAIN) | (min_gains + gain_changes < 0))
+
+    return gain_changes, clipping, overflow
+
+
+def predict_gain_change_python(db_gains, gain_offset, peaks, min_gains, max_gains):
+    gain_changes = []
+    clipping = []
+    overflow = []
+
+    for idx in range(len(db_gains)):
+        gain_change = math.nan
+        if not math.isnan(db_gains[idx]):
+            gain_change = math.floor(0.5 + db_gains[idx] / MP3_GAIN_STEP_DB) + gain_offset
+
+        gain_changes.append(gain_change)
+        clipping.append(peaks[idx] * 2.0 ** (gain_change / 4.0) > MAX_AMPLITUDE)
+        overflow.append(min_gains[idx] != GAIN_UNKNOWN and max_gains[idx] != GAIN_UNKNOWN and
+                        (max_gains[idx] + gain_change > MAX_GLOBAL_GAIN or min_gains[idx] + gain_change < 0))
+
+    return gain_changes, clipping, overflow
+
+
+def get_prediction_flags(clipping, overflow):
+    numpy = get_numpy()
+    if numpy is not None and isinstance(clipping, numpy.ndarray):
+        flags = clipping.astype(numpy.int8) * CLIPPING_FLAG | overflow.astype(numpy.int8) * OVERFLOW_FLAG
+        return flags.tobytes()
+
+    return bytes([(CLIPPING_FLAG if clipping[idx] else 0) | (OVERFLOW_FLAG if overflow[idx] else 0)
+                  for idx in range(len(clipping))])
@@ -0,0 +1,220 @@
+import math
+import mmap
+
+try:
+    import numpy
+    import soundfile
+    from scipy.signal import lfilter
+except ImportError:
+    numpy = None
+    soundfile = None
+    lfilter = None
+
+from lib.tags import *
+from lib.FrameIndex import FrameIndex
+from lib.prediction import get_gain_range
+from lib.globalgain import get_audio_range, get_frame_cache, get_gain_tags, put_frame_index
+
+PINK_REF = 64.82
+RMS_PERCENTILE = 0.95
+RMS_WINDOW_TIME = 0.050
+STEPS_PER_DB = 100
+MAX_DB = 120
+BLOCK_SIZE = 65536
+SAMPLE_SCALE = 32768.0
+
+# Equal loudness filter coefficients (b, a) from the ReplayGain reference implementation (gain_analysis.c).
+# Other sample rates are left to mp3gain.
+YULE_FILTERS = {
+    48000: ([0.03857599435200, -0.02160367184185, -0.00123395316851, -0.00009291677959, -0.01655260341619,
+             0.02161526843274, -0.02074045215285, 0.00594298065125, 0.00306428023191, 0.00012025322027,
+             0.00288463683916],
+            [1.0, -3.84664617118067, 7.81501653005538, -11.34170355132042, 13.05504219327545, -12.28759895145294,
+             9.48293806319790, -5.87257861775999, 2.75465861874613, -0.86984376593551, 0.13919314567432]),
+    44100: ([0.05418656406430, -0.02911007808948, -0.00848709379851, -0.00851165645469, -0.00834990904936,
+             0.02245293253339, -0.02596338512915, 0.01624864962975, -0.00240879051584, 0.00674613682247,
+             -0.00187763777362],
+            [1.0, -3.47845948550071, 6.36317777566148, -8.54751527471874, 9.47693607801280, -8.81498681370155,
+             6.85401540936998, -4.39470996079559, 2.19611684890774, -0.75104302451432, 0.13149317958808]),
+    32000: ([0.15457299681924, -0.09331049056315, -0.06247880153653, 0.02163541888798, -0.05588393329856,
+             0.04781476674921, 0.00222312597743, 0.03174092540049, -0.01390589421898, 0.00651420667831,
+             -0.00881362733839],
+            [1.0, -2.37898834973084, 2.84868151156327, -2.64577170229825, 2.23697657451713, -1.67148153367602,
+             1.00595954808547, -0.45953458054983, 0.16378164858596, -0.05032077717131, 0.02347897407020]),
+}
+BUTTER_FILTERS = {
+    48000: ([0.98621192462708, -1.97242384925416, 0.98621192462708], [1.0, -1.97223372919527, 0.97261396931306]),
+    44100: ([0.98500175787242, -1.97000351574484, 0.98500175787242], [1.0, -1.96977855582618, 0.97022847566350]),
+    32000: ([0.97938932735214, -1.95877865470428, 0.97938932735214], [1.0, -1.95835380975398, 0.95920349965459]),
+}
+
+
+def is_available():
+    return numpy is not None
+
+
+def get_histogram_size():
+    return STEPS_PER_DB * MAX_DB
+
+
+def analyze_samples(mp3_file):
+    info = soundfile.info(mp3_file)
+    if info.samplerate not in YULE_FILTERS or info.channels not in [1, 2]:
+        return None
+
+    yule_b, yule_a = YULE_FILTERS[info.samplerate]
+    butter_b, butter_a = BUTTER_FILTERS[info.samplerate]
+    yule_state = numpy.zeros((len(yule_a) - 1, info.channels))
+    butter_state = numpy.zeros((len(butter_a) - 1, info.channels))
+
+    window_size = int(math.ceil(info.samplerate * RMS_WINDOW_TIME))
+    histogram = numpy.zeros(get_histogram_size(), dtype=numpy.int64)
+    remainder = numpy.zeros(0)
+    peak = 0.0
+
+    for block in soundfile.blocks(mp3_file, blocksize=BLOCK_SIZE, dtype='float64', always_2d=True):
+        block = block * SAMPLE_SCALE
+        peak = max(peak, float(numpy.abs(block).max()))
+
+        filtered, yule_state = lfilter(yule_b, yule_a, block, axis=0, zi=yule_state)
+        filtered, butter_state = lfilter(butter_b, butter_a, filtered, axis=0, zi=butter_state)
+
+        # Mean square over channels; mono counts as both channels, like the reference implementation
+        squares = numpy.concatenate([remainder, (filtered * filtered).mean(axis=1)])
+        num_windows = len(squares) // window_size
+        remainder = squares[num_windows * window_size:]
+
+        if num_windows > 0:
+            windows = squares[:num_windows * window_size].reshape(num_windows, window_size).mean(axis=1)
+            levels = numpy.trunc(STEPS_PER_DB * 10.0 * numpy.log10(windows + 1e-37))
+            levels = numpy.clip(levels, 0, get_histogram_size() - 1).astype(numpy.int64)
+            histogram = histogram + numpy.bincount(levels, minlength=get_histogram_size())
+
+    return histogram, peak
+
+
+def get_histogram_gain(histogram):
+    num_windows = int(histogram.sum())
+    if num_windows == 0:
+        return None
+
+    upper = int(math.ceil(num_windows * (1.0 - RMS_PERCENTILE)))
+    level = len(histogram) - 1 - int(numpy.argmax(numpy.cumsum(histogram[::-1]) >= upper))
+
+    return PINK_REF - level / STEPS_PER_DB
+
+
+def get_gain_result(mp3_file, db_gain, peak, frame_index):
+    gain_min, gain_max = get_gain_range(frame_index)
+
+    return {"File": mp3_file,
+            "tag_exists": True,
+            "MP3 gain": int(math.floor(0.5 + db_gain / MP3_GAIN_STEP_DB)),
+            "dB gain": db_gain,
+            "Max Amplitude": peak,
+            "Max global_gain": gain_max,
+            "Min global_gain": gain_min}
+
+
+def get_frame_index(mp3_file, frame_cache):
+    if frame_cache is not None:
+        frame_index = frame_cache.get_frame_index(mp3_file)
+        if frame_index is not None:
+            return frame_index
+
+    with open(mp3_file, 'rb') as mp3:
+        start, end = get_audio_range(mp3)
+        if end <= start:
+            return None
+
+        with mmap.mmap(mp3.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            frame_index = FrameIndex.scan(data, start, end)
+
+    if len(frame_index) == 0:
+        return None
+
+    return frame_index
+
+
+def analyze_track(mp3_file, frame_cache=None):
+    try:
+        analysis = analyze_samples(mp3_file)
+        frame_index = get_frame_index(mp3_file, frame_cache)
+    except (OSError, RuntimeError, ValueError):
+        return None
+
+    if analysis is None or frame_index is None:
+        return None
+
+    histogram, peak = analysis
+    db_gain = get_histogram_gain(histogram)
+    if db_gain is None:
+        return None
+
+    return get_gain_result(mp3_file, db_gain, peak, frame_index), histogram, frame_index
+
+
+def is_analyzed(analysis, album):
+    # Like mp3gain, files that already carry a complete analysis aren't decoded again
+    keys = ["dB gain", "Max Amplitude", "Min global_gain", "Max global_gain"]
+    if album:
+        keys = keys + ["Album dB gain", "Album Max Amplitude", "Album Min global_gain", "Album Max global_gain"]
+
+    return all(key in analysis for key in keys)
+
+
+def store_analysis(result, frame_index, frame_cache):
+    write_ape_tags(result["File"], get_gain_tags(result, frame_index))
+    put_frame_index(result["File"], frame_index, frame_cache)
+
+
+def analyze_files(mp3_files, album=False, cache_file=None):
+    if not is_available():
+        return [], mp3_files
+
+    stored = [get_stored_analysis(mp3_file) for mp3_file in mp3_files]
+    if album and all(is_analyzed(analysis, album) for analysis in stored):
+        return stored, []
+
+    frame_cache = get_frame_cache(cache_file)
+    results = []
+    tracks = []
+    fallback_files = []
+
+    for analysis in stored:
+        if not album and is_analyzed(analysis, album):
+            results.append(analysis)
+            continue
+
+        track = analyze_track(analysis["File"], frame_cache)
+        if track is None:
+            fallback_files.append(analysis["File"])
+        else:
+            tracks.append(track)
+
+    # The album gain needs every track's histogram, so an album is either analyzed here entirely or by mp3gain
+    if album and len(fallback_files) > 0:
+        return [], mp3_files
+
+    if album and len(tracks) > 0:
+        album_gain = get_histogram_gain(sum(track[1] for track in tracks))
+        album_peak = max(track[0]["Max Amplitude"] for track in tracks)
+        album_min = min(track[0]["Min global_gain"] for track in tracks)
+        album_max = max(track[0]["Max global_gain"] for track in tracks)
+
+        for result, _, _ in tracks:
+            result["Album gain"] = int(math.floor(0.5 + album_gain / MP3_GAIN_STEP_DB))
+            result["Album dB gain"] = album_gain
+            result["Album Max Amplitude"] = album_peak
+            result["Album Min global_gain"] = album_min
+            result["Album Max global_gain"] = album_max
+
+    for result, _, frame_index in tracks:
+        try:
+            store_analysis(result, frame_index, frame_cache)
+        except OSError:
+            print("Error writing tags to {}.".format(result["File"]))
+
+        results.append(result)
+
+    return results, fallback_files
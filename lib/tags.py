@@ -0,0 +1,340 @@
+import math
+import struct
+
+APE_PREAMBLE = b"APETAGEX"
+APE_FOOTER_SIZE = 32
+APE_VERSION = 2000
+APE_HAS_HEADER = 0x80000000
+APE_IS_HEADER = 0x20000000
+ID3V1_SIZE = 128
+ID3V2_HEADER_SIZE = 10
+LYRICS3V2_END = b"LYRICS200"
+MP3_GAIN_STEP_DB = 5.0 * math.log10(2.0)
+GAIN_KEYS = [("MP3 gain", "dB gain", "Max Amplitude", "REPLAYGAIN_TRACK_"),
+             ("Album gain", "Album dB gain", "Album Max Amplitude", "REPLAYGAIN_ALBUM_")]
+MIN_MAX_KEYS = [("Min global_gain", "Max global_gain", "MP3GAIN_MINMAX"),
+                ("Album Min global_gain", "Album Max global_gain", "MP3GAIN_ALBUM_MINMAX")]
+
+
+def read_tags(mp3_file):
+    with open(mp3_file, 'rb') as mp3:
+        tags = read_id3v2_txxx(mp3)
+        tags.update(read_ape_tags(mp3))
+
+    return tags
+
+
+def get_ape_tag_end(mp3):
+    mp3.seek(0, 2)
+    end = mp3.tell()
+
+    if end >= ID3V1_SIZE:
+        mp3.seek(end - ID3V1_SIZE)
+        if mp3.read(3) == b"TAG":
+            end = end - ID3V1_SIZE
+
+            if end >= 15:
+                mp3.seek(end - 15)
+                lyrics = mp3.read(15)
+                if lyrics[6:] == LYRICS3V2_END and lyrics[0:6].isdigit():
+                    end = end - 15 - int(lyrics[0:6])
+
+    return end
+
+
+def get_ape_footer_offset(mp3):
+    end = get_ape_tag_end(mp3)
+
+    if end < APE_FOOTER_SIZE:
+        return None
+
+    mp3.seek(end - APE_FOOTER_SIZE)
+    if mp3.read(len(APE_PREAMBLE)) != APE_PREAMBLE:
+        return None
+
+    return end - APE_FOOTER_SIZE
+
+
+def read_ape_items(mp3):
+    items = []
+
+    footer_offset = get_ape_footer_offset(mp3)
+    if footer_offset is None:
+        tag_end = get_ape_tag_end(mp3)
+        return tag_end, tag_end, items
+
+    mp3.seek(footer_offset)
+    _, _, tag_size, item_count, tag_flags = struct.unpack("<8sIIII8x", mp3.read(APE_FOOTER_SIZE))
+
+    items_size = tag_size - APE_FOOTER_SIZE
+    if items_size < 0 or items_size > footer_offset:
+        return footer_offset, footer_offset + APE_FOOTER_SIZE, items
+
+    tag_start = footer_offset - items_size
+    if tag_flags & APE_HAS_HEADER and tag_start >= APE_FOOTER_SIZE:
+        tag_start = tag_start - APE_FOOTER_SIZE
+
+    mp3.seek(footer_offset - items_size)
+    data = mp3.read(items_size)
+
+    pos = 0
+    for _ in range(item_count):
+        if pos + 8 > len(data):
+            break
+
+        value_size, item_flags = struct.unpack_from("<II", data, pos)
+        key_end = data.find(b"\x00", pos + 8)
+        if key_end < 0:
+            break
+
+        key = data[pos + 8:key_end].decode('ascii', 'replace')
+        value = data[key_end + 1:key_end + 1 + value_size]
+        pos = key_end + 1 + value_size
+
+        items.append([key, item_flags, value])
+
+    return tag_start, footer_offset + APE_FOOTER_SIZE, items
+
+
+def read_ape_tags(mp3):
+    tags = dict()
+
+    _, _, items = read_ape_items(mp3)
+
+    for key, item_flags, value in items:
+        # Only UTF-8 text items are relevant; skip binary and external items
+        if item_flags & 0x06 == 0:
+            tags[key.upper()] = value.decode('utf8', 'replace')
+
+    return tags
+
+
+def write_ape_tags(mp3_file, tags, remove=None):
+    if remove is None:
+        remove = []
+
+    remove = [key.upper() for key in remove]
+
+    with open(mp3_file, 'r+b') as mp3:
+        tag_start, tag_end, items = read_ape_items(mp3)
+
+        new_items = []
+        for item in items:
+            key = item[0].upper()
+            if key in remove:
+                continue
+
+            if key in tags:
+                item = [item[0], 0, tags[key].encode('utf8')]
+
+            new_items.append(item)
+
+        existing_keys = [item[0].upper() for item in items]
+        for key in tags:
+            if key.upper() not in existing_keys:
+                new_items.append([key, 0, tags[key].encode('utf8')])
+
+        mp3.seek(tag_end)
+        trailing_tags = mp3.read()
+
+        mp3.seek(tag_start)
+        if len(new_items) > 0:
+            mp3.write(get_ape_tag(new_items))
+        mp3.write(trailing_tags)
+        mp3.truncate()
+
+
+def get_ape_tag(items):
+    data = b""
+    for key, item_flags, value in items:
+        data = data + struct.pack("<II", len(value), item_flags) + key.encode('ascii') + b"\x00" + value
+
+    tag_size = len(data) + APE_FOOTER_SIZE
+    header = struct.pack("<8sIIII8x", APE_PREAMBLE, APE_VERSION, tag_size, len(items),
+                         APE_HAS_HEADER | APE_IS_HEADER)
+    footer = struct.pack("<8sIIII8x", APE_PREAMBLE, APE_VERSION, tag_size, len(items), APE_HAS_HEADER)
+
+    return header + data + footer
+
+
+def read_id3v2_txxx(mp3):
+    tags = dict()
+
+    mp3.seek(0)
+    header = mp3.read(ID3V2_HEADER_SIZE)
+    if len(header) < ID3V2_HEADER_SIZE or header[0:3] != b"ID3":
+        return tags
+
+    major = header[3]
+    flags = header[5]
+    tag_size = syncsafe_int(header[6:10])
+    data = mp3.read(tag_size)
+
+    if flags & 0x80 and major < 4:
+        data = data.replace(b"\xff\x00", b"\xff")
+
+    pos = 0
+    if flags & 0x40 and major >= 3:
+        if major == 3:
+            pos = struct.unpack(">I", data[0:4])[0] + 4
+        else:
+            pos = syncsafe_int(data[0:4])
+
+    if major == 2:
+        frame_header_size = 6
+        txxx_id = b"TXX"
+    else:
+        frame_header_size = 10
+        txxx_id = b"TXXX"
+
+    while pos + frame_header_size <= len(data):
+        if major == 2:
+            frame_id = data[pos:pos + 3]
+            frame_size = int.from_bytes(data[pos + 3:pos + 6], 'big')
+        else:
+            frame_id = data[pos:pos + 4]
+            if major == 4:
+                frame_size = syncsafe_int(data[pos + 4:pos + 8])
+            else:
+                frame_size = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+
+        if frame_id[0:1] == b"\x00" or frame_size <= 0:
+            break
+
+        frame = data[pos + frame_header_size:pos + frame_header_size + frame_size]
+        pos = pos + frame_header_size + frame_size
+
+        if frame_id == txxx_id:
+            description, value = decode_txxx(frame)
+            if description:
+                tags[description.upper()] = value
+
+    return tags
+
+
+def decode_txxx(frame):
+    if len(frame) < 2:
+        return None, None
+
+    encoding = frame[0]
+    text = frame[1:]
+
+    if encoding in (1, 2):
+        codec = 'utf-16' if encoding == 1 else 'utf-16-be'
+        split = 0
+        while True:
+            split = text.find(b"\x00\x00", split)
+            if split < 0 or split % 2 == 0:
+                break
+            split = split + 1
+
+        if split < 0:
+            return None, None
+
+        description = text[0:split].decode(codec, 'replace')
+        value = text[split + 2:].decode(codec, 'replace')
+    else:
+        codec = 'utf8' if encoding == 3 else 'latin-1'
+        description, _, value = text.partition(b"\x00")
+        description = description.decode(codec, 'replace')
+        value = value.decode(codec, 'replace')
+
+    return description, value.rstrip("\x00")
+
+
+def syncsafe_int(data):
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7f)
+
+    return value
+
+
+def parse_db(value):
+    if value is None:
+        return None
+
+    try:
+        return float(value.strip().split()[0])
+    except (ValueError, IndexError):
+        return None
+
+
+def parse_float(value):
+    if value is None:
+        return None
+
+    try:
+        return float(value.strip())
+    except ValueError:
+        return None
+
+
+def parse_min_max(value):
+    if value is None:
+        return None
+
+    try:
+        min_gain, max_gain = value.split(",")[0:2]
+        return int(min_gain), int(max_gain)
+    except ValueError:
+        return None
+
+
+def get_stored_analysis(mp3_file):
+    entry = dict()
+    entry["File"] = mp3_file
+    entry["tag_exists"] = False
+
+    try:
+        tags = read_tags(mp3_file)
+    except (OSError, struct.error):
+        return entry
+
+    for gain_key, db_key, peak_key, tag_prefix in GAIN_KEYS:
+        db_gain = parse_db(tags.get(tag_prefix + "GAIN"))
+        if db_gain is not None:
+            entry[gain_key] = int(math.floor(0.5 + db_gain / MP3_GAIN_STEP_DB))
+            entry[db_key] = db_gain
+
+        peak = parse_float(tags.get(tag_prefix + "PEAK"))
+        if peak is not None:
+            entry[peak_key] = peak * 32768.0
+
+    for min_key, max_key, tag in MIN_MAX_KEYS:
+        min_max = parse_min_max(tags.get(tag))
+        if min_max is not None:
+            entry[min_key] = min_max[0]
+            entry[max_key] = min_max[1]
+
+    entry["tag_exists"] = len(entry) > 2
+
+    return entry
+
+
+def get_gain_change(analysis, volume_offset, album=False):
+    # The global_gain change mp3gain applies for a volume offset, None without a stored analysis
+    db_key = GAIN_KEYS[1][1] if album else GAIN_KEYS[0][1]
+    if db_key not in analysis:
+        return None
+
+    return int(math.floor(0.5 + (analysis[db_key] + volume_offset) / MP3_GAIN_STEP_DB))
+
+
+def apply_gain_change(analysis, gain_change):
+    result = dict(analysis)
+
+    for gain_key, db_key, peak_key, _ in GAIN_KEYS:
+        if db_key in result:
+            result[db_key] = result[db_key] - gain_change * MP3_GAIN_STEP_DB
+            result[gain_key] = int(math.floor(0.5 + result[db_key] / MP3_GAIN_STEP_DB))
+
+        if peak_key in result:
+            result[peak_key] = result[peak_key] * 2.0 ** (gain_change / 4.0)
+
+    for min_key, max_key, _ in MIN_MAX_KEYS:
+        for key in [min_key, max_key]:
+            if key in result:
+                result[key] = min(max(result[key] + gain_change, 0), 255)
+
+    return result
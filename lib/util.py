@@ -1,24 +1,61 @@
+import os
+import struct
+
+from pathlib import Path
+
 from scandir import scandir
 
+# Windows has no ARG_MAX, its command line is limited to 32767 characters
+WINDOWS_ARG_MAX = 32767
+ARG_MAX_MARGIN = 4096
+POINTER_SIZE = struct.calcsize("P")
+
 
 def get_paths(directory, extensions=None, recursive=False):
+    return list(iter_paths(directory, extensions, recursive))
+
+
+def iter_paths(directory, extensions=None, recursive=False, sort=False):
     if extensions is None:
         extensions = ""
 
     if recursive:
-        file_list = [x.path for x in scantree(directory) if
-                     x.name.lower().endswith(extensions)]
+        entries = scantree(directory, sort)
+    elif sort:
+        entries = sorted(scandir(directory), key=lambda x: x.name)
     else:
-        file_list = [x.path for x in scandir(directory) if
-                     x.name.lower().endswith(extensions)]
+        entries = scandir(directory)
+
+    for entry in entries:
+        if entry.name.lower().endswith(extensions):
+            yield entry.path
+
+
+def group_by_folder(mp3_files, by_folder=False):
+    mp3_folders = dict()
+
+    for mp3_file in mp3_files:
+        if by_folder:
+            folder = str(Path(mp3_file).parent)
+        else:
+            folder = "all"
+
+        if folder not in mp3_folders:
+            mp3_folders[folder] = []
 
-    return file_list
+        mp3_folders[folder].append(mp3_file)
 
+    return mp3_folders
 
-def scantree(path):
-    for entry in scandir(path):
+
+def scantree(path, sort=False):
+    entries = scandir(path)
+    if sort:
+        entries = sorted(entries, key=lambda x: x.name)
+
+    for entry in entries:
         if entry.is_dir(follow_symlinks=False):
-            yield from scantree(entry.path)
+            yield from scantree(entry.path, sort)
         else:
             yield entry
 
@@ -47,12 +84,111 @@ def split_list(input_list, size):
     for idx in range(num_lists):
         lists.append(input_list[idx*size:idx*size + size])
 
-    if size % len(input_list) != 0:
+    if len(input_list) % size != 0:
         lists.append(input_list[num_lists*size:])
 
     return lists
 
 
+def get_groups(src):
+    if isinstance(src, str):
+        src = [src]
+
+    if isinstance(src, dict):
+        return {name: list(files) for name, files in src.items()}
+
+    return {"all": list(src)}
+
+
+def get_chunks(groups, pack=False, max_files=99, max_bytes=0, max_arg_bytes=0, sizes=None):
+    # Returns (group names, files) per chunk. Unpacked groups are one chunk each, packed groups are concatenated and
+    # cut whenever a limit would be exceeded, so small groups share a chunk and large ones are split.
+    # A limit of 0 means no limit.
+    chunks = []
+
+    if not pack:
+        for name, files in groups.items():
+            if len(files) > 0:
+                chunks.append(([name], files))
+
+        return chunks
+
+    names = []
+    files = []
+    chunk_bytes = 0
+    chunk_arg_bytes = 0
+
+    for name, group_files in groups.items():
+        for mp3_file in group_files:
+            file_bytes = 0
+            if sizes is not None:
+                file_bytes = sizes.get(mp3_file, 0)
+
+            arg_bytes = 0
+            if max_arg_bytes > 0:
+                arg_bytes = get_arg_size(mp3_file)
+
+            if len(files) > 0 and ((0 < max_bytes < chunk_bytes + file_bytes) or
+                                   (0 < max_arg_bytes < chunk_arg_bytes + arg_bytes)):
+                chunks.append((names, files))
+                names = []
+                files = []
+                chunk_bytes = 0
+                chunk_arg_bytes = 0
+
+            if len(names) == 0 or names[-1] != name:
+                names.append(name)
+
+            files.append(mp3_file)
+            chunk_bytes = chunk_bytes + file_bytes
+            chunk_arg_bytes = chunk_arg_bytes + arg_bytes
+
+            if 0 < max_files <= len(files):
+                chunks.append((names, files))
+                names = []
+                files = []
+                chunk_bytes = 0
+                chunk_arg_bytes = 0
+
+    if len(files) > 0:
+        chunks.append((names, files))
+
+    return chunks
+
+
+def get_arg_size(arg):
+    # Each argument costs its bytes, a terminating null and a pointer in argv
+    return len(os.fsencode(arg)) + 1 + POINTER_SIZE
+
+
+def get_arg_limit(cmd):
+    try:
+        arg_max = os.sysconf("SC_ARG_MAX")
+    except (AttributeError, ValueError, OSError):
+        arg_max = WINDOWS_ARG_MAX
+
+    if arg_max <= 0:
+        arg_max = WINDOWS_ARG_MAX
+
+    # The environment is passed along with the arguments and counts against the same limit
+    env_size = sum(get_arg_size(key) + len(os.fsencode(value)) + 1 for key, value in os.environ.items())
+
+    return max(arg_max - env_size - sum(get_arg_size(arg) for arg in cmd) - ARG_MAX_MARGIN, 1)
+
+
+def get_file_sizes(groups):
+    sizes = dict()
+
+    for files in groups.values():
+        for mp3_file in files:
+            try:
+                sizes[mp3_file] = os.path.getsize(mp3_file)
+            except OSError:
+                sizes[mp3_file] = 0
+
+    return sizes
+
+
 def time_as_display(msec):
     h = int(msec // 3600)
     m = int((msec - h * 3600) // 60)
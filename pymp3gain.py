@@ -3,34 +3,169 @@ import sys
 import os
 import argparse
 
-from PyQt5 import QtCore
-from PyQt5.QtWidgets import QApplication
-
-from gui import PyMP3GainApp
-
 VER = "0.2.9"
 script_path = os.path.dirname(os.path.abspath(__file__))
+JOURNAL_FILE = os.path.expanduser("~/.config/pymp3gain/journal.sqlite")
 
 
 def main():
-    QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)
-
     arguments = get_arguments().parse_args()
 
+    if arguments.operation is not None:
+        sys.exit(run_batch(arguments))
+
+    # PyQt5 is only imported for the GUI so batch mode works on headless machines
+    from PyQt5 import QtCore
+    from PyQt5.QtWidgets import QApplication
+
+    from gui import PyMP3GainApp
+
+    QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)
+
     app = QApplication(sys.argv)
 
-    ex = PyMP3GainApp(VER, arguments.debug)
+    ex = PyMP3GainApp(VER, arguments.debug, arguments.metrics_file, arguments.profile_dir)
     exit_code = app.exec_()
 
     sys.exit(exit_code)
 
 
+def run_batch(arguments):
+    from lib import MP3Gain, AnalysisCache, JobJournal
+    from lib import batch
+
+    mp3gain = MP3Gain(mp3gain_bin=arguments.mp3gain_bin, max_files=arguments.max_files,
+                      max_processes=arguments.max_processes, native_gain=arguments.native_gain,
+                      native_analysis=arguments.native_analysis, temp_files=arguments.temp_files,
+                      debug_output=arguments.debug)
+
+    if arguments.cache is not None:
+        mp3gain.set_cache(AnalysisCache(arguments.cache))
+
+    if arguments.journal:
+        mp3gain.set_journal(JobJournal(arguments.journal))
+    elif arguments.operation == "resume":
+        print("resume needs a journal (--journal).", file=sys.stderr)
+        return 2
+
+    profiler = None
+    if arguments.profile_dir is not None:
+        from lib.Profiler import Profiler
+        profiler = Profiler(arguments.profile_dir)
+        mp3gain.set_profiler(profiler)
+        profiler.start(arguments.operation)
+
+    if arguments.operation == "resume":
+        exit_code = batch.resume_batch(mp3gain, arguments.job_id, ordered=arguments.ordered,
+                                       discard=arguments.discard)
+    else:
+        exit_code = batch.run_batch(mp3gain, arguments.operation, arguments.paths, mode=arguments.mode,
+                                    target_volume=arguments.target_volume, ordered=arguments.ordered,
+                                    force=arguments.force)
+
+    if profiler is not None:
+        profile_path = profiler.stop(arguments.operation)
+        print("Profile written to {}.prof and {}.trace.json".format(profile_path, profile_path), file=sys.stderr)
+
+    if arguments.metrics_file is not None:
+        try:
+            mp3gain.get_metrics().write(arguments.metrics_file)
+        except OSError:
+            print("Error writing metrics ({}).".format(arguments.metrics_file), file=sys.stderr)
+
+    return exit_code
+
+
 def get_arguments():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("--debug",
                         action="store_true",
                         dest="debug",
                         help="Debug output.")
+    parser.add_argument("--metrics",
+                        default=None,
+                        dest="metrics_file",
+                        help="Write per-stage metrics to this file after each operation "
+                             "(Prometheus text format for *.prom, JSON otherwise).")
+    parser.add_argument("--profile",
+                        default=None,
+                        dest="profile_dir",
+                        help="Profile each operation (cProfile) and record a timeline of chunks, files and GUI "
+                             "batches (Chrome trace) into this directory.")
+
+    subparsers = parser.add_subparsers(dest="operation",
+                                       help="Run an operation without the GUI and print JSON Lines results.")
+
+    for operation in ["analyze", "apply", "undo", "delete-tags", "resume"]:
+        subparser = subparsers.add_parser(operation, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+        if operation == "resume":
+            subparser.add_argument("job_id",
+                                   nargs="?",
+                                   type=int,
+                                   default=None,
+                                   help="Interrupted job to continue (lists them if omitted).")
+            subparser.add_argument("--discard",
+                                   action="store_true",
+                                   dest="discard",
+                                   help="Drop the job from the journal instead of continuing it.")
+        else:
+            subparser.add_argument("paths",
+                                   nargs="+",
+                                   help="MP3 files or directories (searched recursively).")
+            subparser.add_argument("--mode",
+                                   choices=["track", "album", "album-folders"],
+                                   default="track",
+                                   help="Track, single album or one album per folder.")
+            subparser.add_argument("--target-volume",
+                                   type=float,
+                                   default=89.0,
+                                   dest="target_volume",
+                                   help="Target volume (dB).")
+            subparser.add_argument("--force",
+                                   action="store_true",
+                                   dest="force",
+                                   help="Apply: also run files whose stored analysis is already at the target volume.")
+
+        subparser.add_argument("--journal",
+                               default=JOURNAL_FILE,
+                               dest="journal",
+                               help="Journal of apply/undo/delete-tags jobs, for resume (empty to disable).")
+        subparser.add_argument("--mp3gain",
+                               default="/usr/bin/mp3gain",
+                               dest="mp3gain_bin",
+                               help="MP3Gain executable.")
+        subparser.add_argument("--max-files",
+                               type=int,
+                               default=0,
+                               dest="max_files",
+                               help="Maximum # of files per process (0 = sized by file size and throughput).")
+        subparser.add_argument("--processes",
+                               type=int,
+                               default=0,
+                               dest="max_processes",
+                               help="Maximum # of parallel processes (0 = CPU count).")
+        subparser.add_argument("--cache",
+                               default=None,
+                               dest="cache",
+                               help="Analysis cache file.")
+        subparser.add_argument("--ordered",
+                               action="store_true",
+                               dest="ordered",
+                               help="Output results in file order instead of completion order.")
+        subparser.add_argument("--native",
+                               action="store_true",
+                               dest="native_gain",
+                               help="Apply/undo gain of files with stored tags without running mp3gain.")
+        subparser.add_argument("--native-analysis",
+                               action="store_true",
+                               dest="native_analysis",
+                               help="Analyze 32/44.1/48 kHz files in-process (needs soundfile, NumPy and SciPy).")
+        subparser.add_argument("--temp-files",
+                               action="store_true",
+                               dest="temp_files",
+                               help="Have mp3gain write changed files to a temporary copy first (-t), so Ctrl+C stops "
+                                    "between files.")
 
     parser.set_defaults()
 
@@ -0,0 +1,44 @@
+import struct
+
+from lib.FrameIndex import get_header_info, get_global_gain_offsets, get_side_info_size, write_byte_at_bit, \
+    update_crc
+
+# MPEG1 Layer III, 128 kbit/s, 44.1 kHz, joint stereo, without and with CRC
+HEADER = 0xFFFB9064
+CRC_HEADER = 0xFFFA9064
+MONO_HEADER = 0xFFFB90C4
+
+
+def make_frames(gains, header=HEADER):
+    # One silent frame per entry of gains, every granule and channel of a frame set to that global_gain
+    frame_size, _, _, crc = get_header_info(header)
+    data = bytearray()
+
+    for gain in gains:
+        frame = bytearray(frame_size)
+        struct.pack_into(">I", frame, 0, header)
+
+        for _, bit_pos in get_global_gain_offsets(0, header):
+            write_byte_at_bit(frame, bit_pos, gain)
+
+        if crc:
+            update_crc(frame, 0, header)
+
+        data.extend(frame)
+
+    return data
+
+
+def get_reference_crc(frame, header):
+    # Bit by bit CRC-16 (0x8005, starting at 0xFFFF) over the last two header bytes and the side info
+    _, mpeg1, channels, _ = get_header_info(header)
+    crc = 0xFFFF
+
+    for byte in bytes(frame[2:4]) + bytes(frame[6:6 + get_side_info_size(mpeg1, channels)]):
+        for bit in range(7, -1, -1):
+            top = (crc >> 15) & 1
+            crc = (crc << 1) & 0xFFFF
+            if top ^ ((byte >> bit) & 1):
+                crc = crc ^ 0x8005
+
+    return crc
@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+import unittest
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+
+from lib.AnalysisCache import AnalysisCache  # noqa: E402
+from lib.FrameIndex import FrameIndex  # noqa: E402
+from frames import make_frames  # noqa: E402
+
+
+class TestAnalysisCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = AnalysisCache(os.path.join(self.directory.name, "cache", "analysis.db"))
+        self.mp3_files = [self.make_file("{}.mp3".format(idx), b"data") for idx in range(3)]
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    def make_file(self, name, data):
+        mp3_file = os.path.join(self.directory.name, name)
+        with open(mp3_file, "wb") as f:
+            f.write(data)
+
+        return mp3_file
+
+    def get_result(self, mp3_file, gain=1):
+        return {"File": mp3_file, "MP3 gain": gain, "tag_exists": True}
+
+    def test_get_many(self):
+        self.cache.put_many([self.get_result(mp3_file) for mp3_file in self.mp3_files[:2]])
+
+        results, misses = self.cache.get_many(self.mp3_files)
+
+        self.assertEqual(results, [self.get_result(mp3_file) for mp3_file in self.mp3_files[:2]])
+        self.assertEqual(misses, self.mp3_files[2:])
+        self.assertEqual(self.cache.get(self.mp3_files[0]), self.get_result(self.mp3_files[0]))
+
+    def test_invalidated_by_size_and_mtime(self):
+        self.cache.put_many([self.get_result(mp3_file) for mp3_file in self.mp3_files])
+
+        self.make_file("0.mp3", b"longer data")
+        stat = os.stat(self.mp3_files[1])
+        os.utime(self.mp3_files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        os.remove(self.mp3_files[2])
+
+        self.assertEqual(self.cache.get_many(self.mp3_files), ([], self.mp3_files))
+
+        # A new result for the changed file replaces the stale one
+        self.cache.put_many([self.get_result(self.mp3_files[0], gain=2)])
+        self.assertEqual(self.cache.get(self.mp3_files[0]), self.get_result(self.mp3_files[0], gain=2))
+
+    def test_invalidated_by_hash(self):
+        cache = AnalysisCache(os.path.join(self.directory.name, "hashed.db"), verify_hash=True)
+        mp3_file = self.mp3_files[0]
+        cache.put_many([self.get_result(mp3_file)])
+
+        # Same size and mtime, different contents
+        stat = os.stat(mp3_file)
+        self.make_file("0.mp3", b"DATA")
+        os.utime(mp3_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertEqual(cache.get_many([mp3_file]), ([], [mp3_file]))
+        cache.close()
+
+    def test_album(self):
+        results = [self.get_result(mp3_file) for mp3_file in self.mp3_files]
+        self.cache.put_album(self.mp3_files, results)
+
+        # The album key doesn't depend on the order of the files
+        self.assertEqual(self.cache.get_album(list(reversed(self.mp3_files))), results)
+        self.assertIsNone(self.cache.get_album(self.mp3_files[:2]))
+
+        self.make_file("1.mp3", b"changed")
+        self.assertIsNone(self.cache.get_album(self.mp3_files))
+
+    def test_frame_index(self):
+        mp3_file = self.make_file("frames.mp3", make_frames([100, 110]))
+        frame_index = FrameIndex.scan(make_frames([100, 110]))
+        self.cache.put_frame_index(mp3_file, frame_index)
+
+        self.assertEqual(self.cache.get_frame_index(mp3_file).offsets, frame_index.offsets)
+
+        self.make_file("frames.mp3", make_frames([100, 110, 120]))
+        self.assertIsNone(self.cache.get_frame_index(mp3_file))
+
+    def test_eviction(self):
+        cache = AnalysisCache(os.path.join(self.directory.name, "small.db"), max_entries=2)
+
+        for mp3_file in self.mp3_files:
+            cache.put_many([self.get_result(mp3_file)])
+
+        # The least recently used entry goes first
+        self.assertEqual(cache.get_many(self.mp3_files)[1], self.mp3_files[:1])
+        cache.close()
+
+    def test_clear(self):
+        self.cache.put_many([self.get_result(mp3_file) for mp3_file in self.mp3_files])
+        self.cache.clear()
+
+        self.assertEqual(self.cache.get_many(self.mp3_files), ([], self.mp3_files))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import queue
+import asyncio
+import tempfile
+import unittest
+
+from unittest import mock
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+
+from lib import MP3Gain, JobJournal  # noqa: E402
+from lib.AsyncMP3Gain import AsyncMP3Gain  # noqa: E402
+from lib.ChunkProgress import get_temp_file  # noqa: E402
+
+FAKE_MP3GAIN = os.path.join(os.path.dirname(TESTS_PATH), "benchmarks", "fake_mp3gain.py")
+NUM_FILES = 20
+CANCEL_AFTER = 5
+
+
+class TestCancel(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.mp3_files = []
+
+        for idx in range(NUM_FILES):
+            mp3_file = os.path.join(self.directory.name, "{:02d} Track.mp3".format(idx))
+            with open(mp3_file, "wb") as f:
+                f.write(b"\xff\xfb\x90\x64" * 1000)
+            self.mp3_files.append(mp3_file)
+
+        # Slow rewrites, so a cancel lands while mp3gain is writing a file
+        environment = {"PYMP3GAIN_FAKE_LATENCY": "0.01", "PYMP3GAIN_FAKE_WRITE_LATENCY": "0.05"}
+        self.environment = mock.patch.dict(os.environ, environment)
+        self.environment.start()
+
+        self.mp3gain = MP3Gain(mp3gain_bin=FAKE_MP3GAIN, max_files=NUM_FILES, max_processes=1, temp_files=True)
+
+    def tearDown(self):
+        self.mp3gain.shutdown()
+        self.environment.stop()
+        self.directory.cleanup()
+
+    def run_cancelled(self, job):
+        results = []
+
+        while len(results) < CANCEL_AFTER:
+            try:
+                results.append(job.get_result(timeout=5))
+            except queue.Empty:
+                self.fail("no results from mp3gain")
+
+        job.cancel()
+        self.assertTrue(job.wait(10))
+
+        return results + job.get_results()
+
+    def test_cancelled_apply_reports_written_files(self):
+        # The fake writes through a temporary file, a file it rewrote has a new inode
+        inodes = {mp3_file: os.stat(mp3_file).st_ino for mp3_file in self.mp3_files}
+
+        results = self.run_cancelled(self.mp3gain.set_volume(self.mp3_files, 92.0, False))
+
+        self.assertGreaterEqual(len(results), CANCEL_AFTER)
+        self.assertLess(len(results), NUM_FILES)
+
+        for result in results:
+            self.assertNotEqual(os.stat(result["File"]).st_ino, inodes[result["File"]], result["File"])
+
+        for mp3_file in self.mp3_files:
+            self.assertTrue(os.path.exists(mp3_file), mp3_file)
+            self.assertFalse(os.path.exists(get_temp_file(mp3_file)), mp3_file)
+
+    def test_cancelled_in_place_apply_finishes_batch(self):
+        # Files patched in place can't be cut off between files, the running batch is finished
+        self.mp3gain.set_temp_files(False)
+
+        results = self.run_cancelled(self.mp3gain.set_volume(self.mp3_files, 92.0, False))
+
+        self.assertEqual(sorted(result["File"] for result in results), self.mp3_files)
+
+    def test_cancelled_async_apply_reports_written_files(self):
+        inodes = {mp3_file: os.stat(mp3_file).st_ino for mp3_file in self.mp3_files}
+        async_mp3gain = AsyncMP3Gain(self.mp3gain)
+        results = []
+
+        async def consume(received):
+            async for result in async_mp3gain.stream(self.mp3_files, "apply", volume=92.0):
+                results.append(result)
+                if len(results) == CANCEL_AFTER:
+                    received.set()
+
+        async def run_cancelled():
+            received = asyncio.Event()
+            task = asyncio.ensure_future(consume(received))
+            await asyncio.wait_for(received.wait(), 5)
+
+            # stream() only returns once the cancelled mp3gain is stopped and cleaned up
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(run_cancelled())
+        async_mp3gain.close()
+
+        self.assertLess(len(results), NUM_FILES)
+
+        for result in results:
+            self.assertNotEqual(os.stat(result["File"]).st_ino, inodes[result["File"]], result["File"])
+
+        for mp3_file in self.mp3_files:
+            self.assertTrue(os.path.exists(mp3_file), mp3_file)
+            self.assertFalse(os.path.exists(get_temp_file(mp3_file)), mp3_file)
+
+    def test_journal_completes_written_files(self):
+        journal = JobJournal(os.path.join(self.directory.name, "journal.sqlite"))
+        self.mp3gain.set_journal(journal)
+
+        job = self.mp3gain.set_volume(self.mp3_files, 92.0, False)
+
+        # mp3gain is still writing the file it just reported
+        result = job.get_result(timeout=5)
+        entry = journal.get_job(job.journal_id)
+        self.assertIn(result["File"], entry["groups"]["all"])
+
+        results = [result] + self.run_cancelled(job)
+
+        # Every reported file was written, the one mp3gain was stopped at wasn't
+        entry = journal.get_job(job.journal_id)
+        reported = set(result["File"] for result in results)
+        self.assertEqual(set(entry["groups"].get("all", [])), set(self.mp3_files) - reported)
+
+        journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sys
+import unittest
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+
+from lib.FrameIndex import FrameIndex, read_byte_at_bit, write_byte_at_bit  # noqa: E402
+from frames import make_frames, get_reference_crc, HEADER, CRC_HEADER, MONO_HEADER  # noqa: E402
+
+GAINS = [0, 1, 100, 254, 255, 128]
+
+
+class TestFrameIndex(unittest.TestCase):
+    def test_scan(self):
+        for header, gains_per_frame in [(HEADER, 4), (CRC_HEADER, 4), (MONO_HEADER, 2)]:
+            frame_index = FrameIndex.scan(make_frames(GAINS, header))
+
+            self.assertEqual(len(frame_index), len(GAINS))
+            self.assertEqual(list(frame_index.headers), [header] * len(GAINS))
+            self.assertEqual(list(frame_index.gains), [gain for gain in GAINS for _ in range(gains_per_frame)])
+            self.assertEqual(frame_index.get_min_max(), (0, 255))
+
+    def test_scan_skips_leading_garbage(self):
+        data = bytearray(b"\x00\xff\x12" * 10) + make_frames(GAINS)
+        frame_index = FrameIndex.scan(data)
+
+        self.assertEqual(len(frame_index), len(GAINS))
+        self.assertEqual(frame_index.offsets[0], 30)
+
+    def test_serialization(self):
+        for header in [HEADER, CRC_HEADER, MONO_HEADER]:
+            frame_index = FrameIndex.scan(make_frames(GAINS, header))
+            loaded = FrameIndex.from_bytes(frame_index.to_bytes())
+
+            self.assertEqual(loaded.offsets, frame_index.offsets)
+            self.assertEqual(loaded.headers, frame_index.headers)
+            self.assertEqual(loaded.gains, frame_index.gains)
+
+        self.assertEqual(len(FrameIndex.from_bytes(FrameIndex().to_bytes())), 0)
+
+    def test_serialization_rejects_bad_data(self):
+        data = FrameIndex.scan(make_frames(GAINS)).to_bytes()
+
+        self.assertIsNone(FrameIndex.from_bytes(data[:10]))
+        self.assertIsNone(FrameIndex.from_bytes(b"XXXX" + data[4:]))
+        self.assertIsNone(FrameIndex.from_bytes(data[:-4]))
+
+    def test_change_gain_updates_crc(self):
+        data = make_frames(GAINS, CRC_HEADER)
+        frame_index = FrameIndex.scan(data)
+
+        frame_index.change_gain(data, 2, -3)
+
+        self.assertEqual(list(FrameIndex.scan(data).gains), list(frame_index.gains))
+        for pos in frame_index.offsets:
+            frame = data[pos:pos + 6 + 32]
+            self.assertEqual((frame[4] << 8) | frame[5], get_reference_crc(frame, CRC_HEADER))
+
+    def test_change_gain_saturates(self):
+        data = make_frames([0, 255])
+        frame_index = FrameIndex.scan(data)
+
+        frame_index.change_gain(data, 5, -5)
+
+        # Left channel up, right channel down, both clamped to 0-255
+        self.assertEqual(list(FrameIndex.scan(data).gains), [5, 0, 5, 0, 255, 250, 255, 250])
+
+    def test_change_gain_reads_current_gains(self):
+        data = make_frames([100, 100])
+        frame_index = FrameIndex.scan(data)
+
+        # Changed since the index was made, e.g. by mp3gain: the index's offsets still hold, its gains don't
+        for _, _, bit_pos in frame_index.iter_gain_positions():
+            write_byte_at_bit(data, bit_pos, 110)
+
+        frame_index.change_gain(data, 5, 5)
+
+        for _, _, bit_pos in frame_index.iter_gain_positions():
+            self.assertEqual(read_byte_at_bit(data, bit_pos), 115)
+        self.assertEqual(frame_index.get_min_max(), (115, 115))
+
+    def test_change_gain_refuses_moved_frames(self):
+        frame_index = FrameIndex.scan(make_frames(GAINS))
+        data = bytearray(b"\x00") + make_frames(GAINS)
+        original = bytes(data)
+
+        with self.assertRaises(ValueError):
+            frame_index.change_gain(data, 1, 1)
+
+        self.assertEqual(bytes(data), original)
+
+
+if __name__ == "__main__":
+    unittest.main()
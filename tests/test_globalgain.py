@@ -0,0 +1,127 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+
+from lib.tags import read_tags, write_ape_tags  # noqa: E402
+from lib.FrameIndex import FrameIndex  # noqa: E402
+from lib.globalgain import apply_gain_files, undo_gain_files, UNDO_TAG  # noqa: E402
+from lib.ChunkProgress import get_temp_file  # noqa: E402
+from frames import make_frames, get_reference_crc, HEADER, CRC_HEADER  # noqa: E402
+
+GAINS = [120, 140, 160, 150]
+
+
+class TestGlobalGain(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_mp3(self, gains, header=HEADER, db_gain=15.05):
+        # 15.05 dB is a change of +10 global_gain steps
+        mp3_file = os.path.join(self.directory.name, "Track.mp3")
+        with open(mp3_file, "wb") as f:
+            f.write(make_frames(gains, header))
+
+        write_ape_tags(mp3_file, {"REPLAYGAIN_TRACK_GAIN": "{:+f} dB".format(db_gain),
+                                  "REPLAYGAIN_TRACK_PEAK": "0.500000"})
+
+        return mp3_file
+
+    def get_frame_data(self, mp3_file, num_frames):
+        with open(mp3_file, "rb") as f:
+            data = f.read()
+
+        return data[:len(make_frames([0] * num_frames))]
+
+    def test_apply_and_undo(self):
+        for header in [HEADER, CRC_HEADER]:
+            mp3_file = self.make_mp3(GAINS, header)
+            original = self.get_frame_data(mp3_file, len(GAINS))
+
+            results, fallback_files = apply_gain_files([mp3_file], 0)
+
+            self.assertEqual(fallback_files, [])
+            self.assertEqual(results[0]["MP3 gain"], 10)
+            self.assertEqual((results[0]["Min global_gain"], results[0]["Max global_gain"]), (120, 160))
+
+            data = self.get_frame_data(mp3_file, len(GAINS))
+            frame_index = FrameIndex.scan(data)
+            self.assertEqual(frame_index.get_min_max(), (130, 170))
+
+            tags = read_tags(mp3_file)
+            self.assertEqual(tags[UNDO_TAG], "+010,+010,N")
+            self.assertEqual(tags["MP3GAIN_MINMAX"], "130,170")
+
+            if header == CRC_HEADER:
+                for pos in frame_index.offsets:
+                    frame = data[pos:pos + 38]
+                    self.assertEqual((frame[4] << 8) | frame[5], get_reference_crc(frame, header))
+
+            results, fallback_files = undo_gain_files([mp3_file])
+
+            self.assertEqual(fallback_files, [])
+            self.assertEqual(results[0]["left global_gain change"], "-10")
+            self.assertEqual(self.get_frame_data(mp3_file, len(GAINS)), original)
+            self.assertNotIn(UNDO_TAG, read_tags(mp3_file))
+
+    def test_change_is_reduced_to_fit(self):
+        # +10 would take 250 past 255, only +5 is applied and recorded
+        mp3_file = self.make_mp3([200, 250])
+        original = self.get_frame_data(mp3_file, 2)
+
+        results, _ = apply_gain_files([mp3_file], 0)
+
+        self.assertEqual(results[0]["MP3 gain"], 5)
+        self.assertEqual(FrameIndex.scan(self.get_frame_data(mp3_file, 2)).get_min_max(), (205, 255))
+        self.assertEqual(read_tags(mp3_file)[UNDO_TAG], "+005,+005,N")
+
+        undo_gain_files([mp3_file])
+        self.assertEqual(self.get_frame_data(mp3_file, 2), original)
+
+    def test_change_is_reduced_to_fit_at_zero(self):
+        mp3_file = self.make_mp3([0, 3], db_gain=-15.05)
+        original = self.get_frame_data(mp3_file, 2)
+
+        results, _ = apply_gain_files([mp3_file], 0)
+
+        self.assertEqual(results[0]["MP3 gain"], 0)
+        self.assertEqual(self.get_frame_data(mp3_file, 2), original)
+        self.assertNotIn(UNDO_TAG, read_tags(mp3_file))
+
+    def test_interrupted_apply_leaves_file_unchanged(self):
+        mp3_file = self.make_mp3(GAINS)
+        with open(mp3_file, "rb") as f:
+            original = f.read()
+
+        # Frames are changed, writing the tags fails: the file itself hasn't been touched
+        with mock.patch("lib.globalgain.write_ape_tags", side_effect=OSError):
+            self.assertEqual(apply_gain_files([mp3_file], 0), ([], [mp3_file]))
+
+        with open(mp3_file, "rb") as f:
+            self.assertEqual(f.read(), original)
+        self.assertFalse(os.path.exists(get_temp_file(mp3_file)))
+
+    def test_hard_linked_file_falls_back(self):
+        mp3_file = self.make_mp3(GAINS)
+        os.link(mp3_file, os.path.join(self.directory.name, "Link.mp3"))
+
+        self.assertEqual(apply_gain_files([mp3_file], 0), ([], [mp3_file]))
+
+    def test_untagged_file_falls_back(self):
+        mp3_file = os.path.join(self.directory.name, "Untagged.mp3")
+        with open(mp3_file, "wb") as f:
+            f.write(make_frames(GAINS))
+
+        self.assertEqual(apply_gain_files([mp3_file], 0), ([], [mp3_file]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import tempfile
+import unittest
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+
+from lib import MP3Gain, JobJournal  # noqa: E402
+from lib.tags import write_ape_tags  # noqa: E402
+
+FAKE_MP3GAIN = os.path.join(os.path.dirname(TESTS_PATH), "benchmarks", "fake_mp3gain.py")
+NUM_FILES = 6
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal_file = os.path.join(self.directory.name, "journal", "jobs.sqlite")
+        self.journal = JobJournal(self.journal_file)
+        self.mp3_files = []
+
+        for idx in range(NUM_FILES):
+            mp3_file = os.path.join(self.directory.name, "{:02d} Track.mp3".format(idx))
+            with open(mp3_file, "wb") as f:
+                f.write(b"\xff\xfb\x90\x64" * 100)
+            self.mp3_files.append(mp3_file)
+
+        self.groups = {"A": self.mp3_files[:3], "B": self.mp3_files[3:]}
+
+    def tearDown(self):
+        self.journal.close()
+        self.directory.cleanup()
+
+    def test_job_states(self):
+        job_id = self.journal.create_job("apply", {"volume": 92.0, "use_album_gain": False}, self.groups)
+
+        self.journal.start_files(job_id, self.mp3_files[:4])
+        self.journal.complete_files(job_id, self.mp3_files[:2])
+
+        jobs = self.journal.get_unfinished_jobs()
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual((jobs[0]["job_id"], jobs[0]["operation"], jobs[0]["interrupted"]), (job_id, "apply", True))
+        self.assertEqual((jobs[0]["total"], jobs[0]["started"], jobs[0]["completed"]), (NUM_FILES, 2, 2))
+
+        entry = self.journal.get_job(job_id)
+        self.assertEqual(entry["params"], {"volume": 92.0, "use_album_gain": False})
+        self.assertEqual(entry["groups"], {"A": self.mp3_files[2:3], "B": self.mp3_files[3:]})
+        self.assertEqual(entry["all_groups"], self.groups)
+        self.assertEqual(entry["partial_groups"], ["A"])
+
+        # A job that ends with files left stays resumable, but isn't interrupted
+        self.journal.finish_job(job_id)
+        self.assertFalse(self.journal.get_unfinished_jobs()[0]["interrupted"])
+
+        self.journal.complete_files(job_id, self.mp3_files[2:])
+        self.journal.finish_job(job_id)
+        self.assertEqual(self.journal.get_unfinished_jobs(), [])
+        self.assertIsNone(self.journal.get_job(job_id))
+
+    def test_batched_completions_survive_close(self):
+        job_id = self.journal.create_job("undo", {}, self.groups)
+        self.journal.complete_files(job_id, self.mp3_files[:1])
+        self.journal.complete_files(job_id, self.mp3_files[1:2], flush=False)
+        self.journal.close()
+
+        self.journal = JobJournal(self.journal_file)
+        self.assertEqual(self.journal.get_unfinished_jobs()[0]["completed"], 2)
+
+    def get_mp3gain(self):
+        mp3gain = MP3Gain(mp3gain_bin=FAKE_MP3GAIN, max_files=2, max_processes=1)
+        mp3gain.set_journal(self.journal)
+
+        return mp3gain
+
+    def resume(self, job_id):
+        mp3gain = self.get_mp3gain()
+        job = mp3gain.resume_job(job_id)
+        self.assertTrue(job.wait(10))
+        results = job.get_results()
+        mp3gain.shutdown()
+
+        return sorted(result["File"] for result in results)
+
+    def test_resume_track_apply(self):
+        job_id = self.journal.create_job("apply", {"volume": 92.0, "use_album_gain": False}, self.groups)
+        self.journal.start_files(job_id, self.mp3_files[:2])
+        self.journal.complete_files(job_id, self.mp3_files[:1])
+
+        # Already at the target volume, e.g. changed just before the job stopped: skipped, but completed
+        write_ape_tags(self.mp3_files[1], {"REPLAYGAIN_TRACK_GAIN": "-3.000000 dB"})
+
+        self.assertEqual(self.resume(job_id), self.mp3_files[2:])
+        self.assertEqual(self.journal.get_unfinished_jobs(), [])
+
+    def test_resume_album_apply_reapplies_partial_albums(self):
+        job_id = self.journal.create_job("apply", {"volume": 92.0, "use_album_gain": True}, self.groups)
+        self.journal.complete_files(job_id, self.mp3_files[:1])
+
+        self.assertEqual(self.resume(job_id), self.mp3_files)
+        self.assertEqual(self.journal.get_unfinished_jobs(), [])
+
+    def test_resume_undo(self):
+        job_id = self.journal.create_job("undo", {}, self.groups)
+        self.journal.complete_files(job_id, self.mp3_files[:4])
+
+        self.assertEqual(self.resume(job_id), self.mp3_files[4:])
+        self.assertEqual(self.journal.get_unfinished_jobs(), [])
+
+    def test_resume_unknown_job(self):
+        mp3gain = self.get_mp3gain()
+
+        self.assertIsNone(mp3gain.resume_job(1000))
+
+        job_id = self.journal.create_job("analyze", {}, self.groups)
+        with self.assertRaises(ValueError):
+            mp3gain.resume_job(job_id)
+
+        mp3gain.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
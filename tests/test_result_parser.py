@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+
+from lib.ResultParser import ResultParser, parse_output  # noqa: E402
+
+ANALYSIS_HEADER = "File\tMP3 gain\tdB gain\tMax Amplitude\tMax global_gain\tMin global_gain\n"
+ALBUM_HEADER = "File\tMP3 gain\tdB gain\tMax Amplitude\tMax global_gain\tMin global_gain\tAlbum gain\tAlbum dB gain\t" \
+               "Album Max Amplitude\tAlbum Max global_gain\tAlbum Min global_gain\n"
+APPLY_HEADER = "File\tMP3 gain\tdB gain\tMax Amplitude\tMax global_gain\tMin global_gain\tleft global_gain change\n"
+
+
+class TestResultParser(unittest.TestCase):
+    def test_analysis_line(self):
+        parser = ResultParser(ANALYSIS_HEADER)
+        result = parser.parse_line("a.mp3\t-3\t-4.600000\t25000.5\t210\t120\n")
+
+        self.assertEqual(result.as_dict(), {"tag_exists": True, "File": "a.mp3", "MP3 gain": -3, "dB gain": -4.6,
+                                            "Max Amplitude": 25000.5, "Max global_gain": 210,
+                                            "Min global_gain": 120})
+
+    def test_status_lines(self):
+        # mp3gain interleaves status lines with the results while it writes
+        parser = ResultParser(APPLY_HEADER)
+
+        for line in ["Applying mp3 gain change of -3 to a.mp3...\n", "No changes to undo in a.mp3\n", "\n",
+                     "Done\twith\tit\n"]:
+            self.assertIsNone(parser.parse_line(line))
+
+        result = parser.parse_line("a.mp3\t-3\t-4.600000\t25000.5\t210\t120\t-3\n")
+        self.assertEqual(result.file, "a.mp3")
+        self.assertEqual(result.extra, {"left global_gain change": "-3"})
+
+    def test_album_line(self):
+        parser = ResultParser(ALBUM_HEADER)
+
+        self.assertIsNone(parser.parse_line("\"Album\"\t-2\t-3.000000\t30000.0\t210\t100\t-2\t-3.000000\t30000.0\t"
+                                            "210\t100\n"))
+
+        result = parser.parse_line("a.mp3\t-3\t-4.600000\t25000.5\t210\t120\t-2\t-3.000000\t30000.0\t210\t100\n")
+        self.assertEqual((result.album_gain, result.album_db_gain, result.album_min_global_gain), (-2, -3.0, 100))
+
+    def test_na_and_tabs_in_file_name(self):
+        parser = ResultParser(ANALYSIS_HEADER)
+
+        # Files without a stored analysis report NA, which leaves the columns unset
+        result = parser.parse_line("a\tb.mp3\tNA\tNA\tNA\tNA\tNA\n")
+
+        self.assertEqual(result.file, "a\tb.mp3")
+        self.assertEqual(result.as_dict(), {"tag_exists": False, "File": "a\tb.mp3"})
+
+    def test_parse_output(self):
+        output = ANALYSIS_HEADER + "a.mp3\t-3\t-4.600000\t25000.5\t210\t120\n" + \
+            "b.mp3\t1\t1.500000\tnot a number\t210\t120\n" + "c.mp3\t0\t0.000000\t100.0\t200\t100\n"
+
+        self.assertEqual([result.file for result in parse_output(output)], ["a.mp3", "c.mp3"])
+        self.assertEqual(parse_output(""), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
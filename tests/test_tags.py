@@ -0,0 +1,110 @@
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+
+from lib.tags import read_tags, write_ape_tags, get_stored_analysis  # noqa: E402
+from frames import make_frames  # noqa: E402
+
+ID3V1_TAG = b"TAG" + b"Title".ljust(125, b"\x00")
+
+
+def get_syncsafe(value):
+    return bytes([(value >> shift) & 0x7f for shift in (21, 14, 7, 0)])
+
+
+def make_id3v2(frames, major):
+    # An ID3v2 tag holding the given TXXX frames, each a (encoding, description, value) tuple
+    data = b""
+    for encoding, description, value in frames:
+        if encoding == 1:
+            text = description.encode("utf-16") + b"\x00\x00" + value.encode("utf-16")
+        else:
+            text = description.encode("latin-1") + b"\x00" + value.encode("latin-1")
+
+        content = bytes([encoding]) + text
+        size = get_syncsafe(len(content)) if major == 4 else struct.pack(">I", len(content))
+        data = data + b"TXXX" + size + b"\x00\x00" + content
+
+    return b"ID3" + bytes([major, 0, 0]) + get_syncsafe(len(data)) + data
+
+
+class TestTags(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_mp3(self, prefix=b"", suffix=b""):
+        mp3_file = os.path.join(self.directory.name, "Track.mp3")
+        with open(mp3_file, "wb") as f:
+            f.write(prefix + make_frames([100, 100]) + suffix)
+
+        return mp3_file
+
+    def read_data(self, mp3_file):
+        with open(mp3_file, "rb") as f:
+            return f.read()
+
+    def test_ape_round_trip(self):
+        # The APE tag goes in front of a trailing ID3v1 tag, which is kept
+        mp3_file = self.make_mp3(suffix=ID3V1_TAG)
+        original = self.read_data(mp3_file)
+
+        write_ape_tags(mp3_file, {"REPLAYGAIN_TRACK_GAIN": "-2.500000 dB", "MP3GAIN_MINMAX": "090,110"})
+        self.assertEqual(read_tags(mp3_file), {"REPLAYGAIN_TRACK_GAIN": "-2.500000 dB", "MP3GAIN_MINMAX": "090,110"})
+
+        data = self.read_data(mp3_file)
+        self.assertTrue(data.startswith(original[:-len(ID3V1_TAG)]))
+        self.assertTrue(data.endswith(ID3V1_TAG))
+
+        write_ape_tags(mp3_file, {"MP3GAIN_MINMAX": "095,115"}, remove=["replaygain_track_gain"])
+        self.assertEqual(read_tags(mp3_file), {"MP3GAIN_MINMAX": "095,115"})
+
+        # Removing the last item removes the whole tag
+        write_ape_tags(mp3_file, {}, remove=["MP3GAIN_MINMAX"])
+        self.assertEqual(self.read_data(mp3_file), original)
+
+    def test_id3v2_txxx(self):
+        frames = [(0, "replaygain_track_gain", "+1.000000 dB"), (1, "REPLAYGAIN_TRACK_PEAK", "0.250000")]
+
+        for major in [3, 4]:
+            mp3_file = self.make_mp3(prefix=make_id3v2(frames, major))
+
+            self.assertEqual(read_tags(mp3_file), {"REPLAYGAIN_TRACK_GAIN": "+1.000000 dB",
+                                                   "REPLAYGAIN_TRACK_PEAK": "0.250000"})
+
+            # APE items win over ID3v2 frames with the same description
+            write_ape_tags(mp3_file, {"REPLAYGAIN_TRACK_GAIN": "+2.000000 dB"})
+            self.assertEqual(read_tags(mp3_file)["REPLAYGAIN_TRACK_GAIN"], "+2.000000 dB")
+
+    def test_stored_analysis(self):
+        mp3_file = self.make_mp3()
+        write_ape_tags(mp3_file, {"REPLAYGAIN_TRACK_GAIN": "+15.050000 dB", "REPLAYGAIN_TRACK_PEAK": "0.500000",
+                                  "REPLAYGAIN_ALBUM_GAIN": "-3.010000 dB", "MP3GAIN_MINMAX": "090,110"})
+
+        analysis = get_stored_analysis(mp3_file)
+
+        self.assertTrue(analysis["tag_exists"])
+        self.assertEqual(analysis["MP3 gain"], 10)
+        self.assertEqual(analysis["dB gain"], 15.05)
+        self.assertEqual(analysis["Max Amplitude"], 16384.0)
+        self.assertEqual(analysis["Album gain"], -2)
+        self.assertEqual((analysis["Min global_gain"], analysis["Max global_gain"]), (90, 110))
+        self.assertNotIn("Album Max Amplitude", analysis)
+
+    def test_stored_analysis_without_tags(self):
+        analysis = get_stored_analysis(self.make_mp3())
+        self.assertEqual(analysis, {"File": analysis["File"], "tag_exists": False})
+
+        analysis = get_stored_analysis(os.path.join(self.directory.name, "Missing.mp3"))
+        self.assertFalse(analysis["tag_exists"])
+
+
+if __name__ == "__main__":
+    unittest.main()